@@ -0,0 +1,54 @@
+"""Measures how long importing the modules of yourtube takes, and which imports are the heaviest.
+
+It runs each import in a new process with `python -X importtime`, so that nothing is cached.
+YourTube.py isn't measured, because it starts the app when imported.
+
+Run with: poetry run python benchmarks/bench_importtime.py [num_of_heaviest]
+"""
+import subprocess
+import sys
+
+modules = [
+    "yourtube",
+    "yourtube.file_operations",
+    "yourtube.scraping",
+    "yourtube.html_components",
+    "yourtube.recommendation",
+]
+
+
+def measure_import(module):
+    """Returns the total import time of the module, and the self times of all the imports,
+    in seconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    self_times = dict()
+    total = 0
+    # lines look like: "import time:       123 |        456 |   some.module"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        self_times[name.strip()] = int(self_us) / 1e6
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+    return total, self_times
+
+
+def main():
+    num_of_heaviest = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for module in modules:
+        total, self_times = measure_import(module)
+        print(f"{module}: {total:.3f} s")
+        heaviest = sorted(self_times.items(), key=lambda item: item[1], reverse=True)
+        for name, self_time in heaviest[:num_of_heaviest]:
+            print(f"    {self_time:.3f} s  {name}")
+
+
+if __name__ == "__main__":
+    main()
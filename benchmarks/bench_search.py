@@ -0,0 +1,75 @@
+"""Measures building the search index and query latency on synthetic titles and keywords.
+
+Run with: poetry run python benchmarks/bench_search.py [num_of_videos] [tree_size]
+"""
+import string
+import sys
+import tempfile
+from pathlib import Path
+from time import time
+
+import networkx as nx
+import numpy as np
+
+from yourtube import file_operations
+from yourtube.search import SearchIndex
+
+
+def create_synthetic_graph(num_of_videos, vocabulary_size=30_000, seed=0):
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_lowercase))
+    words = ["".join(rng.choice(letters, size=rng.integers(3, 10))) for _ in range(vocabulary_size)]
+    # word frequencies follow Zipf's law, so the first words are in most of the titles
+    words[:8] = ["music", "live", "official", "video", "the", "of", "remix", "cover"]
+    words = np.array(words, dtype=object)
+    probabilities = 1 / np.arange(1, vocabulary_size + 1)
+    probabilities /= probabilities.sum()
+    word_indexes = rng.choice(vocabulary_size, size=(num_of_videos, 13), p=probabilities)
+
+    G = nx.DiGraph()
+    for i, indexes in enumerate(word_indexes):
+        G.add_node(
+            f"{i:011d}", title=" ".join(words[indexes[:8]]), keywords=list(words[indexes[8:]])
+        )
+    return G, words
+
+
+def main(num_of_videos=1_000_000, tree_size=5000):
+    G, words = create_synthetic_graph(num_of_videos)
+    queries = [
+        "music",
+        "official video",
+        "the music live",
+        "remix cover",
+        words[500],
+        words[20_000],
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # don't import the real transcripts
+        file_operations.transcripts_path = str(Path(directory) / "transcripts.json")
+        file_operations.transcripts_db_path = str(Path(directory) / "transcripts.sqlite")
+        with SearchIndex(Path(directory) / "search_index.sqlite") as index:
+            start_time = time()
+            index.add_videos_from_nodes(list(G.nodes(data=True)))
+            print(f"indexing {num_of_videos} videos: {time() - start_time:.3f} seconds")
+
+            for query in queries:
+                start_time = time()
+                results = index.search(query)
+                print(f"{query!r}: {len(results)} results in {(time() - start_time) * 1000:.1f} ms")
+
+            # a user's tree has a small part of all the videos, like the branch index
+            rng = np.random.default_rng(1)
+            tree_ids = dict.fromkeys(
+                rng.choice(list(G.nodes), size=min(tree_size, num_of_videos), replace=False)
+            )
+            print(f"\nsearching in a tree of {len(tree_ids)} videos:")
+            for query in queries:
+                start_time = time()
+                results = index.search(query, video_ids=tree_ids)
+                print(f"{query!r}: {len(results)} results in {(time() - start_time) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
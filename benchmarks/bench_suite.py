@@ -0,0 +1,155 @@
+"""Times the hot paths of the app on synthetic data, and prints the results as JSON.
+
+Each step is run a few times, on cold caches, and the fastest and the median times are reported,
+so that the results of different commits can be compared to find regressions.
+
+Run with: poetry run python benchmarks/bench_suite.py [num_of_videos] [repeats] > results.json
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import networkx as nx
+
+from synthetic import (
+    StubDriver,
+    create_synthetic_graph,
+    load_watch_pages,
+    redirect_data_path,
+    write_synthetic_takeout,
+    write_watch_pages,
+)
+from yourtube import file_operations, recommendation
+from yourtube.filtering_functions import select_nodes_to_cluster
+from yourtube.recommendation import Recommender, TreeClimber, cluster_subgraph
+from yourtube.scraping import scrape_content
+
+username = "benchmark"
+
+
+def measure(name, fn, repeats, setup=lambda: None):
+    """Runs setup and then fn, repeats times, and returns the timings of fn and its last result."""
+    times = []
+    for _ in range(repeats):
+        setup()
+        start_time = perf_counter()
+        result = fn()
+        times.append(perf_counter() - start_time)
+    print(f"{name}: {min(times):.4f} s", file=sys.stderr)
+    return dict(min=min(times), median=statistics.median(times), repeats=repeats), result
+
+
+def navigate(climber, tree):
+    """Goes down the first columns to the lowest cluster, and back up to the root."""
+    climber.reset(tree)
+    while climber.choose_column(0) == 0:
+        pass
+    while climber.go_back() == 0:
+        pass
+    return climber.branch_id
+
+
+def main(num_of_videos=20_000, repeats=3):
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        redirect_data_path(directory)
+
+        G = create_synthetic_graph(num_of_videos)
+        write_synthetic_takeout(file_operations.takeouts_template.format(username), G)
+        scraped_ids = [id_ for id_, data in G.nodes(data=True) if "title" in data]
+        pages_dir = Path(directory) / "pages"
+        write_watch_pages(pages_dir, G, scraped_ids[:100])
+        pages = load_watch_pages(pages_dir)
+        driver = StubDriver(G)
+
+        def clear_parsed_takeout():
+            file_operations._parsed_takeouts.clear()
+            Path(file_operations.takeout_cache_template.format(username)).unlink(missing_ok=True)
+
+        results["parse_takeout"], _ = measure(
+            "parse_takeout",
+            lambda: file_operations.get_parsed_takeout(username),
+            repeats,
+            setup=clear_parsed_takeout,
+        )
+
+        def clear_graph_cache():
+            Path(file_operations.graph_path_template.format(username)).unlink(missing_ok=True)
+
+        Path(file_operations.graph_path_template).parent.mkdir(parents=True, exist_ok=True)
+        results["load_graph_from_neo4j"], loaded_G = measure(
+            "load_graph_from_neo4j",
+            lambda: file_operations.load_graph_from_neo4j(driver, username),
+            repeats,
+            setup=clear_graph_cache,
+        )
+
+        results["select_nodes_to_cluster"], (_, nodes_to_cluster) = measure(
+            "select_nodes_to_cluster", lambda: select_nodes_to_cluster(loaded_G), repeats
+        )
+
+        def clear_clustering_cache():
+            shutil.rmtree(Path(recommendation.clustering_cache_template).parent, ignore_errors=True)
+            Path(recommendation.clustering_cache_template).parent.mkdir(parents=True)
+
+        results["cluster_subgraph"], (tree, _, _) = measure(
+            "cluster_subgraph",
+            lambda: cluster_subgraph(nodes_to_cluster, loaded_G, 1.7, 1, create_image=False),
+            repeats,
+            setup=clear_clustering_cache,
+        )
+
+        video_ids = tree.pre_order()
+        recommender = Recommender(loaded_G, seed=1)
+        results["compute_node_ranks"], _ = measure(
+            "compute_node_ranks", lambda: recommender.compute_node_ranks(video_ids), repeats
+        )
+
+        climber = TreeClimber(num_of_groups=3, videos_in_group=5)
+        climber.reset(tree)
+        wall_parameters = dict(hide_watched=True, exploration=0.1)
+        results["build_wall"], _ = measure(
+            "build_wall",
+            lambda: recommender.build_wall(climber.grandchildren, wall_parameters),
+            repeats,
+        )
+
+        results["tree_climber_navigation"], _ = measure(
+            "tree_climber_navigation", lambda: navigate(climber, tree), repeats
+        )
+        results["compute_branch_index"], _ = measure(
+            "compute_branch_index", climber.compute_branch_index, repeats
+        )
+
+        def parse_pages():
+            parsed_G = nx.DiGraph()
+            for id_, page in pages.items():
+                scrape_content(page, id_, parsed_G)
+            return parsed_G
+
+        results["parse_watch_pages"], _ = measure("parse_watch_pages", parse_pages, repeats)
+        results["parse_watch_pages"]["pages"] = len(pages)
+
+    report = dict(
+        parameters=dict(
+            num_of_videos=num_of_videos,
+            num_of_edges=G.number_of_edges(),
+            num_of_clustered_videos=len(video_ids),
+            repeats=repeats,
+        ),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        results=results,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
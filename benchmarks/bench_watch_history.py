@@ -0,0 +1,75 @@
+"""Compares the watch history parser with the previous regex + dateutil implementation.
+
+Run with: poetry run python benchmarks/bench_watch_history.py [num_of_entries]
+"""
+import random
+import re
+import sys
+import tempfile
+from time import mktime, time
+
+from dateutil import parser
+
+from synthetic import html_entry, html_footer, html_header, month_names
+from yourtube.file_operations import parse_watch_history
+
+
+def write_synthetic_history(file, num_of_entries, num_of_videos=None, seed=0):
+    rng = random.Random(seed)
+    num_of_videos = num_of_videos or num_of_entries // 2
+    ids = [f"{i:011d}" for i in range(num_of_videos)]
+    file.write(html_header)
+    for i in range(num_of_entries):
+        # entries are sorted from the newest, around 30 entries per day
+        day = i // 30
+        year, month, day = 2022 - day // 336, 12 - day // 28 % 12, 28 - day % 28
+        hour, minute, second = rng.randrange(1, 13), rng.randrange(60), rng.randrange(60)
+        am_pm = rng.choice(["AM", "PM"])
+        timestamp = (
+            f"{month_names[month - 1]} {day}, {year}, {hour}:{minute:02}:{second:02} {am_pm} CET"
+        )
+        file.write(html_entry.format(id_=rng.choice(ids), timestamp=timestamp))
+    file.write(html_footer)
+
+
+def legacy_get_youtube_watched_ids(history_path):
+    with open(history_path, encoding="utf-8") as file:
+        lines = file.readlines()
+    text = " ".join(lines)
+
+    watched = re.findall(
+        r"Watched.*?https://www.youtube.com\/watch\?v=(.{11}).*?<br>((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) .*?)</div>",
+        text,
+    )
+
+    ids, timestamps, _ = zip(*watched)
+    unixtimes = [mktime(parser.parse(timestamp).utctimetuple()) for timestamp in timestamps]
+
+    id_to_watched_times = dict()
+    for id_, watched_time in zip(ids, unixtimes):
+        id_to_watched_times.setdefault(id_, []).append(watched_time)
+    return id_to_watched_times
+
+
+def main(num_of_entries=200_000):
+    with tempfile.NamedTemporaryFile("w", suffix=".html", encoding="utf-8") as file:
+        write_synthetic_history(file, num_of_entries)
+        file.flush()
+
+        start_time = time()
+        legacy_result = legacy_get_youtube_watched_ids(file.name)
+        legacy_time = time() - start_time
+
+        start_time = time()
+        result = parse_watch_history(file.name)
+        new_time = time() - start_time
+
+    assert result == legacy_result
+    print(f"entries: {num_of_entries}, videos: {len(result)}")
+    print(f"previous parser: {legacy_time:.3f} seconds")
+    print(f"streaming parser: {new_time:.3f} seconds")
+    print(f"speedup: {legacy_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,307 @@
+"""Generates synthetic data for benchmarks: graphs, takeouts, saved watch pages and a stub driver.
+
+Graphs look like the ones loaded from neo4j: videos from playlists (and watched ones) are scraped,
+and recommend videos mostly from their own topic, so that clustering finds these topics.
+"""
+import json
+import os
+import string
+import sys
+from pathlib import Path
+from time import gmtime, strftime, time
+
+import networkx as nx
+import numpy as np
+
+seconds_in_year = 60 * 60 * 24 * 365
+
+html_header = '<html><head><title>Watch history</title></head><body><div class="mdl-grid">'
+html_entry = (
+    '<div class="outer-cell mdl-cell mdl-cell--12-col mdl-shadow--2dp"><div class="mdl-grid">'
+    '<div class="header-cell mdl-cell mdl-cell--12-col"><p class="mdl-typography--title">YouTube'
+    '<br></p></div><div class="content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1">'
+    'Watched\xa0<a href="https://www.youtube.com/watch?v={id_}">Video {id_}</a><br>'
+    '<a href="https://www.youtube.com/channel/UC{id_}">Channel</a><br>{timestamp}</div>'
+    '<div class="content-cell mdl-cell mdl-cell--6-col mdl-typography--body-1 mdl-typography--text-right">'
+    "</div></div></div>"
+)
+html_footer = "</div></body></html>"
+month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+playlist_names = ["Liked videos", "Watch later", "Music", "Lectures", "Favorites"]
+
+
+def create_vocabulary(rng, vocabulary_size):
+    letters = np.array(list(string.ascii_lowercase))
+    words = ["".join(rng.choice(letters, size=rng.integers(3, 10))) for _ in range(vocabulary_size)]
+    return np.array(words, dtype=object)
+
+
+def create_synthetic_graph(
+    num_of_videos,
+    num_of_sources=None,
+    num_of_topics=None,
+    recommendations_per_video=20,
+    topic_locality=0.85,
+    watched_fraction=0.3,
+    down_fraction=0.02,
+    seed=0,
+):
+    """Returns a DiGraph with attributes like the ones of a graph loaded from neo4j.
+
+    Sources are the videos from playlists. They are scraped, so they have titles, keywords
+    and recommendations. A topic_locality fraction of recommendations is from the same topic.
+    """
+    rng = np.random.default_rng(seed)
+    num_of_sources = num_of_sources or num_of_videos // 10
+    num_of_topics = num_of_topics or max(1, num_of_videos // 500)
+    ids = np.array([f"{i:011d}" for i in range(num_of_videos)], dtype=object)
+    topics = rng.integers(num_of_topics, size=num_of_videos)
+    videos_of_topic = [np.flatnonzero(topics == topic) for topic in range(num_of_topics)]
+    # some videos are recommended much more often than others
+    popularity = 1 / np.arange(1, num_of_videos + 1) ** 0.8
+    popularity = rng.permutation(popularity / popularity.sum())
+
+    words = create_vocabulary(rng, 20_000)
+    topic_words = rng.choice(len(words), size=(num_of_topics, 30))
+
+    G = nx.DiGraph()
+    G.add_nodes_from(ids)
+    sources = rng.choice(num_of_videos, size=num_of_sources, replace=False)
+    now = time()
+    for source in sources:
+        id_ = ids[source]
+        node = G.nodes[id_]
+        if rng.random() < down_fraction:
+            node["is_down"] = True
+            continue
+        topic = topics[source]
+        title_words = words[rng.choice(topic_words[topic], size=rng.integers(3, 9))]
+        node["title"] = " ".join(title_words)
+        node["keywords"] = list(words[rng.choice(topic_words[topic], size=5)])
+        node["like_count"] = int(rng.pareto(1.2) * 100)
+        node["time_scraped"] = now - rng.uniform(0, 30) * 60 * 60 * 24
+        node["is_down"] = False
+        node["from"] = playlist_names[rng.integers(len(playlist_names))]
+        node["time_added"] = float(int(now - rng.uniform(0, 3) * seconds_in_year))
+
+        num_of_local = rng.binomial(recommendations_per_video, topic_locality)
+        local = rng.choice(videos_of_topic[topic], size=num_of_local)
+        other = rng.choice(
+            num_of_videos, size=recommendations_per_video - num_of_local, p=popularity
+        )
+        G.add_edges_from((id_, ids[rec]) for rec in np.concatenate([local, other]) if rec != source)
+
+    # watched videos are mostly the ones from playlists, and some recommended ones
+    watched = set(rng.choice(sources, size=int(len(sources) * watched_fraction), replace=False))
+    watched.update(rng.choice(num_of_videos, size=int(len(sources) * watched_fraction / 3)))
+    for index in range(num_of_videos):
+        G.nodes[ids[index]]["watched"] = index in watched
+    return G
+
+
+def graph_to_neo4j_rows(G):
+    """Returns the rows which neo4j returns for the queries of load_graph_from_neo4j.
+
+    It's (video_rows, playlist_rows), where a video row describes a pair of a playlist video
+    and a video it recommends.
+    """
+    fields = ["title", "view_count", "like_count", "time_scraped", "is_down"]
+    video_rows = []
+    for v1, v2 in G.edges:
+        v1_data = G.nodes[v1]
+        v2_data = G.nodes[v2]
+        video_rows.append(
+            [v1, *(v1_data.get(field) for field in fields)]
+            + [v2, *(v2_data.get(field) for field in fields)]
+        )
+    playlist_rows = [
+        [data["from"], id_, data["time_added"]]
+        for id_, data in G.nodes(data=True)
+        if "from" in data
+    ]
+    return video_rows, playlist_rows
+
+
+class StubResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def values(self):
+        return self.rows
+
+
+class StubTransaction:
+    def __init__(self, video_rows, playlist_rows):
+        self.video_rows = video_rows
+        self.playlist_rows = playlist_rows
+
+    def run(self, query_string, **params):
+        if "RECOMMENDS" in query_string:
+            return StubResult(self.video_rows)
+        if "time_added" in query_string:
+            return StubResult(self.playlist_rows)
+        return StubResult([])
+
+
+class StubSession:
+    def __init__(self, transaction):
+        self.transaction = transaction
+
+    def read_transaction(self, fn, *args):
+        return fn(self.transaction, *args)
+
+    def write_transaction(self, fn, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StubDriver:
+    """A neo4j driver which answers the queries of load_graph_from_neo4j with the rows of G.
+
+    Rows are prepared once, so only the loading itself is measured.
+    """
+
+    def __init__(self, G):
+        self.transaction = StubTransaction(*graph_to_neo4j_rows(G))
+
+    def session(self, **config):
+        return StubSession(self.transaction)
+
+    def close(self):
+        pass
+
+
+def history_timestamp(unix_time):
+    year, month, day, hour, minute, second = gmtime(unix_time)[:6]
+    am_pm = "AM" if hour < 12 else "PM"
+    hour = (hour - 1) % 12 + 1
+    return f"{month_names[month - 1]} {day}, {year}, {hour}:{minute:02}:{second:02} {am_pm} UTC"
+
+
+def write_synthetic_takeout(takeout_dir, G, views_per_watched_video=3, seed=0):
+    """Writes playlist CSVs and watch-history.html of the videos of G, like in a takeout.
+
+    takeout_dir is the directory of the user, containing the Takeout directory.
+    """
+    rng = np.random.default_rng(seed)
+    youtube_dir = Path(takeout_dir) / "Takeout" / "YouTube and YouTube Music"
+    (youtube_dir / "playlists").mkdir(parents=True, exist_ok=True)
+    (youtube_dir / "history").mkdir(parents=True, exist_ok=True)
+
+    playlists = dict()
+    for id_, data in G.nodes(data=True):
+        if "from" in data:
+            playlists.setdefault(data["from"], []).append((id_, data["time_added"]))
+    for playlist_name, rows in playlists.items():
+        with open(youtube_dir / "playlists" / f"{playlist_name}.csv", "w") as file:
+            file.write(
+                f"Playlist Id,Channel Id,Title\nPL{seed:032d},UC{seed:022d},{playlist_name}\n"
+            )
+            file.write("\nVideo Id,Time Added\n")
+            for id_, time_added in rows:
+                file.write(f"{id_},{strftime('%Y-%m-%dT%H:%M:%S+00:00', gmtime(time_added))}\n")
+
+    now = time()
+    watched_entries = []
+    for id_, data in G.nodes(data=True):
+        if data.get("watched"):
+            for _ in range(rng.integers(1, 2 * views_per_watched_video)):
+                watched_entries.append((int(now - rng.uniform(0, 3) * seconds_in_year), id_))
+    # the newest entries are first
+    watched_entries.sort(reverse=True)
+    with open(youtube_dir / "history" / "watch-history.html", "w", encoding="utf-8") as file:
+        file.write(html_header)
+        for watched_time, id_ in watched_entries:
+            file.write(html_entry.format(id_=id_, timestamp=history_timestamp(watched_time)))
+        file.write(html_footer)
+
+
+class SavedPage:
+    """A saved watch page, which can be parsed like a response from youtube."""
+
+    def __init__(self, text, url=""):
+        self.text = text
+        self.url = url
+        self.status_code = 200
+
+
+def create_watch_page(id_, data, recommended_ids, page_size=800_000):
+    """Returns the html of a watch page, with the fields read by the parsers in yourtube.scraping.
+
+    It's padded to about page_size characters, because real pages are big and mostly irrelevant.
+    """
+    keywords = ",".join(json.dumps(keyword) for keyword in data.get("keywords", []))
+    player_response = (
+        f'{{"videoDetails":{{"videoId":"{id_}","title":{json.dumps(data["title"])},'
+        f'"keywords":[{keywords}],"lengthSeconds":"213","viewCount":"1000"}}}}'
+    )
+    like_label = f"{data.get('like_count', 0):,} likes"
+    primary_info = (
+        f'"videoPrimaryInfoRenderer":{{"title":{{"runs":[{{"text":"{data["title"]}"}}]}},'
+        f'"videoActions":{{"menuRenderer":{{"topLevelButtons":[{{"toggleButtonRenderer":'
+        f'{{"defaultIcon":{{"iconType":"LIKE"}},"defaultText":{{"accessibility":'
+        f'{{"accessibilityData":{{"label":"{like_label}"}}}}}}}}}}]}}}}}}'
+    )
+    subscribe = (
+        '"subscribeCommand":{"clickTrackingParams":"CAAQ","commandMetadata":{"webCommandMetadata":'
+        '{"sendPost":true,"apiUrl":"/youtubei/v1/subscription/subscribe"}},"subscribeEndpoint":'
+        f'{{"channelIds":["UC{id_}"]}}'
+    )
+    recommendations = ",".join(
+        f'{{"compactVideoRenderer":{{"videoId":"{rec}","navigationEndpoint":'
+        f'{{"commandMetadata":{{"webCommandMetadata":{{"url":"/watch?v={rec}"}}}}}}}}}}'
+        for rec in recommended_ids
+    )
+    filler = '{"trackingParams":"' + "x" * 200 + '"},'
+    num_of_fillers = max(0, (page_size - len(recommendations)) // len(filler))
+    return (
+        f"<html><head><title>{data['title']}</title></head><body>"
+        f"<script>var ytInitialPlayerResponse = {player_response};</script>"
+        f"<script>var ytInitialData = {{{primary_info},{subscribe},"
+        f'"secondaryResults":[{recommendations}],"filler":[{filler * num_of_fillers}{{}}]}};'
+        "</script></body></html>"
+    )
+
+
+def write_watch_pages(pages_dir, G, ids, page_size=800_000):
+    """Saves the watch pages of these scraped videos of G, as {id}.html files."""
+    Path(pages_dir).mkdir(parents=True, exist_ok=True)
+    for id_ in ids:
+        page = create_watch_page(id_, G.nodes[id_], list(G.successors(id_)), page_size)
+        with open(os.path.join(pages_dir, f"{id_}.html"), "w", encoding="utf-8") as file:
+            file.write(page)
+
+
+def load_watch_pages(pages_dir):
+    """Returns a dict from video ids to the saved pages."""
+    pages = dict()
+    for filename in sorted(os.listdir(pages_dir)):
+        with open(os.path.join(pages_dir, filename), encoding="utf-8") as file:
+            id_ = filename[: -len(".html")]
+            pages[id_] = SavedPage(file.read(), url=f"https://www.youtube.com/watch?v={id_}")
+    return pages
+
+
+def redirect_data_path(directory):
+    """Makes yourtube read and write its data files in this directory, instead of data_path.
+
+    It must be called after importing all the yourtube modules that are used, because they
+    copy the paths when they are imported.
+    """
+    from yourtube.file_operations import data_path
+
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("yourtube"):
+            continue
+        for attribute, value in list(vars(module).items()):
+            if isinstance(value, str) and value.startswith(data_path):
+                setattr(module, attribute, str(directory) + value[len(data_path) :])
@@ -0,0 +1,51 @@
+import threading
+
+from yourtube.build_pool import BuildPool
+
+
+def test_builds_with_the_same_key_are_coalesced():
+    pool = BuildPool(max_workers=2)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def build(value, progress_callback):
+        calls.append(value)
+        progress_callback("first stage", 0.5)
+        started.set()
+        release.wait()
+        progress_callback("second stage", 0.9)
+        return value * 2
+
+    first_progress = []
+    second_progress = []
+    first = pool.submit("key", build, 1, progress_callback=lambda *p: first_progress.append(p))
+    started.wait()
+    second = pool.submit("key", build, 1, progress_callback=lambda *p: second_progress.append(p))
+    other = pool.submit("other key", build, 5)
+    release.set()
+
+    assert second is first
+    assert first.result() == 2 and other.result() == 10
+    assert sorted(calls) == [1, 5]
+    assert first_progress == [("first stage", 0.5), ("second stage", 0.9)]
+    # the one which joined later gets the last progress at once
+    assert second_progress == [("first stage", 0.5), ("second stage", 0.9)]
+
+    # a finished build isn't shared anymore
+    third = pool.submit("key", build, 1)
+    assert third is not first and third.result() == 2
+    assert len(calls) == 3
+
+
+def test_failing_progress_callback_doesnt_break_the_build():
+    pool = BuildPool(max_workers=1)
+
+    def build(progress_callback):
+        progress_callback("stage", 0)
+        return "done"
+
+    def broken_callback(stage, fraction):
+        raise RuntimeError("session closed")
+
+    assert pool.submit("key", build, progress_callback=broken_callback).result() == "done"
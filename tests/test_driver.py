@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from yourtube.driver import InstrumentedDriver
+
+
+class FakeSession:
+    def __init__(self):
+        self.closed = False
+
+    def run(self, query):
+        return query
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDriver:
+    def session(self, **config):
+        return FakeSession()
+
+
+def test_instrumented_driver_limits_and_measures_sessions():
+    driver = InstrumentedDriver(FakeDriver(), max_sessions=2, acquisition_timeout=0.1)
+    with driver.session() as first, driver.session() as second:
+        assert first.run("RETURN 1") == "RETURN 1"
+        assert driver.get_stats()["in_use"] == 2
+        assert driver.get_stats()["utilisation"] == 1
+        # all the slots are used
+        with pytest.raises(TimeoutError):
+            driver.session()
+    assert first._session.closed
+
+    stats = driver.get_stats()
+    assert stats["in_use"] == 0
+    assert stats["peak_in_use"] == 2
+    assert stats["acquisitions"] == 2
+    assert stats["acquisition_timeouts"] == 1
+
+    # a waiting session gets the slot when another one is closed
+    blocking = driver.session()
+    driver.session().close()
+    threading.Timer(0.05, blocking.close).start()
+    with driver.session(), driver.session():
+        pass
+    # closing twice doesn't free the slot twice
+    blocking.close()
+    assert driver.get_stats()["in_use"] == 0
+    assert driver.get_stats()["acquisition_wait_max"] > 0
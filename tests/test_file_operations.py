@@ -0,0 +1,288 @@
+import io
+import zipfile
+
+import networkx as nx
+import numpy as np
+from scipy.cluster.hierarchy import linkage, to_tree
+
+from yourtube import file_operations
+from yourtube.scraping import Scraper
+from yourtube.file_operations import (
+    TranscriptStore,
+    get_saved_clusters,
+    get_parsed_takeout,
+    load_cluster_from_file,
+    load_latest_scrape_report,
+    parse_watch_history,
+    register_saved_cluster,
+    save_cluster_to_file,
+    save_scrape_report,
+    start_creating_user,
+    finish_creating_user,
+    timestamp_to_seconds,
+    update_user_takeout,
+)
+
+
+def create_tree(ids):
+    points = np.random.default_rng(0).random((len(ids), 2))
+    tree = to_tree(linkage(points))
+
+    def substitute_video_id(leaf):
+        leaf.id = ids[leaf.id]
+
+    tree.pre_order(substitute_video_id)
+    return tree
+
+
+def test_saved_cluster_roundtrip(tmp_path):
+    ids = [f"video{i:06d}" for i in range(50)]
+    tree = create_tree(ids)
+    G = nx.DiGraph()
+    for i, id_ in enumerate(ids):
+        G.add_node(id_, title=f"title {i}", is_down=i % 7 == 0, watched=i % 3 == 0)
+        if i % 5 != 0:
+            G.nodes[id_]["time_scraped"] = 1_600_000_000.0 + i
+    # videos outside of the cluster shouldn't be saved
+    G.add_edge(ids[0], "outside0000")
+    node_ranks = {id_: i for i, id_ in enumerate(ids)}
+
+    subtree = max(tree.left, tree.right, key=lambda child: child.count)
+    path = tmp_path / "cluster"
+    save_cluster_to_file(path, subtree, node_ranks, G)
+    loaded_tree, loaded_ranks, loaded_G = load_cluster_from_file(path)
+
+    assert loaded_tree.pre_order() == subtree.pre_order()
+    assert loaded_tree.count == subtree.count
+    assert loaded_tree.left.pre_order() == subtree.left.pre_order()
+    assert loaded_tree.dist == subtree.dist
+    assert set(loaded_G.nodes) == set(subtree.pre_order())
+    for id_ in loaded_G.nodes:
+        assert loaded_ranks[id_] == node_ranks[id_]
+        assert loaded_G.nodes[id_] == G.nodes[id_]
+
+    # browsing the loaded cluster doesn't scrape its videos again
+    scraper = Scraper(G=loaded_G, fetch_service=object())
+    for id_ in loaded_G.nodes:
+        was_scraped = "time_scraped" in G.nodes[id_] or G.nodes[id_]["is_down"]
+        assert scraper.should_skip(id_, float("inf")) == was_scraped
+
+
+def test_saved_clusters_catalog(tmp_path, monkeypatch):
+    saved_clusters_template = str(tmp_path / "{}" / "{}")
+    monkeypatch.setattr(file_operations, "saved_clusters_template", saved_clusters_template)
+    monkeypatch.setattr(
+        file_operations, "saved_clusters_catalog_path", str(tmp_path / "catalog.sqlite")
+    )
+    # a cluster saved before the catalog existed
+    (tmp_path / "bob").mkdir()
+    (tmp_path / "bob" / "rock").touch()
+
+    register_saved_cluster("alice", "music", 10)
+    register_saved_cluster("alice", "_private", 20)
+    register_saved_cluster("bob", "_private", 30)
+    register_saved_cluster("carol", "podcasts", 40)
+
+    assert get_saved_clusters("alice") == ["_private", "music", "bob/rock", "carol/podcasts"]
+    assert get_saved_clusters("bob") == ["_private", "rock", "alice/music", "carol/podcasts"]
+    assert get_saved_clusters("alice", prefix="bob/") == ["bob/rock"]
+    assert get_saved_clusters("alice", limit=2, offset=1) == ["music", "bob/rock"]
+
+
+def test_watch_history_formats(tmp_path):
+    html_path = tmp_path / "watch-history.html"
+    html_path.write_text(
+        '<div class="outer-cell">Watched\xa0<a href="https://www.youtube.com/watch?v=aaaaaaaaaaa">'
+        "A</a><br><a>Channel</a><br>Jan 3, 2022, 10:15:32 PM CET</div>"
+        '<div class="outer-cell">Watched a video that has been removed<br></div>'
+        '<div class="outer-cell">Watched\xa0<a href="https://www.youtube.com/watch?v=bbbbbbbbbbb">'
+        "B</a><br><a>Channel</a><br>Jan 3, 2022, 9:00:00 AM CET</div>"
+        '<div class="outer-cell">Watched\xa0<a href="https://www.youtube.com/watch?v=aaaaaaaaaaa">'
+        "A</a><br><a>Channel</a><br>Dec 24, 2021, 12:00:00 AM CET</div>",
+        encoding="utf-8",
+    )
+    json_path = tmp_path / "watch-history.json"
+    json_path.write_text(
+        """[{
+            "header": "YouTube",
+            "title": "Watched A",
+            "titleUrl": "https://www.youtube.com/watch?v\\u003daaaaaaaaaaa",
+            "time": "2022-01-03T22:15:32.000Z"
+        }, {
+            "header": "YouTube",
+            "title": "Watched a video that has been removed",
+            "time": "2022-01-03T10:00:00.000Z"
+        }, {
+            "header": "YouTube",
+            "title": "Watched B",
+            "titleUrl": "https://www.youtube.com/watch?v\\u003dbbbbbbbbbbb",
+            "time": "2022-01-03T09:00:00Z"
+        }, {
+            "header": "YouTube",
+            "title": "Watched A",
+            "titleUrl": "https://www.youtube.com/watch?v\\u003daaaaaaaaaaa",
+            "time": "2021-12-24T00:00:00.000Z"
+        }]""",
+        encoding="utf-8",
+    )
+    expected = {
+        "aaaaaaaaaaa": [
+            timestamp_to_seconds("Jan 3, 2022, 10:15:32 PM"),
+            timestamp_to_seconds("Dec 24, 2021, 12:00:00 AM"),
+        ],
+        "bbbbbbbbbbb": [timestamp_to_seconds("Jan 3, 2022, 9:00:00 AM")],
+    }
+
+    for path in [html_path, json_path]:
+        # small chunks, to check that entries split between chunks are parsed correctly
+        for chunk_size in [7, 100, 2**20]:
+            assert parse_watch_history(str(path), chunk_size=chunk_size) == expected
+
+
+def patch_takeout_paths(monkeypatch, tmp_path):
+    takeouts_template = str(tmp_path / "takeouts" / "{}")
+    monkeypatch.setattr(
+        file_operations, "playlists_path_template", f"{takeouts_template}/playlists"
+    )
+    monkeypatch.setattr(
+        file_operations, "history_path_template", f"{takeouts_template}/watch-history.html"
+    )
+    monkeypatch.setattr(
+        file_operations, "takeout_cache_template", str(tmp_path / "takeout_cache" / "{}.pickle")
+    )
+
+
+def test_parsed_takeout_cache(tmp_path, monkeypatch):
+    patch_takeout_paths(monkeypatch, tmp_path)
+    playlists_path = tmp_path / "takeouts" / "user" / "playlists"
+    playlists_path.mkdir(parents=True)
+    (tmp_path / "takeouts" / "user" / "watch-history.html").write_text(
+        '<div class="outer-cell">Watched\xa0<a href="https://www.youtube.com/watch?v=aaaaaaaaaaa">'
+        "A</a><br><a>Channel</a><br>Jan 3, 2022, 10:15:32 PM CET</div>",
+        encoding="utf-8",
+    )
+    (playlists_path / "Liked videos.csv").write_text(
+        "Video Id,Time Added\naaaaaaaaaaa,2021-06-07T19:21:32+00:00\n"
+    )
+
+    parsed = get_parsed_takeout("user")
+    assert list(parsed["watched"]) == ["aaaaaaaaaaa"]
+    assert parsed["playlists"]["Liked videos"] == (
+        ["aaaaaaaaaaa"],
+        [timestamp_to_seconds("2021-06-07T19:21:32+00:00")],
+    )
+
+    # unchanged files aren't parsed again, even in a new process
+    with monkeypatch.context() as m:
+        m.setattr(file_operations, "parse_watch_history", None)
+        m.setattr(file_operations, "parse_youtube_playlist", None)
+        assert get_parsed_takeout("user") == parsed
+        file_operations._parsed_takeouts.clear()
+        assert get_parsed_takeout("user") == parsed
+
+    # but changed ones are
+    (playlists_path / "Liked videos.csv").write_text(
+        "Video Id,Time Added\nbbbbbbbbbbb,2021-06-07T19:21:32+00:00\n"
+    )
+    assert get_parsed_takeout("user")["playlists"]["Liked videos"][0] == ["bbbbbbbbbbb"]
+
+
+def test_update_user_takeout(tmp_path, monkeypatch):
+    youtube_dir = "Takeout/YouTube and YouTube Music"
+    monkeypatch.setattr(file_operations, "takeouts_template", str(tmp_path / "takeouts" / "{}"))
+    monkeypatch.setattr(
+        file_operations,
+        "playlists_path_template",
+        str(tmp_path / "takeouts" / "{}" / youtube_dir / "playlists"),
+    )
+    monkeypatch.setattr(
+        file_operations,
+        "history_path_template",
+        str(tmp_path / "takeouts" / "{}" / youtube_dir / "history" / "watch-history.html"),
+    )
+
+    takeout_file = io.BytesIO()
+    with zipfile.ZipFile(takeout_file, "w") as zip_ref:
+        zip_ref.writestr(f"{youtube_dir}/playlists/Liked videos.csv", "Video Id,Time Added\n")
+        zip_ref.writestr(f"{youtube_dir}/history/watch-history.html", "<html></html>")
+        zip_ref.writestr(f"{youtube_dir}/videos/video.mp4", b"\0" * 1000)
+        zip_ref.writestr("Takeout/Drive/file.txt", "not needed")
+    progress = []
+
+    assert update_user_takeout("user", takeout_file, lambda *args: progress.append(args))
+    extracted = {
+        path.relative_to(tmp_path / "takeouts" / "user").as_posix()
+        for path in (tmp_path / "takeouts" / "user").rglob("*")
+        if path.is_file()
+    }
+    assert extracted == {
+        f"{youtube_dir}/playlists/Liked videos.csv",
+        f"{youtube_dir}/history/watch-history.html",
+    }
+    assert progress[-1] == ("extracting", 1)
+
+    assert not update_user_takeout("other_user", io.BytesIO(b"not a zip file"))
+    assert list((tmp_path / "takeouts" / "other_user").iterdir()) == []
+
+    # corrupted compressed data
+    corrupted_file = io.BytesIO()
+    member_name = f"{youtube_dir}/playlists/Liked videos.csv"
+    with zipfile.ZipFile(corrupted_file, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(member_name, "Video Id\n" * 1000)
+    corrupted = bytearray(corrupted_file.getvalue())
+    # the data starts after a 30 bytes header and the name
+    data_start = 30 + len(member_name)
+    corrupted[data_start : data_start + 4] = b"\xff" * 4
+    assert not update_user_takeout("corrupted_user", io.BytesIO(bytes(corrupted)))
+    assert list((tmp_path / "takeouts" / "corrupted_user").iterdir()) == []
+
+    # e.g. a full disk
+    def raise_os_error(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(file_operations, "_extract_youtube_takeout", raise_os_error)
+    assert not update_user_takeout("full_disk_user", takeout_file)
+    assert list((tmp_path / "takeouts" / "full_disk_user").iterdir()) == []
+
+
+def test_transcript_store(tmp_path, monkeypatch):
+    legacy_path = tmp_path / "transcripts.json"
+    legacy_path.write_text('{"aaaaaaaaaaa": [{"text": "hi", "start": 0.0}], "bbbbbbbbbbb": null}')
+    monkeypatch.setattr(file_operations, "transcripts_path", str(legacy_path))
+    db_path = tmp_path / "transcripts.sqlite"
+
+    with TranscriptStore(db_path) as store:
+        assert store.fetched_ids() == {"aaaaaaaaaaa", "bbbbbbbbbbb"}
+        assert store["aaaaaaaaaaa"] == [{"text": "hi", "start": 0.0}]
+        assert "bbbbbbbbbbb" in store and store["bbbbbbbbbbb"] is None
+        store["ccccccccccc"] = [{"text": "bye", "start": 1.5}]
+
+    # legacy transcripts are imported only once
+    legacy_path.write_text('{"ddddddddddd": null}')
+    with TranscriptStore(db_path) as store:
+        assert len(store) == 3
+        assert store.get("ccccccccccc") == [{"text": "bye", "start": 1.5}]
+        assert store.get("ddddddddddd", "missing") == "missing"
+
+
+def test_scrape_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_operations, "scrape_reports_path", str(tmp_path))
+    monkeypatch.setattr(file_operations.Config, "max_saved_scrape_reports", 2)
+    assert load_latest_scrape_report() is None
+
+    for day in range(3):
+        save_scrape_report(dict(time_started=1_600_000_000 + day * 86400, day=day))
+    assert load_latest_scrape_report()["day"] == 2
+    # the oldest report is deleted
+    assert len(list(tmp_path.glob("*.json"))) == 3
+
+
+def test_creating_user_guard():
+    assert start_creating_user("new_user")
+    # e.g. Refresh is pressed again, while the takeout is extracted
+    assert not start_creating_user("new_user")
+    assert start_creating_user("another_user")
+    finish_creating_user("new_user")
+    finish_creating_user("another_user")
+    assert start_creating_user("new_user")
+    finish_creating_user("new_user")
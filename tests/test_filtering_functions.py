@@ -0,0 +1,52 @@
+from time import time
+
+import networkx as nx
+
+from yourtube.filtering_functions import (
+    added_in_last_n_years,
+    get_neighborhood,
+    graph_to_csr,
+    not_down,
+    only_watched,
+    select_nodes_to_cluster,
+)
+
+seconds_in_year = 60 * 60 * 24 * 365
+
+
+def create_graph():
+    G = nx.DiGraph()
+    G.add_edges_from([("a", "b"), ("a", "c"), ("b", "c"), ("c", "d"), ("e", "f"), ("g", "a")])
+    G.add_node("h")
+    G.nodes["a"]["time_added"] = time() - seconds_in_year
+    G.nodes["b"]["time_added"] = time() - seconds_in_year
+    G.nodes["b"]["is_down"] = True
+    G.nodes["e"]["time_added"] = time() - 10 * seconds_in_year
+    G.nodes["f"]["watched"] = True
+    G.nodes["h"]["time_added"] = time() - seconds_in_year
+    return G
+
+
+def test_graph_to_csr():
+    G = create_graph()
+    node_ids, indptr, indices = graph_to_csr(G)
+    for i, id_ in enumerate(node_ids):
+        successors = node_ids[indices[indptr[i] : indptr[i + 1]]]
+        assert set(successors) == set(G.successors(id_))
+
+
+def test_select_nodes_to_cluster():
+    G = create_graph()
+    num_of_sources, ids = select_nodes_to_cluster(G, use_watched=False)
+    assert num_of_sources == 2
+    sources = not_down(G, added_in_last_n_years(G, list(G.nodes)))
+    assert set(ids) == set(get_neighborhood(G, sources)) == {"a", "b", "c"}
+
+
+def test_select_nodes_to_cluster_with_watched():
+    G = create_graph()
+    num_of_sources, ids = select_nodes_to_cluster(G, min_sources=4)
+    assert num_of_sources == 3
+    sources = list(added_in_last_n_years(G, list(G.nodes))) + list(only_watched(G, list(G.nodes)))
+    sources = not_down(G, sources)
+    assert set(ids) == set(get_neighborhood(G, sources)) == {"a", "b", "c"}
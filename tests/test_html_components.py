@@ -0,0 +1,36 @@
+import json
+
+import panel as pn
+
+from yourtube.html_components import VideoGrid
+
+
+def get_patch(grid):
+    return json.loads(grid.cells_patch)["cells"]
+
+
+def test_video_grid_patches():
+    grid = VideoGrid(4, 2, 260, 260, 20)
+    grid.set_cells(["a", "b", "", ""], ["A", "B", "-", "-"], ["ua", "ub", "x", "x"])
+    assert len(get_patch(grid)) == 4
+
+    # only the changed cells are sent
+    grid.set_cells(["a", "c", "", ""], ["A", "C", "-", "-"], ["ua", "uc", "x", "x"])
+    assert get_patch(grid) == {"1": ["c", "C", "uc"]}
+    patch = grid.cells_patch
+    grid.set_cells(["a", "c", "", ""], ["A", "C", "-", "-"], ["ua", "uc", "x", "x"])
+    assert grid.cells_patch == patch
+
+    grid.set_cells(["a", "c", "d", ""], ["A", "C", "D", "-"], ["ua", "uc", "ud", "x"])
+    assert get_patch(grid) == {"2": ["d", "D", "ud"]}
+
+    # a new view gets all the cells
+    pn.Row(grid).get_root()
+    assert len(get_patch(grid)) == 4
+
+    # the thumbnail of a displayed video got cached, but the browser keeps the one it has
+    patch = grid.cells_patch
+    grid.set_cells(["a", "c", "d", ""], ["A", "C", "D", "-"], ["local_a", "uc", "ud", "x"])
+    assert grid.cells_patch == patch
+    grid.set_cells(["a", "c", "e", ""], ["A2", "C", "E", "-"], ["local_a", "uc", "local_e", "x"])
+    assert get_patch(grid) == {"0": ["a", "A2", "ua"], "2": ["e", "E", "local_e"]}
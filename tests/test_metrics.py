@@ -0,0 +1,39 @@
+from yourtube import metrics
+
+
+def test_render_metrics():
+    metrics.observe_duration("test_stage", 0.02, user="alice")
+    metrics.observe_duration("test_stage", 3, user="alice")
+    with metrics.timed("test_stage", user='bob "the" user'):
+        pass
+
+    @metrics.timed_function("test_function")
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    metrics.count_cache_request("test_cache", hit=True)
+    metrics.count_cache_request("test_cache", hit=True)
+    metrics.count_cache_request("test_cache", hit=False)
+    metrics.register_collector(
+        lambda: [("test_gauge", "gauge", "A test gauge.", [(None, 7), ({"pool": "a"}, 1.5)])]
+    )
+
+    lines = metrics.render_metrics().splitlines()
+    labels = 'stage="test_stage",user="alice"'
+    # buckets are cumulative
+    assert f'yourtube_stage_duration_seconds_bucket{{{labels},le="0.01"}} 0' in lines
+    assert f'yourtube_stage_duration_seconds_bucket{{{labels},le="0.025"}} 1' in lines
+    assert f'yourtube_stage_duration_seconds_bucket{{{labels},le="5"}} 2' in lines
+    assert f'yourtube_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert f"yourtube_stage_duration_seconds_sum{{{labels}}} 3.02" in lines
+    assert f"yourtube_stage_duration_seconds_count{{{labels}}} 2" in lines
+    assert (
+        'yourtube_stage_duration_seconds_count{stage="test_stage",user="bob \\"the\\" user"} 1'
+        in lines
+    )
+    assert 'yourtube_stage_duration_seconds_count{stage="test_function",user=""} 1' in lines
+    assert 'yourtube_cache_requests_total{cache="test_cache",result="hit"} 2' in lines
+    assert 'yourtube_cache_requests_total{cache="test_cache",result="miss"} 1' in lines
+    assert "# TYPE test_gauge gauge" in lines
+    assert "test_gauge 7" in lines and 'test_gauge{pool="a"} 1.5' in lines
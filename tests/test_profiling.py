@@ -0,0 +1,43 @@
+import json
+import os
+from time import sleep
+
+from yourtube import profiling
+from yourtube.config import Config
+
+
+def test_profile_if_slow(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "profiles_path", str(tmp_path))
+    monkeypatch.setattr(Config, "max_saved_profiles", 2)
+
+    @profiling.profile_if_slow(
+        "slow", lambda duration, user: dict(user=user, duration_arg=duration)
+    )
+    def slow(duration, user):
+        sleep(duration)
+        # nested calls aren't profiled separately
+        return nested()
+
+    @profiling.profile_if_slow("nested")
+    def nested():
+        return "done"
+
+    # profiling is off by default
+    assert slow(0.02, "alice") == "done"
+    assert os.listdir(tmp_path) == []
+
+    monkeypatch.setattr(Config, "profile_slower_than", 0.01)
+    assert slow(0, "alice") == "done"
+    assert os.listdir(tmp_path) == []
+    for user in ["alice", "bob", "carol/dave"]:
+        assert slow(0.02, user) == "done"
+
+    # only the newest profiles are kept
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 4
+    assert names[0].endswith("_slow_bob.json") and names[1].endswith("_slow_bob.prof")
+    assert names[2].endswith("_slow_carol_dave.json")
+    with open(tmp_path / names[2]) as file:
+        metadata = json.load(file)
+    assert metadata["name"] == "slow" and metadata["user"] == "carol/dave"
+    assert metadata["duration"] > 0.01 and metadata["duration_arg"] == 0.02
@@ -0,0 +1,54 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage, to_tree
+
+from yourtube.recommendation import TreeClimber
+
+
+def create_tree_climber(num_of_leaves=60):
+    ids = [f"video{i:06d}" for i in range(num_of_leaves)]
+    points = np.random.default_rng(0).random((num_of_leaves, 2))
+    tree = to_tree(linkage(points))
+    tree.pre_order(lambda leaf: setattr(leaf, "id", ids[leaf.id]))
+    tree_climber = TreeClimber(num_of_groups=3, videos_in_group=2)
+    tree_climber.reset(tree)
+    return tree_climber, ids
+
+
+def test_branch_index():
+    tree_climber, ids = create_tree_climber()
+    branch_index = tree_climber.get_branch_index()
+    assert set(branch_index) == set(ids)
+
+    for id_ in ids:
+        # climb down by hand, choosing the column containing this video
+        tree_climber.go_to_root()
+        while True:
+            i = next(i for i, child in enumerate(tree_climber.children) if id_ in child.pre_order())
+            if tree_climber.choose_column(i) == -1:
+                break
+        assert branch_index[id_] == tree_climber.branch_id
+
+        assert tree_climber.go_to_branch(branch_index[id_]) == 0
+        assert tree_climber.branch_id == branch_index[id_]
+        assert id_ in tree_climber.tree.pre_order()
+
+
+def test_go_to_branch():
+    tree_climber, _ = create_tree_climber()
+    deepest_branch_id = max(tree_climber.get_branch_index().values(), key=len)
+    assert tree_climber.go_to_branch(deepest_branch_id) == 0
+    assert tree_climber.branch_id == deepest_branch_id
+    assert tree_climber.go_back() == 0
+
+    for bad_branch_id in ["4", "0", "x", deepest_branch_id + "1"]:
+        assert tree_climber.go_to_branch(bad_branch_id) == -1
+        assert tree_climber.tree is tree_climber.root and tree_climber.branch_id == ""
+
+
+def test_jump_to_video():
+    tree_climber, _ = create_tree_climber()
+
+    assert tree_climber.jump_to_video(["not_in_tree", "video000042"]) == "video000042"
+    assert "video000042" in tree_climber.tree.pre_order()
+    assert tree_climber.tree.count < tree_climber.root.count
+    assert tree_climber.jump_to_video(["not_in_tree"]) is None
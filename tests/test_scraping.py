@@ -1,8 +1,12 @@
-from time import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import os
+from time import sleep, time
 
 import networkx as nx
+import pytest
 
-from yourtube import __version__
+from yourtube import __version__, scraping
 from yourtube.scraping import get_content, get_title, Scraper
 
 id_ = "dQw4w9WgXcQ"
@@ -68,3 +72,233 @@ def test_title_special_chars():
     content, id_ = get_content("gmxSGVQEXuc")
     title = get_title(content)
     assert title == """test"&ŒœŠšŸˆ˜   –—‘’‚“”„†‡‰‹›€~!@#$%^&*()_+[]{};'\\:"|,./?"""
+
+
+def test_scrape_in_batches(monkeypatch):
+    class FakeScraper:
+        def __init__(self):
+            self.batches = []
+
+        def scrape_from_list(self, ids, skip_if_fresher_than=None):
+            self.batches.append(list(ids))
+            return [id_ for id_ in ids if id_.startswith("failed")]
+
+    saved_states = []
+    monkeypatch.setattr(scraping.Config, "scraping_checkpoint_interval", 2)
+    monkeypatch.setattr(scraping, "save_scraping_state", lambda state: saved_states.append(state))
+    scraper = FakeScraper()
+    state = dict(time_checked=dict())
+
+    ids = ["a", "failed1", "b", "c", "failed2"]
+    failed_ids = scraping.scrape_in_batches(scraper, ids, None, state)
+
+    assert failed_ids == {"failed1", "failed2"}
+    assert scraper.batches == [["a", "failed1"], ["b", "c"], ["failed2"]]
+    assert set(state["time_checked"]) == {"a", "b", "c"}
+    assert len(saved_states) == 3
+
+
+def test_check_response():
+    class FakeResponse:
+        def __init__(self, status_code=200, url="https://www.youtube.com/watch?v=a", text=""):
+            self.status_code = status_code
+            self.url = url
+            self.text = text
+
+    scraping.check_response(FakeResponse(text="var ytInitialData = {};"))
+    # a real watch page, which only mentions it
+    scraping.check_response(FakeResponse(text="var ytInitialData = {}; unusual traffic"))
+    for response, error in [
+        (FakeResponse(status_code=429), scraping.ThrottledError),
+        (FakeResponse(url="https://www.google.com/sorry/index"), scraping.ThrottledError),
+        (FakeResponse(status_code=503), scraping.FetchError),
+        (FakeResponse(url="https://consent.youtube.com/m"), scraping.FetchError),
+        (FakeResponse(text="<html></html>"), scraping.FetchError),
+    ]:
+        with pytest.raises(error):
+            scraping.check_response(response)
+
+
+def test_adaptive_concurrency():
+    concurrency = scraping.AdaptiveConcurrency(8)
+    assert concurrency.can_submit(7) and not concurrency.can_submit(8)
+
+    concurrency.on_error(throttled=True)
+    assert concurrency.limit == 4
+    # sending is paused after throttling
+    assert not concurrency.can_submit(0)
+
+    concurrency.paused_until = 0
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 8
+
+
+def test_fetch_service_limits_requests_in_flight():
+    fetch_service = scraping.FetchService(max_workers=2)
+    first = fetch_service.try_submit(pow, 2, 10)
+    second = fetch_service.try_submit(pow, 3, 2)
+    # all the slots are taken, by whichever scraper
+    assert first is not None and second is not None
+    assert fetch_service.try_submit(pow, 4, 2) is None
+    assert first.result() == 1024 and second.result() == 9
+    # done callbacks can run a moment after the result is set
+    for _ in range(100):
+        if fetch_service.in_flight == 0:
+            break
+        sleep(0.01)
+    assert fetch_service.in_flight == 0
+    assert fetch_service.try_submit(pow, 4, 2).result() == 16
+
+    fetch_service.shutdown()
+    assert fetch_service.try_submit(pow, 2, 2) is None
+
+
+def test_schedule_refresh():
+    now = time()
+    importance = {"new": 0.1, "stale": 1, "important": 10, "fresh": 100}
+    time_checked = {"stale": now - 100, "important": now - 20, "fresh": now - 1}
+
+    assert scraping.schedule_refresh(importance, time_checked, 10, None) == [
+        "new",
+        "important",
+        "stale",
+    ]
+    assert scraping.schedule_refresh(importance, time_checked, 10, 2) == ["new", "important"]
+
+
+class Page:
+    def __init__(self, text):
+        self.text = text
+
+
+def test_scrape_stats():
+    stats = scraping.ScrapeStats()
+    down_G = nx.DiGraph()
+    scraping.scrape_content(Page("no recommendations"), "aaaaaaaaaaa", down_G, stats=stats)
+    assert down_G.nodes["aaaaaaaaaaa"]["is_down"]
+
+    page = Page("watch?v=bbbbbbbbbbb watch?v=ccccccccccc, but no title")
+    with pytest.raises(AssertionError):
+        scraping.scrape_content(page, "aaaaaaaaaaa", nx.DiGraph(), stats=stats)
+    stats.add(requested=3, skipped=1, pages_fetched=2, bytes_fetched=1000, retries=1)
+    stats.add_error(scraping.ThrottledError("429"))
+    stats.finish()
+
+    report = stats.to_dict()
+    assert report["videos"]["marked_down"] == 1
+    assert report["videos"]["requested"] == 3
+    assert report["fetch"]["bytes"] == 1000
+    assert report["fetch"]["retries"] == 1
+    assert report["fetch"]["pages_per_second"] > 0
+    assert report["errors"] == {"ThrottledError": 1}
+    assert report["parse_failures"] == {"get_title": 1}
+
+
+class FakeFetchService:
+    def __init__(self):
+        self.pages = 0
+
+    def try_submit(self, fn, id_):
+        page = Page("the video is down")
+        page.content = page.text.encode()
+        future = Future()
+        future.set_result((page, id_))
+        self.pages += 1
+        return future
+
+    def on_success(self):
+        pass
+
+    def get_paused_until(self):
+        return 0
+
+
+def test_scrape_from_list_reads_ids_lazily(monkeypatch):
+    monkeypatch.setattr(scraping.Config, "scraping_window", 5)
+    scraped_G = nx.DiGraph()
+    read_ahead = []
+
+    def generate_ids():
+        for i in range(100):
+            read_ahead.append(i - len(scraped_G))
+            yield f"{i:011d}"
+
+    fetch_service = FakeFetchService()
+    with Scraper(G=scraped_G, fetch_service=fetch_service) as scraper:
+        assert scraper.scrape_from_list(generate_ids(), non_verbose=True) == []
+        # the videos are down now, so they are skipped
+        scraper.scrape_from_list([["", "00000000000"], ["00000000001"]], non_verbose=True)
+    assert len(scraped_G) == 100
+    assert max(read_ahead) <= 5
+    assert fetch_service.pages == 100
+    assert scraper.stats.to_dict()["videos"]["skipped"] == 2
+
+
+def test_fetch_service_replaces_broken_pool():
+    fetch_service = scraping.FetchService(max_workers=2)
+    # the process dies, like when it's killed for using too much memory
+    future = fetch_service.try_submit(os._exit, 1)
+    with pytest.raises(BrokenProcessPool):
+        future.result()
+    for _ in range(100):
+        if fetch_service.in_flight == 0:
+            break
+        sleep(0.01)
+    assert fetch_service.try_submit(pow, 2, 3).result() == 8
+    fetch_service.shutdown()
+
+
+class FakeSession:
+    def __init__(self, writes):
+        self.writes = writes
+
+    def write_transaction(self, transaction_function, *args):
+        self.writes.append((transaction_function.__name__, *args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FakeDriver:
+    def __init__(self):
+        self.writes = []
+
+    def session(self):
+        return FakeSession(self.writes)
+
+
+def test_ingest_manifest(monkeypatch):
+    now = time()
+    playlist = [("a", now - 300), ("b", now - 200), ("failed", now - 100)]
+    monkeypatch.setattr(scraping, "get_playlist_names", lambda username: ["Liked"])
+    monkeypatch.setattr(
+        scraping,
+        "get_youtube_playlist_ids",
+        lambda playlist_name, username: tuple(zip(*playlist)),
+    )
+    driver = FakeDriver()
+    manifest = dict(rows=set())
+
+    importance = dict()
+    new_rows = scraping.get_new_playlist_rows("user", 5, manifest, importance)
+    assert len(new_rows["Liked"]) == 3
+    # the recently added ones are more important
+    assert importance["a"] < importance["b"] < importance["failed"]
+    scraping.save_playlist_rows("user", "Liked", new_rows["Liked"], driver, manifest, {"failed"})
+    saved_ids = [write[3] for write in driver.writes[1:]]
+    assert saved_ids == ["a", "b"]
+    assert {id_ for _, id_, _ in manifest["rows"]} == {"a", "b"}
+
+    # in the next run, only the new and the failed rows are saved
+    playlist.append(("c", now))
+    driver.writes.clear()
+    new_rows = scraping.get_new_playlist_rows("user", 5, manifest, dict())
+    assert [id_ for _, id_, _ in new_rows["Liked"]] == ["failed", "c"]
+    scraping.save_playlist_rows("user", "Liked", new_rows["Liked"], driver, manifest, set())
+    assert driver.writes[0] == ("ensure_playlist_exists", "user", "Liked")
+    assert [write[3] for write in driver.writes[1:]] == ["failed", "c"]
+    assert len(manifest["rows"]) == 4
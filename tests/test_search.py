@@ -0,0 +1,58 @@
+import networkx as nx
+
+from yourtube import file_operations, search
+from yourtube.file_operations import TranscriptStore
+from yourtube.search import SearchIndex
+
+
+def create_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_operations, "transcripts_path", str(tmp_path / "transcripts.json"))
+    monkeypatch.setattr(
+        file_operations, "transcripts_db_path", str(tmp_path / "transcripts.sqlite")
+    )
+    return SearchIndex(tmp_path / "search_index.sqlite")
+
+
+def test_search_index(tmp_path, monkeypatch):
+    with TranscriptStore(tmp_path / "transcripts.sqlite") as store:
+        store["ccccccccccc"] = [{"text": "today we bake bread", "start": 0.0}]
+        store["ddddddddddd"] = None
+    index = create_index(tmp_path, monkeypatch)
+
+    G = nx.DiGraph()
+    G.add_node("aaaaaaaaaaa", title="Sourdough bread recipe", keywords=["baking"])
+    G.add_node("bbbbbbbbbbb", title="Bread", keywords=["bread", "baking"])
+    G.add_node("ccccccccccc", title="Kitchen vlog", keywords=[])
+    # not scraped yet
+    G.add_edge("aaaaaaaaaaa", "eeeeeeeeeee")
+    index.add_videos_from_nodes(list(G.nodes(data=True)))
+
+    assert set(index.search("bread")) == {"aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc"}
+    # title matches are the most relevant
+    assert index.search("bread")[-1] == "ccccccccccc"
+    assert index.search("BAKING bread") == ["bbbbbbbbbbb", "aaaaaaaaaaa"]
+    assert index.search("vlog bake") == ["ccccccccccc"]
+    assert index.search('"bread" OR NEAR(') == index.search("bread or near")
+    assert index.search("") == []
+
+    # searching only the videos of some tree, so that its matches aren't crowded out by others
+    assert index.search("bread", limit=1) == ["bbbbbbbbbbb"]
+    assert index.search("bread", limit=1, video_ids=["ccccccccccc", "xxxxxxxxxxx"]) == [
+        "ccccccccccc"
+    ]
+    assert index.search("bread", video_ids=[]) == []
+
+    # matches are read in pages, until there are enough results
+    monkeypatch.setattr(search.Config, "search_page_size", 1)
+    assert index.search("bread", limit=1, video_ids={"bbbbbbbbbbb"}) == ["bbbbbbbbbbb"]
+    assert len(index.search("bread", limit=2)) == 2
+    monkeypatch.setattr(search.Config, "search_max_candidates", 2)
+    # this video was indexed last, so it is not among the first candidates
+    assert index.search("bread", video_ids={"bbbbbbbbbbb"}) == []
+
+    # updates keep the other columns
+    index.add_video("ccccccccccc", "Kitchen tour", ["kitchen"])
+    assert index.search("bake") == ["ccccccccccc"]
+    assert index.search("vlog") == []
+    index.add_transcript("eeeeeeeeeee", [{"text": "hello", "start": 0.0}])
+    assert index.search("hello") == ["eeeeeeeeeee"]
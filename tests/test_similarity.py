@@ -0,0 +1,93 @@
+from threading import Thread
+
+import networkx as nx
+import numpy as np
+
+from yourtube.similarity import SimilarityIndex, vectorize
+
+
+def create_index(tmp_path):
+    return SimilarityIndex(tmp_path / "ids.txt", tmp_path / "vectors.float32")
+
+
+def test_vectorize():
+    guitar = vectorize("Acoustic guitar lesson", ["guitar", "music lesson"])
+    assert np.isclose(np.linalg.norm(guitar), 1)
+    assert np.array_equal(guitar, vectorize("acoustic GUITAR lesson!", ["Guitar", "music lesson"]))
+
+    similar = vectorize("Electric guitar lesson for beginners", ["guitar"])
+    different = vectorize("Sourdough bread recipe", ["baking"])
+    assert guitar @ similar > guitar @ different
+    assert not vectorize("", []).any()
+
+
+def test_similarity_index(tmp_path):
+    G = nx.DiGraph()
+    G.add_node("guitar00001", title="Acoustic guitar lesson", keywords=["guitar"])
+    G.add_node("guitar00002", title="Electric guitar lesson", keywords=["guitar", "rock"])
+    G.add_node("bread000001", title="Sourdough bread recipe", keywords=["baking"])
+    # not scraped yet
+    G.add_edge("guitar00001", "unknown0001")
+    index = create_index(tmp_path)
+    index.add_videos_from_nodes(list(G.nodes(data=True)))
+    index.add_video("bread000002", "Easy bread recipe", ["baking", "bread"])
+
+    candidates = ["guitar00002", "bread000001", "bread000002", "unknown0001", "guitar00001"]
+    assert index.most_similar("guitar00001", candidates, n=1) == ["guitar00002"]
+    assert index.most_similar("bread000001", candidates, n=1) == ["bread000002"]
+    assert len(index.most_similar("bread000001", candidates, n=10)) == 3
+    assert index.most_similar("unknown0001", candidates, n=3) is None
+    assert index.most_similar("guitar00001", ["guitar00001"], n=3) == []
+
+    # it's persistent
+    loaded_index = create_index(tmp_path)
+    assert loaded_index.id_to_row == index.id_to_row
+    assert np.array_equal(loaded_index.get_vectors(), index.get_vectors())
+
+    # and an interrupted append is repaired
+    with open(tmp_path / "vectors.float32", "ab") as file:
+        file.write(b"\0" * 100)
+    repaired_index = create_index(tmp_path)
+    assert repaired_index.id_to_row == index.id_to_row
+    repaired_index.add_video("guitar00003", "Guitar chords", ["guitar"])
+    assert create_index(tmp_path).most_similar("guitar00003", candidates, n=1) == ["guitar00001"]
+
+
+def test_similarity_index_concurrent_adds(tmp_path):
+    index = create_index(tmp_path)
+    rows = [(f"video{i:06d}", f"video number {i}", ["video"]) for i in range(1000)]
+    # the same videos are added by many threads at once, and twice in one call
+    threads = [Thread(target=index.add_videos, args=[rows + rows[:10]]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert index.num_of_rows == len(rows)
+    assert len(index.get_vectors()) == len(rows)
+    assert sorted(index.id_to_row.values()) == list(range(len(rows)))
+    assert create_index(tmp_path).id_to_row == index.id_to_row
+
+
+def test_similarity_index_shared_by_processes(tmp_path):
+    # each index has its own state, like the indexes of the server and of the scraping job
+    indexes = [create_index(tmp_path), create_index(tmp_path)]
+    rows = [(f"video{i:06d}", f"video number {i} {i % 7}", [f"tag{i % 5}"]) for i in range(600)]
+    threads = [
+        Thread(target=index.add_videos, args=[rows[start : start + 400]])
+        for index, start in zip(indexes, [0, 200])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    indexes[0].add_video("video999999", "the last video", [])
+
+    loaded_index = create_index(tmp_path)
+    assert loaded_index.num_of_rows == len(rows) + 1
+    vectors = loaded_index.get_vectors()
+    for id_, title, keywords in rows[::50]:
+        assert np.allclose(vectors[loaded_index.id_to_row[id_]], vectorize(title, keywords))
+    # the other index reads the rows appended by the first one, before its next append
+    indexes[1].add_video("video999998", "one more video", [])
+    assert indexes[1].id_to_row == create_index(tmp_path).id_to_row
@@ -0,0 +1,40 @@
+import os
+
+from yourtube import thumbnails
+from yourtube.thumbnails import ThumbnailCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+
+def test_thumbnail_cache(tmp_path, monkeypatch):
+    requested = []
+
+    def fake_get(url, timeout):
+        requested.append(url)
+        if "missing0001" in url:
+            return FakeResponse(404)
+        return FakeResponse(200, b"\xff" * 100)
+
+    monkeypatch.setattr(thumbnails.requests, "get", fake_get)
+    cache = ThumbnailCache(tmp_path, max_bytes=250)
+
+    assert cache.get_url("video000001") == "https://i.ytimg.com/vi/video000001/mqdefault.jpg"
+    cache.prefetch(["video000001", "video000002", "", "missing0001"])
+    cache.executor.shutdown(wait=True)
+    assert len(requested) == 3
+    assert cache.get_url("video000001") == "/thumbnails/video000001.jpg"
+    assert cache.get_url("missing0001") == "https://i.ytimg.com/vi/missing0001/mqdefault.jpg"
+
+    # video000001 was used more recently than video000002
+    os.utime(tmp_path / "video000002.jpg", (0, 0))
+    cache = ThumbnailCache(tmp_path, max_bytes=250)
+    assert cache.total_bytes == 200
+    cache.prefetch(["video000003", "video000001"])
+    cache.executor.shutdown(wait=True)
+    assert len(requested) == 4
+    assert sorted(os.listdir(tmp_path)) == ["video000001.jpg", "video000003.jpg"]
+    assert cache.total_bytes == 200
@@ -1,19 +1,25 @@
 import functools
+import io
 import logging
 import random
-from time import time
+import re
+from threading import Thread
+from time import perf_counter, time
 
-import matplotlib.pyplot as plt
 import numpy as np
 import panel as pn
 import param
-from neo4j import GraphDatabase
 
+from yourtube.build_pool import get_build_pool
+from yourtube.driver import get_driver
+from yourtube.metrics import observe_duration, timed
+from yourtube.profiling import profile_if_slow
 from yourtube.file_operations import (
     user_takeout_exists,
     update_user_takeout,
-    load_joined_graph_of_many_users,
     get_saved_clusters,
+    start_creating_user,
+    finish_creating_user,
 )
 from yourtube.html_components import (
     MaterialButton,
@@ -22,13 +28,12 @@ from yourtube.html_components import (
     VideoGrid,
     required_modules,
 )
-from yourtube.recommendation import Engine
 from yourtube.config import Config, Msgs
 
 logger = logging.getLogger("yourtube")
 logger.setLevel(logging.DEBUG)
 
-plt.style.use("dark_background")
+video_id_regex = re.compile(r"(?:v=|youtu\.be/|^)([\w-]{11})(?:$|[^\w-])")
 
 # pn.extension doesn't support loading
 pn.extension(
@@ -98,8 +103,10 @@ class UI:
         )
         save_cluster_button.on_click = self.save_current_cluster
 
+        self.username = parameters.username
         self.saved_cluster_selector = pn.widgets.Select(
-            name="Saved clusters", options=get_saved_clusters(parameters.username)
+            name="Saved clusters",
+            options=get_saved_clusters(self.username, limit=Config.saved_clusters_in_selector),
         )
         load_cluster_button = MaterialButton(
             label="Load cluster",
@@ -107,6 +114,21 @@ class UI:
         )
         load_cluster_button.on_click = self.load_cluster
 
+        self.search_field = MaterialTextField(
+            label="Search",
+            value="",
+        )
+        search_button = MaterialButton(
+            label="Search",
+            style="width: 110px; height:57px",
+        )
+        search_button.on_click = self.search
+        more_like_this_button = MaterialButton(
+            label="More like this",
+            style="width: 110px; height:57px",
+        )
+        more_like_this_button.on_click = self.more_like_this
+
         top = pn.Row(
             go_back_button,
             pn.Spacer(width=20),
@@ -120,6 +142,10 @@ class UI:
             pn.Spacer(width=20),
             self.saved_cluster_selector,
             load_cluster_button,
+            pn.Spacer(width=20),
+            self.search_field,
+            search_button,
+            more_like_this_button,
             required_modules,
         )
 
@@ -177,16 +203,22 @@ class UI:
 
     def display_video_grid(self):
         ids = self.engine.get_video_ids(self.get_recommendation_parameters())
+        self.display_videos(ids)
+
+    def display_videos(self, ids):
         ids = np.array(ids).flatten()
 
         texts = []
+        thumbnail_urls = []
         for i, id_ in enumerate(ids):
             if id_ == "" or self.engine.is_video_down(id_):
                 # it's "" if its cluster turned out empty after filtering
                 # it can also be down
                 ids[i] = "RqJVa0fl01w"  # confused Travolta
                 texts.append("-")
+                thumbnail_urls.append(self.engine.get_thumbnail_url(ids[i]))
                 continue
+            thumbnail_urls.append(self.engine.get_thumbnail_url(id_))
             # logger.debug(id_)
             title = self.engine.get_video_title(id_)
             # TODO refine and show video info
@@ -198,9 +230,7 @@ class UI:
             text = title
             texts.append(text)
 
-        self.video_wall.ids = list(ids)
-        self.video_wall.texts = texts
-        self.video_wall.update()
+        self.video_wall.set_cells(list(ids), texts, thumbnail_urls)
 
     def choose_column(self, _change, i):
         exit_code = self.engine.choose_column(i)
@@ -224,18 +254,63 @@ class UI:
 
     def save_current_cluster(self, _event):
         self.engine.save_current_cluster(self.cluster_to_save_name_field.value)
+        self.saved_cluster_selector.options = get_saved_clusters(
+            self.username, limit=Config.saved_clusters_in_selector
+        )
 
     def load_cluster(self, _event):
         self.engine.load_cluster(self.saved_cluster_selector.value)
 
+    def search(self, _event):
+        query = self.search_field.value
+        start_time = time()
+        id_ = self.engine.search(query)
+        logger.info(f"searching for {query!r} took {time() - start_time:.3f} seconds")
+        if id_ is None:
+            self.show_message("no videos in this graph match this search")
+            return
+
+        self.show_message(f"{self.engine.get_branch_id()}: {self.engine.get_video_title(id_)}")
+        self.update_displayed_videos()
+
+    def more_like_this(self, _event):
+        # the search field can contain a video id or its url
+        match = video_id_regex.search(self.search_field.value)
+        if match is None:
+            self.show_message("to see similar videos, enter a video url or id in the search field")
+            return
+        video_id = match[1]
+
+        start_time = time()
+        similar_ids = self.engine.more_like_this(video_id)
+        logger.info(f"finding videos similar to {video_id} took {time() - start_time:.3f} seconds")
+        if similar_ids is None:
+            self.show_message("this video isn't scraped yet")
+            return
+
+        # fill the rest of the wall with empty clusters
+        num_of_videos = self.num_of_groups * self.videos_in_group
+        similar_ids += [""] * (num_of_videos - len(similar_ids))
+        self.show_message(f"videos similar to: {self.engine.get_video_title(video_id)}")
+        self.display_videos(similar_ids)
+
+    @profile_if_slow(
+        "update_displayed_videos",
+        lambda self, *args: dict(
+            user=self.username,
+            branch=self.engine.get_branch_id(),
+            **self.get_recommendation_parameters(),
+        ),
+    )
     def update_displayed_videos(self, _widget=None, _event=None, _data=None):
-        # display children sizes
-        for button, child in zip(self.choice_buttons, self.engine.tree_climber.children):
-            size = len(child.pre_order())
-            button.label = f"{size}"
+        with timed("update_displayed_videos", self.username):
+            # display children sizes
+            for button, child in zip(self.choice_buttons, self.engine.tree_climber.children):
+                size = len(child.pre_order())
+                button.label = f"{size}"
 
-        self.display_video_grid()
-        self.engine.fetch_videos(self.get_recommendation_parameters())
+            self.display_video_grid()
+            self.engine.fetch_videos(self.get_recommendation_parameters())
 
     def show_message(self, message):
         info_template = '<div id="message_output" style="width:400px;">{}</div>'
@@ -260,19 +335,60 @@ parameters = Parameters(seed=random.randint(1, 9999))
 takeout_file_input = pn.widgets.FileInput(accept=".zip", multiple=False)
 # pn.state.location.sync(parameters, ["username"])
 
-driver = GraphDatabase.driver("neo4j://neo4j:7687", auth=("neo4j", Config.neo4j_password))
+# the driver is shared by all the sessions
+driver = get_driver()
+# incremented on each refresh, so that only the newest engine build of this session is shown
+build_generation = 0
 
 # # only sane templates are FastListTemplate and VanillaTemplate and MaterialTemplate
 template = pn.template.MaterialTemplate(title="YourTube", theme=pn.template.DarkTheme)
 template.main.append(pn.Row([pn.Spacer()]))
 
 
+def create_new_user(username, takeout_file):
+    message = pn.pane.Markdown(Msgs.processing_takeout.format("uploading"))
+    progress = pn.indicators.Progress(value=0, max=100, width=400)
+    template.main[0][0] = pn.Column(message, progress)
+
+    def show_progress(stage, fraction):
+        message.object = Msgs.processing_takeout.format(stage)
+        progress.value = int(fraction * 100)
+
+    try:
+        takeout_ok = update_user_takeout(username, takeout_file, show_progress)
+    except Exception:
+        # it runs in a thread, so an error wouldn't be shown to the user otherwise
+        logger.exception(f"failed to process the takeout of user: {username}")
+        takeout_ok = False
+    finally:
+        finish_creating_user(username)
+    if takeout_ok:
+        logger.info(f"created new user: {username}")
+        template.main[0][0] = pn.pane.Markdown(Msgs.user_created)
+    else:
+        logger.error(f"failed to create a new user: {username}")
+        template.main[0][0] = pn.pane.Markdown(Msgs.user_creation_failed)
+
+
+def get_parameters_metadata(*args, **kwargs):
+    return dict(
+        user=parameters.username,
+        seed=parameters.seed,
+        clustering_balance_a=parameters.clustering_balance_a,
+        clustering_balance_b=parameters.clustering_balance_b,
+        num_of_groups=parameters.num_of_groups,
+        videos_in_group=parameters.videos_in_group,
+    )
+
+
+@profile_if_slow("refresh", get_parameters_metadata)
 def refresh(_event):
     # it looks that it needs to be global, so that ui gets dereferenced, and can disappear
     # otherwise it is still bound to the new panel buttons, probably due to some panel quirk
     # and this causes each click to be executed double
     global ui, engine, G, takeout_file_input
     logger.info("refreshed")
+    logger.info(f"neo4j connection pool: {driver.get_stats()}")
     template.main[0][0] = pn.Spacer()
 
     usernames = parameters.username.split("+")
@@ -286,14 +402,17 @@ def refresh(_event):
             template.main[0][0] = pn.pane.Markdown(Msgs.user_doesnt_exist.format(username))
             return
         elif (not user_takeout_exists(username)) and (takeout_file_input.value is not None):
+            if not start_creating_user(username):
+                # the takeout only exists when it's fully extracted, so it can be uploaded again
+                logger.info(f"user is already being created: {username}")
+                template.main[0][0] = pn.pane.Markdown(Msgs.user_being_created)
+                return
             logger.info("creating new user")
-            takeout_ok = update_user_takeout(username, takeout_file_input)
-            if takeout_ok:
-                logger.info(f"created new user: {username}")
-                template.main[0][0] = pn.pane.Markdown(Msgs.user_created)
-            else:
-                logger.error(f"failed to create a new user: {username}")
-                template.main[0][0] = pn.pane.Markdown(Msgs.user_creation_failed)
+            # processing a big takeout takes a while, so don't block the server
+            # FileInput sends the whole upload through the websocket, so it's already in memory
+            # here, and only the saving and extracting which follow keep their memory bounded
+            takeout_file = io.BytesIO(takeout_file_input.value)
+            Thread(target=create_new_user, args=(username, takeout_file)).start()
             return
         elif user_takeout_exists(username) and (takeout_file_input.value is not None):
             logger.info(f"someone tried to create a new user with existing username: {username}")
@@ -310,26 +429,91 @@ def refresh(_event):
                 template.main[0][0] = pn.pane.Markdown(Msgs.user_doesnt_exist.format(username))
                 return
 
-    start_time = time()
-    # G = load_graph_from_neo4j(driver, user=parameters.username)
-    G = load_joined_graph_of_many_users(driver, usernames)
-    logger.info(f"loading graph took: {time() - start_time:.3f} seconds")
-    logger.info(f"user: {parameters.username}, graph size: {len(G.nodes)}")
-    if len(G.nodes) == 0:
-        logger.error(f"user: {parameters.username}, tried to load an empty graph")
-        template.main[0][0] = pn.pane.Markdown(Msgs.trying_to_load_empty_graph)
-        return
-
     # ensure correct param values
     if parameters.seed < 1 or parameters.seed > 9999:
         parameters.seed = random.randint(1, 9999)
 
-    engine = Engine(G, driver, parameters)
-    ui = UI(engine, parameters)
-    engine.display_callback = ui.display_video_grid
-    engine.message_callback = ui.show_message
+    # deep link to some branch, like ?branch=1323
+    branch_id = pn.state.session_args.get("branch", [b""])[0].decode()
+
+    # loading the graph and clustering it takes a while, so it's done in the build pool,
+    # shared with the other sessions of the same users
+    global build_generation
+    build_generation += 1
+    message = pn.pane.Markdown(Msgs.loading.format("waiting"))
+    progress = pn.indicators.Progress(value=0, max=100, width=400)
+    template.main[0][0] = pn.Column(message, progress)
+
+    def show_progress(stage, fraction):
+        message.object = Msgs.loading.format(stage)
+        progress.value = int(fraction * 100)
+
+    a, b = parameters.clustering_balance_a, parameters.clustering_balance_b
+    future = get_build_pool().submit(
+        (tuple(sorted(usernames)), a, b),
+        load_clustered_graph,
+        usernames,
+        a,
+        b,
+        progress_callback=show_progress,
+    )
+    Thread(
+        target=build_engine,
+        args=(future, branch_id, build_generation, show_progress, perf_counter()),
+    ).start()
+
+
+# refresh only starts it, so it's profiled separately
+@profile_if_slow("load_clustered_graph", get_parameters_metadata)
+def load_clustered_graph(usernames, balance_alpha, balance_beta, progress_callback):
+    # imported here, because importing it takes a while
+    from yourtube import recommendation
+
+    return recommendation.load_clustered_graph(
+        driver, usernames, balance_alpha, balance_beta, progress_callback
+    )
+
+
+def build_engine(future, branch_id, generation, show_progress, refresh_time):
+    global ui, engine, G
+    try:
+        new_G, clustering = future.result()
+        if generation != build_generation:
+            # this session was refreshed again in the meantime
+            return
+        if clustering is None:
+            logger.error(f"user: {parameters.username}, tried to load an empty graph")
+            template.main[0][0] = pn.pane.Markdown(Msgs.trying_to_load_empty_graph)
+            return
+
+        from yourtube.recommendation import Engine
+
+        show_progress("ranking videos", 0.9)
+        # the graph is shared with the other sessions which joined this build,
+        # and each engine adds the scraped videos to its graph, so it needs its own copy
+        G = new_G.copy()
+        engine = Engine(G, driver, parameters, clustering)
+        # go to the branch before the UI displays the first wall, so it's displayed once
+        if branch_id != "":
+            branch_exit_code = engine.go_to_branch(branch_id)
+        ui = UI(engine, parameters)
+        engine.display_callback = ui.display_video_grid
+        engine.message_callback = ui.show_message
+    except Exception:
+        logger.exception(f"user: {parameters.username}, failed to build the engine")
+        template.main[0][0] = pn.pane.Markdown(Msgs.loading_failed)
+        return
+
+    if branch_id != "":
+        if branch_exit_code == -1:
+            ui.show_message(f"there is no branch: {branch_id}")
+        else:
+            ui.show_message(branch_id)
 
-    template.main[0][0] = ui.whole_output
+    if generation == build_generation:
+        template.main[0][0] = ui.whole_output
+        # the time the user waited for the wall
+        observe_duration("refresh", perf_counter() - refresh_time, parameters.username)
 
 
 refresh_button = pn.widgets.Button(name="Refresh")
@@ -340,4 +524,5 @@ template.sidebar.append(takeout_file_input)
 template.sidebar.append(refresh_button)
 template.servable()
 
-refresh(None)
+# run it after the page is sent, so that the user sees it at once
+pn.state.onload(lambda: refresh(None))
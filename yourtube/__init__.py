@@ -1,18 +1,17 @@
 import os
 import pathlib
-import subprocess
 from pathlib import Path
 
-from neo4j import GraphDatabase
-
 from yourtube.neo4j_queries import create_username_constraint, create_video_id_constraint
 from yourtube.file_operations import (
     graph_path_template,
     clustering_cache_template,
     saved_clusters_template,
     takeouts_template,
+    takeout_cache_template,
+    ingest_manifest_template,
+    thumbnails_path,
 )
-from yourtube.config import Config
 
 __version__ = "0.7.0"
 
@@ -23,11 +22,23 @@ installer_path = os.path.join(dir_, "install.sh")
 
 
 def run():
-    # TODO once poetry-core 1.1.0 drops, this could be made more elegantly, directly with a bash script
-    subprocess.run(["panel", "serve", "--show", "--port=8866", app_path])
-    # "--autoreload",
-    # if this command cannot import yourtube, setting PYTHONPATH is needed
-    # https://stackoverflow.com/questions/37275033/running-export-command-with-pythons-subprocess-does-not-work
+    # imported here, because importing panel takes a while
+    import panel as pn
+
+    from yourtube.metrics import get_metrics_handler
+    from yourtube.thumbnails import thumbnails_route
+
+    Path(thumbnails_path).mkdir(parents=True, exist_ok=True)
+    # the app is served in this process, so that it can also serve its metrics
+    pn.serve(
+        {"YourTube": app_path},
+        port=8866,
+        show=True,
+        # cached thumbnails are served from local storage
+        static_dirs={thumbnails_route: thumbnails_path},
+        # metrics in the Prometheus text format
+        extra_patterns=[(r"/metrics", get_metrics_handler())],
+    )
 
 
 def install():
@@ -36,9 +47,14 @@ def install():
     Path(clustering_cache_template).parent.mkdir(parents=True, exist_ok=True)
     Path(saved_clusters_template).parent.parent.mkdir(parents=True, exist_ok=True)
     Path(takeouts_template).parent.mkdir(parents=True, exist_ok=True)
+    Path(takeout_cache_template).parent.mkdir(parents=True, exist_ok=True)
+    Path(ingest_manifest_template).parent.mkdir(parents=True, exist_ok=True)
+    Path(thumbnails_path).mkdir(parents=True, exist_ok=True)
 
     print("\n\nSetting up database...")
-    driver = GraphDatabase.driver("neo4j://neo4j:7687", auth=("neo4j", Config.neo4j_password))
+    from yourtube.driver import get_driver
+
+    driver = get_driver()
     # this creates neeeded constraints (which by the way sets up indexes)
     with driver.session() as s:
         s.write_transaction(create_video_id_constraint)
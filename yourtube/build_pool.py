@@ -0,0 +1,79 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+
+class BuildPool:
+    """Runs slow builds in a few worker threads, so that they don't block the server.
+
+    A build submitted with the same key as a running one isn't started again, instead it shares
+    the result and the progress of the running one.
+    """
+
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="build")
+        self.lock = threading.Lock()
+        # key -> (future, progress callbacks, last progress)
+        self.builds = dict()
+
+    def submit(self, key, fn, *args, progress_callback=None):
+        """Runs fn(*args, progress_callback=...) in the pool, unless a build with this key runs.
+
+        Progress callbacks take a stage name and a fraction of the work done.
+        Returns a future of the result.
+        """
+        with self.lock:
+            if key in self.builds:
+                future, callbacks, last_progress = self.builds[key]
+                if progress_callback is not None:
+                    callbacks.append(progress_callback)
+                joined = True
+                last_progress = list(last_progress)
+            else:
+                callbacks = [] if progress_callback is None else [progress_callback]
+                last_progress = []
+                future = self.executor.submit(
+                    fn,
+                    *args,
+                    progress_callback=functools.partial(self._report_progress, key),
+                )
+                self.builds[key] = (future, callbacks, last_progress)
+                joined = False
+
+        if joined:
+            logger.info(f"joining the running build: {key}")
+            # the new one can't see the progress reported so far, so repeat the last one
+            if progress_callback is not None and last_progress != []:
+                progress_callback(*last_progress)
+        else:
+            future.add_done_callback(functools.partial(self._forget, key))
+        return future
+
+    def _report_progress(self, key, stage, fraction):
+        with self.lock:
+            _, callbacks, last_progress = self.builds[key]
+            last_progress[:] = [stage, fraction]
+            callbacks = list(callbacks)
+        for callback in callbacks:
+            try:
+                callback(stage, fraction)
+            except Exception:
+                # a closed session mustn't break the build of the others
+                logger.exception(f"progress callback of the build {key} failed")
+
+    def _forget(self, key, future):
+        with self.lock:
+            if key in self.builds and self.builds[key][0] is future:
+                del self.builds[key]
+
+
+@functools.lru_cache(maxsize=None)
+def get_build_pool():
+    """Returns the build pool shared by all the sessions."""
+    return BuildPool(Config.engine_build_workers)
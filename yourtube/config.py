@@ -12,12 +12,86 @@ class Config:
     # when scraping periodically, skip videos which have been already scraped recently
     periodic_scraping_skip_if_fresher_than = seconds_in_day * 7
 
+    # at most this many videos are scraped in one periodic scraping, the stalest and most important
+    # first, so that the load is spread evenly; None means no limit
+    periodic_scraping_budget = 20000
+
+    # when scraping periodically, progress is saved after scraping this many videos
+    scraping_checkpoint_interval = 1000
+
+    # one scraper reads at most this many ids ahead of the ones already saved,
+    # so the memory used by scraping doesn't grow with the number of ids
+    scraping_window = 256
+
+    # number of processes fetching youtube pages, shared by all the sessions
+    max_fetch_workers = 8
+
+    # when searching, at most this many matching videos are ranked, to keep the search fast
+    # they're read in pages, and reading stops when there are enough results
+    search_max_candidates = 10000
+    search_page_size = 5000
+    # at most this many best matching videos are returned by a search
+    search_results_limit = 50
+
+    # titles and keywords are turned into vectors of this many dimensions, to find similar videos
+    # changing it requires deleting the similarity index
+    similarity_dimensions = 128
+    similarity_hashes_per_token = 4
+    similarity_keyword_weight = 0.5
+
+    # thumbnails are cached on disk, and the least recently used are evicted above this size
+    thumbnail_cache_max_bytes = 2**30
+    thumbnail_fetch_workers = 8
+
+    # number of threads fetching transcripts
+    transcript_fetch_workers = 8
+
+    # fetching a page is retried with exponential backoff, starting at this many seconds
+    fetch_backoff_base = 2
+    fetch_max_attempts = 4
+    fetch_timeout = 60
+
+    # when a bigger fraction of recent requests fails, fewer requests are sent at once
+    max_fetch_error_rate = 0.2
+    fetch_error_rate_window = 50
+
+    # number of threads loading graphs and clustering them, for all the sessions together
+    # clustering holds the GIL, so with more of them the server would respond slowly
+    engine_build_workers = 2
+
+    # calls slower than this many seconds are profiled, and their profiles are saved
+    # None turns profiling off, because it slows down all the profiled calls
+    profile_slower_than = None
+    max_saved_profiles = 100
+
+    # reports of scraping runs kept in data/scrape_reports
+    max_saved_scrape_reports = 100
+
     # to improve graph loading times, keep a cache of the graph loaded from neo4j, for this time:
     graph_cache_time = seconds_in_day * 3
 
-    # password to the neo4j database
+    # uploaded takeouts are saved and extracted in chunks of this size
+    takeout_chunk_size = 2**20
+
+    # takeout members bigger than this are rejected
+    max_takeout_member_size = 2**30
+
+    # how many saved clusters can be listed in the saved clusters selector
+    saved_clusters_in_selector = 1000
+
+    # address and credentials of the neo4j database
+    # they can be overridden with YOURTUBE_NEO4J_URI, YOURTUBE_NEO4J_USER, YOURTUBE_NEO4J_PASSWORD
+    neo4j_uri = "neo4j://neo4j:7687"
+    neo4j_user = "neo4j"
     neo4j_password = "yourtube"
 
+    # all the sessions and scraping threads share one connection pool of this size
+    neo4j_max_connection_pool_size = 200
+    # seconds to wait for a free connection, before failing
+    neo4j_connection_acquisition_timeout = 60
+    # records fetched from neo4j in one batch, bigger is faster for loading whole graphs
+    neo4j_fetch_size = 10000
+
 
 @dataclass
 class Msgs:
@@ -30,10 +104,24 @@ class Msgs:
         You should be able to use the app tomorrow, after your videos get scraped.\n
         Thanks for your patience!
     """
+    processing_takeout = """
+        #### Processing your takeout: {}
+    """
+    user_being_created = """
+        #### Your takeout is still being processed.
+        Wait until it's done, it can take a few minutes.
+    """
     user_creation_failed = """
         #### Failed to create a new user.
         The file you uploaded doesn't seem to be a valid youtube takeout.
     """
+    loading = """
+        #### Loading your videos: {}
+    """
+    loading_failed = """
+        #### Something went wrong while loading your videos :(
+        Try refreshing the page later.
+    """
     trying_to_load_empty_graph = """
         #### There's nothing to show to you :(
         Either we didn't scrape your videos yet, or your yourtube takeout was empty.
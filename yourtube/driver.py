@@ -0,0 +1,179 @@
+import functools
+import logging
+import os
+import threading
+from time import time
+
+from yourtube.metrics import register_collector, timed
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+
+class InstrumentedSession:
+    """A neo4j session, which gives its slot back to the driver when it's closed."""
+
+    def __init__(self, session, release):
+        self._session = session
+        self._release = release
+        self._closed = False
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._session.close()
+        finally:
+            self._release()
+
+    def read_transaction(self, transaction_function, *args, **kwargs):
+        with timed(f"neo4j_{transaction_function.__name__}"):
+            return self._session.read_transaction(transaction_function, *args, **kwargs)
+
+    def write_transaction(self, transaction_function, *args, **kwargs):
+        with timed(f"neo4j_{transaction_function.__name__}"):
+            return self._session.write_transaction(transaction_function, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class InstrumentedDriver:
+    """The neo4j driver, which measures how its connection pool is used.
+
+    Each session can hold one connection, so at most max_sessions sessions are open at once,
+    and the next ones wait for a free slot. It's measured how long they wait.
+    """
+
+    def __init__(self, driver, max_sessions, acquisition_timeout):
+        self._driver = driver
+        self.max_sessions = max_sessions
+        self.acquisition_timeout = acquisition_timeout
+        self.slots = threading.BoundedSemaphore(max_sessions)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.acquisitions = 0
+        self.acquisition_wait_total = 0.0
+        self.acquisition_wait_max = 0.0
+        self.acquisition_timeouts = 0
+
+    def session(self, **config):
+        start_time = time()
+        if not self.slots.acquire(timeout=self.acquisition_timeout):
+            with self.lock:
+                self.acquisition_timeouts += 1
+            raise TimeoutError(
+                f"no free neo4j connection after {self.acquisition_timeout} seconds, "
+                f"all {self.max_sessions} are used"
+            )
+        wait = time() - start_time
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.acquisitions += 1
+            self.acquisition_wait_total += wait
+            self.acquisition_wait_max = max(self.acquisition_wait_max, wait)
+        try:
+            return InstrumentedSession(self._driver.session(**config), self._release)
+        except Exception:
+            self._release()
+            raise
+
+    def _release(self):
+        with self.lock:
+            self.in_use -= 1
+        self.slots.release()
+
+    def get_stats(self):
+        """Returns the pool utilisation and the acquisition wait times, in seconds."""
+        with self.lock:
+            return dict(
+                in_use=self.in_use,
+                max_sessions=self.max_sessions,
+                utilisation=self.in_use / self.max_sessions,
+                peak_in_use=self.peak_in_use,
+                acquisitions=self.acquisitions,
+                acquisition_wait_total=self.acquisition_wait_total,
+                acquisition_wait_max=self.acquisition_wait_max,
+                acquisition_timeouts=self.acquisition_timeouts,
+            )
+
+    def collect_metrics(self):
+        stats = self.get_stats()
+        return [
+            (
+                "yourtube_neo4j_sessions_in_use",
+                "gauge",
+                "Open neo4j sessions, each can hold a connection.",
+                [(None, stats["in_use"])],
+            ),
+            (
+                "yourtube_neo4j_sessions_max",
+                "gauge",
+                "Maximum number of open neo4j sessions, equal to the pool size.",
+                [(None, stats["max_sessions"])],
+            ),
+            (
+                "yourtube_neo4j_acquisitions_total",
+                "counter",
+                "Opened neo4j sessions.",
+                [(None, stats["acquisitions"])],
+            ),
+            (
+                "yourtube_neo4j_acquisition_wait_seconds_total",
+                "counter",
+                "Time spent waiting for a free neo4j session.",
+                [(None, stats["acquisition_wait_total"])],
+            ),
+            (
+                "yourtube_neo4j_acquisition_timeouts_total",
+                "counter",
+                "Times when no neo4j session became free in time.",
+                [(None, stats["acquisition_timeouts"])],
+            ),
+        ]
+
+    def close(self):
+        self._driver.close()
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_driver():
+    """Returns the neo4j driver shared by the whole process, its connection pool is thread safe.
+
+    Address and credentials can be set with the environment variables:
+    YOURTUBE_NEO4J_URI, YOURTUBE_NEO4J_USER and YOURTUBE_NEO4J_PASSWORD
+    """
+    # imported here, because importing neo4j takes a while
+    from neo4j import GraphDatabase
+
+    uri = os.environ.get("YOURTUBE_NEO4J_URI", Config.neo4j_uri)
+    user = os.environ.get("YOURTUBE_NEO4J_USER", Config.neo4j_user)
+    password = os.environ.get("YOURTUBE_NEO4J_PASSWORD", Config.neo4j_password)
+    logger.info(f"connecting to neo4j at {uri}, as {user}")
+    driver = GraphDatabase.driver(
+        uri,
+        auth=(user, password),
+        max_connection_pool_size=Config.neo4j_max_connection_pool_size,
+        connection_acquisition_timeout=Config.neo4j_connection_acquisition_timeout,
+        fetch_size=Config.neo4j_fetch_size,
+    )
+    instrumented_driver = InstrumentedDriver(
+        driver,
+        Config.neo4j_max_connection_pool_size,
+        Config.neo4j_connection_acquisition_timeout,
+    )
+    register_collector(instrumented_driver.collect_metrics)
+    return instrumented_driver
@@ -1,22 +1,31 @@
 import csv
+import functools
 import json
 import logging
 import os
 import pickle
 import re
+import shutil
+import sqlite3
+import threading
 import zipfile
+import zlib
 import glob
+from contextlib import closing
+from datetime import datetime
 from time import mktime, time
 from pathlib import Path
 
 import networkx as nx
-import pickledb
+import numpy as np
 from dateutil import parser
+from scipy.cluster.hierarchy import ClusterNode
 
 from yourtube.neo4j_queries import (
     get_all_user_relevant_playlist_info,
     get_limited_user_relevant_video_info,
 )
+from yourtube.metrics import count_cache_request, timed
 from yourtube.config import Config
 
 logger = logging.getLogger("yourtube")
@@ -28,7 +37,19 @@ data_path = os.path.join(os.sep, "yourtube", "data")
 graph_path_template = os.path.join(data_path, "graph_cache", "{}.pickle")
 clustering_cache_template = os.path.join(data_path, "clustering_cache", "{}.pickle")
 saved_clusters_template = os.path.join(data_path, "saved_clusters", "{}", "{}")
+saved_clusters_catalog_path = os.path.join(data_path, "saved_clusters", "catalog.sqlite")
+# legacy, transcripts are now stored in transcripts_db_path
 transcripts_path = os.path.join(data_path, "transcripts.json")
+transcripts_db_path = os.path.join(data_path, "transcripts.sqlite")
+search_index_path = os.path.join(data_path, "search_index.sqlite")
+similarity_ids_path = os.path.join(data_path, "similarity", "ids.txt")
+similarity_vectors_path = os.path.join(data_path, "similarity", "vectors.float32")
+thumbnails_path = os.path.join(data_path, "thumbnails")
+profiles_path = os.path.join(data_path, "profiles")
+takeout_cache_template = os.path.join(data_path, "takeout_cache", "{}.pickle")
+ingest_manifest_template = os.path.join(data_path, "ingest_manifests", "{}.pickle")
+scraping_state_path = os.path.join(data_path, "scraping_state.pickle")
+scrape_reports_path = os.path.join(data_path, "scrape_reports")
 
 takeouts_template = os.path.join(data_path, "takeouts", "{}")
 playlists_path_template = os.path.join(
@@ -37,17 +58,27 @@ playlists_path_template = os.path.join(
 history_path_template = os.path.join(
     takeouts_template, "Takeout", "YouTube and YouTube Music", "history", "watch-history.html"
 )
+history_json_path_template = os.path.join(
+    takeouts_template, "Takeout", "YouTube and YouTube Music", "history", "watch-history.json"
+)
 
 
 def load_graph_from_neo4j(driver, user):
+    with timed("load_graph_from_neo4j", user):
+        return _load_graph_from_neo4j(driver, user)
+
+
+def _load_graph_from_neo4j(driver, user):
     # see if it's cached
     graph_path = graph_path_template.format(user)
     if os.path.isfile(graph_path):
         time_modified = os.path.getmtime(graph_path)
         if time() - time_modified < Config.graph_cache_time:
             logger.info("using cached graph")
+            count_cache_request("graph", hit=True)
             with open(graph_path, "rb") as handle:
                 return pickle.load(handle)
+    count_cache_request("graph", hit=False)
 
     # load info about which videos have been watched
     id_to_watched_times = get_youtube_watched_ids(user)
@@ -133,8 +164,100 @@ def load_joined_graph_of_many_users(driver, users):
     return joined_graph
 
 
+class TranscriptStore:
+    """Transcripts of videos, stored in SQLite as compressed JSON.
+
+    Each transcript is committed when it's set, and only the requested ones are read.
+    None is stored for videos which have no transcript, so that they aren't fetched again.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = transcripts_db_path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    video_id TEXT PRIMARY KEY,
+                    transcript BLOB
+                )
+                """
+            )
+            # user_version marks that the transcripts from the old JSON file were imported
+            (store_version,) = self.conn.execute("PRAGMA user_version").fetchone()
+            if store_version == 0:
+                self._import_legacy_transcripts()
+                self.conn.execute("PRAGMA user_version = 1")
+
+    def _import_legacy_transcripts(self):
+        if not os.path.isfile(transcripts_path):
+            return
+        with open(transcripts_path, "r", encoding="utf-8") as file:
+            legacy_transcripts = json.load(file)
+        logger.info(f"importing {len(legacy_transcripts)} transcripts from {transcripts_path}")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO transcripts VALUES (?, ?)",
+            ((id_, self._compress(transcript)) for id_, transcript in legacy_transcripts.items()),
+        )
+
+    @staticmethod
+    def _compress(transcript):
+        if transcript is None:
+            return None
+        return zlib.compress(json.dumps(transcript).encode("utf-8"))
+
+    @staticmethod
+    def _decompress(blob):
+        if blob is None:
+            return None
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def __setitem__(self, id_, transcript):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transcripts VALUES (?, ?)",
+                (id_, self._compress(transcript)),
+            )
+
+    def __getitem__(self, id_):
+        row = self.conn.execute(
+            "SELECT transcript FROM transcripts WHERE video_id = ?", (id_,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(id_)
+        return self._decompress(row[0])
+
+    def get(self, id_, default=None):
+        try:
+            return self[id_]
+        except KeyError:
+            return default
+
+    def __contains__(self, id_):
+        query = "SELECT 1 FROM transcripts WHERE video_id = ?"
+        return self.conn.execute(query, (id_,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+    def fetched_ids(self):
+        """Returns the set of ids of videos which were already fetched."""
+        return {id_ for (id_,) in self.conn.execute("SELECT video_id FROM transcripts")}
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def get_transcripts_db():
-    return pickledb.load(transcripts_path, auto_dump=False)
+    return TranscriptStore()
 
 
 def get_playlist_names(username):
@@ -160,7 +283,11 @@ def get_freetube_favorites_ids():
 
 
 def timestamp_to_seconds(timestamp):
-    timelocal = parser.parse(timestamp)
+    try:
+        # fast path for ISO timestamps, used in playlist CSVs and in JSON history
+        timelocal = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        timelocal = parser.parse(timestamp)
     unixtime = mktime(timelocal.utctimetuple())
     # warning: mktime may be inaccurate up to a few hours because of timezones
     # https://stackoverflow.com/a/7852891/11756613
@@ -168,9 +295,46 @@ def timestamp_to_seconds(timestamp):
     return unixtime
 
 
+months = dict(Jan=1, Feb=2, Mar=3, Apr=4, May=5, Jun=6, Jul=7, Aug=8, Sep=9, Oct=10, Nov=11, Dec=12)
+history_timestamp_regex = re.compile(
+    r"(\w{3} \d{1,2}, \d{4}),? (\d{1,2}):(\d{2}):(\d{2})(?: ?([AP]M))?(?: [A-Za-z]+)?"
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_history_date(date_string):
+    # consecutive history entries are usually from the same day, so this is cached
+    month, day, year = date_string.replace(",", "").split(" ")
+    return int(year), months[month], int(day)
+
+
+def history_timestamp_to_seconds(timestamp):
+    """Fast version of timestamp_to_seconds, for timestamps like: Jan 3, 2022, 10:15:32 PM CET
+
+    Gives the same results as timestamp_to_seconds, which is used as a fallback.
+    """
+    # newer takeouts use narrow no-break spaces
+    timestamp = timestamp.replace("\u202f", " ").replace("\xa0", " ")
+    match = history_timestamp_regex.fullmatch(timestamp.strip())
+    if match is None or match[1][:3] not in months:
+        return timestamp_to_seconds(timestamp)
+    date_string, hour, minute, second, am_pm = match.groups()
+    year, month, day = _parse_history_date(date_string)
+    hour = int(hour)
+    if am_pm is not None:
+        hour = hour % 12 + (12 if am_pm == "PM" else 0)
+    # timezone names are ignored, just like dateutil ignores unknown ones
+    # timestamps with explicit offsets aren't matched, so they are parsed by dateutil
+    # and isdst=0, just like in utctimetuple used by timestamp_to_seconds
+    return mktime((year, month, day, hour, int(minute), int(second), 0, 0, 0))
+
+
 def get_youtube_playlist_ids(playlist_name, username):
-    playlists_path = playlists_path_template.format(username)
-    filename = os.path.join(playlists_path, f"{playlist_name}.csv")
+    """Returns (video_ids, times_added) of this playlist, read from the parsed takeout cache."""
+    return get_parsed_takeout(username)["playlists"][playlist_name]
+
+
+def parse_youtube_playlist(filename):
     with open(filename) as file:
         reader = csv.reader(file, delimiter=",")
         data_read = [row for row in reader]
@@ -188,36 +352,258 @@ def get_youtube_playlist_ids(playlist_name, username):
     return video_ids, times_added
 
 
+watched_entry_regex = re.compile(
+    r"Watched.*?https://www.youtube.com\/watch\?v=(.{11}).*?<br>((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) .*?)</div>"
+)
+html_entry_start = '<div class="outer-cell'
+
+
+def _iterate_html_history(file, chunk_size):
+    """Yields (video_id, timestamp) pairs, reading the file chunk by chunk.
+
+    Each chunk is cut at the start of the last entry in it, so that no entry is split.
+    """
+    buffer = ""
+    for chunk in iter(lambda: file.read(chunk_size), ""):
+        buffer += chunk
+        boundary = buffer.rfind(html_entry_start)
+        if boundary <= 0:
+            continue
+        yield from watched_entry_regex.findall(buffer, 0, boundary)
+        buffer = buffer[boundary:]
+    yield from watched_entry_regex.findall(buffer)
+
+
+def _iterate_json_array(file, chunk_size):
+    """Yields the elements of a JSON array, reading the file chunk by chunk."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    while True:
+        # skip separators between the elements
+        while position < len(buffer) and buffer[position] in "[, \t\r\n":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position == len(buffer):
+                raise json.JSONDecodeError("no element in buffer", buffer, position)
+            element, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                if buffer[position:].strip() == "":
+                    return
+                raise
+            chunk = file.read(chunk_size)
+            eof = chunk == ""
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield element
+
+
+def _iterate_json_history(file, chunk_size):
+    """Yields (video_id, timestamp) pairs from a JSON watch history."""
+    for entry in _iterate_json_array(file, chunk_size):
+        match = re.search(r"watch\?v=(.{11})", entry.get("titleUrl", ""))
+        if match is None or not entry.get("title", "").startswith("Watched"):
+            # the video was removed, or it's not a watched video
+            continue
+        yield match[1], entry["time"]
+
+
 def get_youtube_watched_ids(username):
     """Returns a dictionary, where keys are video ids,
     and each value is a list of times when this video has been watched (in unix time).
 
     Unwatched videos aren't in this dictionary.
+    It is read from the parsed takeout cache.
     """
-    history_path = history_path_template.format(username)
-    with open(history_path, encoding="utf-8") as file:
-        lines = file.readlines()
-    text = " ".join(lines)
+    return get_parsed_takeout(username)["watched"]
 
-    watched = re.findall(
-        r"Watched.*?https://www.youtube.com\/watch\?v=(.{11}).*?<br>((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) .*?)</div>",
-        text,
-    )
 
-    ids, timestamps, _ = zip(*watched)
-    unixtimes = [timestamp_to_seconds(timestamp) for timestamp in timestamps]
+def parse_watch_history(history_path, chunk_size=2**20):
+    """Parses the watch history. The result is like in get_youtube_watched_ids.
 
-    id_set = set(ids)
+    Both HTML and JSON formats of the watch history are supported.
+    """
+    if history_path.endswith(".json"):
+        iterate_history = _iterate_json_history
+        to_seconds = timestamp_to_seconds
+    else:
+        iterate_history = _iterate_html_history
+        to_seconds = history_timestamp_to_seconds
 
     id_to_watched_times = dict()
-    for id_ in id_set:
-        id_to_watched_times[id_] = []
-    for id_, watched_time in zip(ids, unixtimes):
-        id_to_watched_times[id_].append(watched_time)
+    with open(history_path, encoding="utf-8") as file:
+        for id_, timestamp in iterate_history(file, chunk_size):
+            id_to_watched_times.setdefault(id_, []).append(to_seconds(timestamp))
 
     return id_to_watched_times
 
 
+def get_history_path(username):
+    """Returns the path of the HTML watch history, or of the JSON one if there's no HTML."""
+    history_path = history_path_template.format(username)
+    if os.path.exists(history_path):
+        return history_path
+    return history_json_path_template.format(username)
+
+
+def _atomic_pickle_dump(obj, path):
+    # write to a temporary file first, so that other processes never read a partial file
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as handle:
+        pickle.dump(obj, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+
+def _atomic_json_dump(obj, path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as handle:
+        json.dump(obj, handle, indent=2)
+    os.replace(temporary_path, path)
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+# username -> (signature of the cache file, parsed takeout)
+# so that the cache file isn't unpickled again on each call
+_parsed_takeouts = dict()
+
+
+def get_parsed_takeout(username):
+    """Returns dict(watched=id_to_watched_times, playlists={playlist_name: (ids, times_added)}).
+
+    Parsing takeout files is slow, so the parsed takeout is cached in a binary file.
+    Each takeout file is parsed again only when its modification time or size changes.
+    """
+    cache_path = takeout_cache_template.format(username)
+    cache = dict(watched=(None, None), playlists=dict())
+    if os.path.isfile(cache_path):
+        cache_signature = _file_signature(cache_path)
+        if _parsed_takeouts.get(username, (None,))[0] == cache_signature:
+            cache = _parsed_takeouts[username][1]
+        else:
+            with open(cache_path, "rb") as handle:
+                cache = pickle.load(handle)
+            _parsed_takeouts[username] = (cache_signature, cache)
+
+    new_cache = dict(watched=cache["watched"], playlists=dict())
+    changed = False
+    history_path = get_history_path(username)
+    history_signature = _file_signature(history_path)
+    if cache["watched"][0] != history_signature:
+        logger.info(f"parsing watch history of user: {username}")
+        new_cache["watched"] = (history_signature, parse_watch_history(history_path))
+        changed = True
+
+    playlists_path = playlists_path_template.format(username)
+    for playlist_name in get_playlist_names(username):
+        filename = os.path.join(playlists_path, f"{playlist_name}.csv")
+        signature = _file_signature(filename)
+        cached_signature, playlist = cache["playlists"].get(playlist_name, (None, None))
+        if cached_signature != signature:
+            playlist = parse_youtube_playlist(filename)
+            changed = True
+        new_cache["playlists"][playlist_name] = (signature, playlist)
+    # some playlists could have been removed
+    changed |= new_cache["playlists"].keys() != cache["playlists"].keys()
+
+    count_cache_request("takeout", hit=not changed)
+    if changed:
+        _atomic_pickle_dump(new_cache, cache_path)
+        _parsed_takeouts[username] = (_file_signature(cache_path), new_cache)
+
+    return dict(
+        watched=new_cache["watched"][1],
+        playlists={name: playlist for name, (_, playlist) in new_cache["playlists"].items()},
+    )
+
+
+def load_ingest_manifest(username):
+    """Returns what has already been ingested from this user's takeout, as a dict:
+
+    rows:
+        set of (playlist_name, video_id, time_added) already saved in the database
+    """
+    manifest_path = ingest_manifest_template.format(username)
+    if not os.path.isfile(manifest_path):
+        return dict(rows=set())
+    with open(manifest_path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def save_ingest_manifest(username, manifest):
+    _atomic_pickle_dump(manifest, ingest_manifest_template.format(username))
+
+
+def load_scraping_state():
+    """Returns the state of periodic scraping, shared by all users, as a dict:
+
+    time_checked:
+        dict from video_id to the last time it was scraped, or skipped because it was fresh
+    """
+    if not os.path.isfile(scraping_state_path):
+        return dict(time_checked=dict())
+    with open(scraping_state_path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def save_scraping_state(scraping_state):
+    _atomic_pickle_dump(scraping_state, scraping_state_path)
+
+
+def save_scrape_report(report):
+    """Saves the report of a scraping run as JSON, and deletes the oldest reports above the limit.
+
+    The last report is also saved as latest.json, for the jobs which monitor scraping.
+    Returns the path of the report.
+    """
+    time_started = report.get("time_started", time())
+    file_name = datetime.fromtimestamp(time_started).strftime("%Y%m%d-%H%M%S") + ".json"
+    path = os.path.join(scrape_reports_path, file_name)
+    _atomic_json_dump(report, path)
+    _atomic_json_dump(report, os.path.join(scrape_reports_path, "latest.json"))
+
+    # names start with the time, so the oldest are first
+    reports = sorted(
+        entry.name
+        for entry in os.scandir(scrape_reports_path)
+        if entry.name.endswith(".json") and entry.name != "latest.json"
+    )
+    for old_report in reports[: -Config.max_saved_scrape_reports]:
+        os.remove(os.path.join(scrape_reports_path, old_report))
+    return path
+
+
+def load_latest_scrape_report():
+    """Returns the report of the last scraping run, or None if there wasn't any."""
+    path = os.path.join(scrape_reports_path, "latest.json")
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as handle:
+        return json.load(handle)
+
+
+def load_branch_index(path):
+    """Returns the cached dict from video id to its branch id, or None if it isn't cached."""
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def save_branch_index(path, branch_index):
+    _atomic_pickle_dump(branch_index, path)
+
+
 def user_takeout_exists(username):
     return os.path.exists(playlists_path_template.format(username))
 
@@ -227,44 +613,289 @@ def get_usernames():
         yield Path(abs_path).parts[-4]
 
 
-def update_user_takeout(username, takeout_file_input):
+# only these members of the takeout zip are extracted, the rest is skipped
+takeout_member_regex = re.compile(
+    r"(?:.*/)?(Takeout/YouTube and YouTube Music/(?:playlists/[^/]+|history/watch-history\.(?:html|json)))"
+)
+
+
+def _no_progress(stage, fraction):
+    pass
+
+
+# usernames whose takeouts are being saved, by any session
+_users_being_created = set()
+_users_being_created_lock = threading.Lock()
+
+
+def start_creating_user(username):
+    """Returns False if this user is already being created, e.g. when Refresh is pressed again.
+
+    Otherwise, finish_creating_user must be called when the creation ends.
+    """
+    with _users_being_created_lock:
+        if username in _users_being_created:
+            return False
+        _users_being_created.add(username)
+        return True
+
+
+def finish_creating_user(username):
+    with _users_being_created_lock:
+        _users_being_created.discard(username)
+
+
+def update_user_takeout(username, takeout_file, progress_callback=_no_progress):
+    """Saves the uploaded takeout zip and extracts only the playlists and the watch history.
+
+    takeout_file is a binary file object, it is copied to disk in chunks.
+    progress_callback(stage, fraction) is called as the work progresses.
+    Returns True if the takeout is valid.
+    """
     # make sure user's takeout folder exists
     user_takeout_dir = takeouts_template.format(username)
     Path(user_takeout_dir).mkdir(parents=True, exist_ok=True)
-
-    # save takeout file
-    takeout_filename = os.path.join(takeouts_template.format(username), "takeout.zip")
-    takeout_file_input.save(takeout_filename)
-
-    # unzip takeout file
-    with zipfile.ZipFile(takeout_filename, "r") as zip_ref:
-        zip_ref.extractall(Path(takeout_filename).parent)
+    takeout_filename = os.path.join(user_takeout_dir, "takeout.zip")
+    # unzip into a temporary directory, so that a failed upload leaves no partial takeout
+    partial_dir = os.path.join(user_takeout_dir, "Takeout.partial")
+    try:
+        # save takeout file
+        takeout_file.seek(0, os.SEEK_END)
+        takeout_size = takeout_file.tell()
+        takeout_file.seek(0)
+        with open(takeout_filename, "wb") as file:
+            for chunk in iter(lambda: takeout_file.read(Config.takeout_chunk_size), b""):
+                file.write(chunk)
+                progress_callback("saving", file.tell() / max(takeout_size, 1))
+
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        _extract_youtube_takeout(takeout_filename, partial_dir, progress_callback)
+
+        # this is called only for new users, so any existing takeout is an invalid leftover
+        takeout_dir = os.path.join(user_takeout_dir, "Takeout")
+        shutil.rmtree(takeout_dir, ignore_errors=True)
+        os.replace(os.path.join(partial_dir, "Takeout"), takeout_dir)
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, ValueError) as ex:
+        # NotImplementedError is raised for unsupported compression methods
+        logger.error(f"invalid takeout of user {username}: {ex}")
+        return False
+    except OSError as ex:
+        # e.g. the disk is full
+        logger.error(f"failed to save the takeout of user {username}: {ex}")
+        return False
+    finally:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        # the zip can be huge, and everything needed is already extracted
+        Path(takeout_filename).unlink(missing_ok=True)
 
     # verify that the takeout file is valid
     playlist_exist = os.path.exists(playlists_path_template.format(username))
-    history_exists = os.path.exists(history_path_template.format(username))
+    history_exists = os.path.exists(get_history_path(username))
     return playlist_exist and history_exists
 
 
-def get_saved_clusters(username):
-    pattern = saved_clusters_template.format(username, "*")
-    cluster_names = []
-    for abs_filename in glob.glob(pattern):
-        filename = os.path.split(abs_filename)[1]
-        cluster_name = filename.split(".")[0]
-        cluster_names.append(cluster_name)
+def _extract_youtube_takeout(takeout_filename, target_dir, progress_callback):
+    with zipfile.ZipFile(takeout_filename, "r") as zip_ref:
+        members = []
+        for info in zip_ref.infolist():
+            match = takeout_member_regex.fullmatch(info.filename)
+            if match is None or info.is_dir():
+                continue
+            if match[1].split("/")[-1] in [".", ".."]:
+                raise ValueError(f"invalid member name: {info.filename}")
+            if info.file_size > Config.max_takeout_member_size:
+                raise ValueError(f"{info.filename} is too big: {info.file_size} bytes")
+            members.append((info, match[1]))
+        if not members:
+            raise ValueError("there's no YouTube data in this takeout")
+
+        total_size = max(sum(info.file_size for info, _ in members), 1)
+        extracted_size = 0
+        for info, relative_path in members:
+            path = os.path.join(target_dir, *relative_path.split("/"))
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            with zip_ref.open(info) as source, open(path, "wb") as target:
+                for chunk in iter(lambda: source.read(Config.takeout_chunk_size), b""):
+                    target.write(chunk)
+                    extracted_size += len(chunk)
+                    # don't trust the sizes declared in the zip
+                    if target.tell() > info.file_size:
+                        raise ValueError(f"{info.filename} is bigger than declared")
+                    progress_callback("extracting", extracted_size / total_size)
+
+
+def save_cluster_to_file(path, tree, node_ranks, G):
+    """Saves only what is needed to browse this cluster later, instead of the whole graph.
+
+    The tree is stored as arrays. Leaves have indexes 0..n-1 (in pre-order),
+    and an internal node has index n+k, where k is its row in `children`.
+    Children always come before their parents, so the root is the last node.
+    """
+    num_of_leaves = tree.count
+    ids = []
+    children = []
+    distances = []
+    node_to_index = dict()
+    # iterative post-order traversal, because the tree can be too deep for recursion
+    stack = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if node.is_leaf():
+            node_to_index[id(node)] = len(ids)
+            ids.append(node.id)
+        elif children_done:
+            node_to_index[id(node)] = num_of_leaves + len(children)
+            children.append((node_to_index[id(node.left)], node_to_index[id(node.right)]))
+            distances.append(node.dist)
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+
+    nodes = G.nodes
+    with open(path, "wb") as handle:
+        np.savez(
+            handle,
+            ids=np.array(ids, dtype=str),
+            children=np.array(children, dtype=np.int64).reshape(-1, 2),
+            distances=np.array(distances, dtype=float),
+            ranks=np.array([node_ranks.get(id_, 0) for id_ in ids], dtype=np.int64),
+            titles=np.array([nodes[id_].get("title", "") for id_ in ids], dtype=str),
+            is_down=np.array([nodes[id_].get("is_down", False) for id_ in ids], dtype=bool),
+            watched=np.array([nodes[id_].get("watched", False) for id_ in ids], dtype=bool),
+            # so that the videos aren't scraped again when the cluster is browsed
+            # NaN means that the video wasn't scraped
+            time_scraped=np.array(
+                [nodes[id_].get("time_scraped", np.nan) for id_ in ids], dtype=float
+            ),
+        )
+
+
+def load_cluster_from_file(path):
+    """Returns (tree, node_ranks, G), where G contains only the videos of this cluster.
 
-    # get public clusters of other users
-    # if a cluster name starts with _, it is private, so avoid it
-    pattern = saved_clusters_template.format("*", "[!_]*")
-    for abs_filename in glob.glob(pattern):
+    Clusters saved in the old format (a pickle with the whole graph) are also supported.
+    """
+    if not zipfile.is_zipfile(path):
+        with open(path, "rb") as handle:
+            return pickle.load(handle)
+
+    with np.load(path, allow_pickle=False) as data:
+        ids = data["ids"].tolist()
+        children = data["children"].tolist()
+        distances = data["distances"].tolist()
+        ranks = data["ranks"].tolist()
+        titles = data["titles"].tolist()
+        is_down = data["is_down"].tolist()
+        watched = data["watched"].tolist()
+        if "time_scraped" in data:
+            time_scraped = data["time_scraped"].tolist()
+        else:
+            # saved before the scraping times were saved, so the scraped videos (the ones with
+            # titles) are assumed to be scraped when the cluster was saved
+            time_saved = os.path.getmtime(path)
+            time_scraped = [time_saved if title != "" else np.nan for title in titles]
+
+    num_of_leaves = len(ids)
+    nodes = [ClusterNode(i) for i in range(num_of_leaves)]
+    # ClusterNode requires numeric ids when created, so substitute video ids afterwards
+    for leaf, id_ in zip(nodes, ids):
+        leaf.id = id_
+    for k, ((left_index, right_index), dist) in enumerate(zip(children, distances)):
+        left = nodes[left_index]
+        right = nodes[right_index]
+        node = ClusterNode(num_of_leaves + k, left, right, dist, left.count + right.count)
+        nodes.append(node)
+    tree = nodes[-1]
+
+    G = nx.DiGraph()
+    G.add_nodes_from(
+        (id_, dict(title=title, is_down=down, watched=was_watched))
+        for id_, title, down, was_watched in zip(ids, titles, is_down, watched)
+    )
+    for id_, time_ in zip(ids, time_scraped):
+        if not np.isnan(time_):
+            G.nodes[id_]["time_scraped"] = time_
+    node_ranks = dict(zip(ids, ranks))
+    return tree, node_ranks, G
+
+
+def _get_saved_clusters_catalog():
+    """Opens the catalog of saved clusters, creating it if needed.
+
+    When the catalog is created, clusters already present on disk are added to it.
+    """
+    Path(saved_clusters_catalog_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(saved_clusters_catalog_path, timeout=30)
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS clusters (
+                username TEXT NOT NULL,
+                cluster_name TEXT NOT NULL,
+                is_public INTEGER NOT NULL,
+                size INTEGER,
+                time_created REAL NOT NULL,
+                PRIMARY KEY (username, cluster_name)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS public_clusters ON clusters (is_public, username)")
+        # user_version marks that the clusters saved before the catalog existed were added
+        (catalog_version,) = conn.execute("PRAGMA user_version").fetchone()
+        if catalog_version == 0:
+            conn.executemany(
+                "INSERT OR IGNORE INTO clusters VALUES (?, ?, ?, NULL, ?)",
+                (
+                    (username, cluster_name, not cluster_name.startswith("_"), time_created)
+                    for username, cluster_name, time_created in _scan_saved_clusters()
+                ),
+            )
+            conn.execute("PRAGMA user_version = 1")
+    return conn
+
+
+def _scan_saved_clusters():
+    for abs_filename in glob.glob(saved_clusters_template.format("*", "*")):
         head, cluster_name = os.path.split(abs_filename)
-        current_username = os.path.split(head)[1]
-        if current_username == username:
-            # this user's cluster were already added previously
-            continue
+        username = os.path.split(head)[1]
+        yield username, cluster_name, os.path.getmtime(abs_filename)
+
+
+def register_saved_cluster(username, cluster_name, size):
+    # if a cluster name starts with _, it is private
+    is_public = not cluster_name.startswith("_")
+    with closing(_get_saved_clusters_catalog()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?)",
+            (username, cluster_name, is_public, size, time()),
+        )
 
-        cluster_name = current_username + "/" + cluster_name
-        cluster_names.append(cluster_name)
 
-    return cluster_names
+def get_saved_clusters(username, prefix="", limit=None, offset=0):
+    """Returns names of this user's clusters, followed by public clusters of other users.
+
+    Clusters of other users are named: username/cluster_name
+    Only names starting with prefix are returned. limit and offset can be used for paging.
+    """
+    with closing(_get_saved_clusters_catalog()) as conn:
+        rows = conn.execute(
+            """
+            SELECT CASE
+                WHEN username = :username THEN cluster_name
+                ELSE username || '/' || cluster_name
+            END AS name
+            FROM clusters
+            WHERE (username = :username OR is_public) AND substr(name, 1, :length) = :prefix
+            ORDER BY username != :username, name
+            LIMIT :limit OFFSET :offset
+            """,
+            dict(
+                username=username,
+                prefix=prefix,
+                length=len(prefix),
+                limit=-1 if limit is None else limit,
+                offset=offset,
+            ),
+        ).fetchall()
+    return [name for (name,) in rows]
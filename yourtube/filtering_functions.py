@@ -1,16 +1,23 @@
-# note that they are all generators
+# note that they are all generators, except for select_nodes_to_cluster
 
 from itertools import chain
+from operator import methodcaller
 from time import time
 
+import numpy as np
 
-def added_in_last_n_years(G, ids, n=5):
+
+def _added_after(n):
     seconds_in_month = 60 * 60 * 24 * 30.4
     seconds_in_year = seconds_in_month * 12
     start_time = time() - seconds_in_year * n
     # round start_time to months, to prevent clustering being recalculated too frequently
     # returned ids will change only each month, so the cached value will be used
-    start_time = start_time // seconds_in_month * seconds_in_month
+    return start_time // seconds_in_month * seconds_in_month
+
+
+def added_in_last_n_years(G, ids, n=5):
+    start_time = _added_after(n)
 
     for id_ in ids:
         node = G.nodes[id_]
@@ -61,13 +68,53 @@ def get_neighborhood(G, ids):
     return G.edge_subgraph(out_edges).nodes
 
 
-def select_nodes_to_cluster(G, use_watched=False):
-    sources = added_in_last_n_years(G, list(G.nodes), n=5)
-    if use_watched:
-        watched = only_watched(G, list(G.nodes))
-        # note that some videos will be duplicated because of this chain
-        # but it's more efficient this way
-        sources = chain(sources, watched)
-
-    sources = not_down(G, sources)
-    return list(get_neighborhood(G, sources))
+def graph_to_csr(G):
+    """Returns the adjacency of G in a CSR form: (node_ids, indptr, indices).
+
+    Successors of node_ids[i] are node_ids[indices[indptr[i]:indptr[i + 1]]].
+    """
+    adjacency = G.succ
+    node_ids = list(adjacency)
+    node_to_index = {id_: i for i, id_ in enumerate(node_ids)}
+    degrees = np.fromiter(map(len, adjacency.values()), dtype=np.int64, count=len(node_ids))
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    indices = np.fromiter(
+        map(node_to_index.__getitem__, chain.from_iterable(adjacency.values())),
+        dtype=np.int64,
+        count=indptr[-1],
+    )
+    return np.array(node_ids), indptr, indices
+
+
+def select_nodes_to_cluster(G, use_watched=None, n=5, min_sources=400):
+    """Selects source videos and returns (num_of_sources, ids_of_their_neighborhood).
+
+    Sources are the videos added in the last n years which aren't down.
+    If use_watched is None, watched videos are also used as sources
+    only when there are fewer than min_sources videos added in the last n years.
+
+    The neighborhood consists of the sources that recommend something,
+    and all the videos they recommend (like get_neighborhood does).
+    """
+    start_time = _added_after(n)
+
+    # read the node attributes straight into arrays
+    nodes = G.nodes.values()
+    recent = start_time < np.fromiter(
+        map(methodcaller("get", "time_added", -np.inf), nodes), dtype=float, count=len(nodes)
+    )
+    watched = np.fromiter(map(methodcaller("get", "watched", False), nodes), bool, len(nodes))
+    down = np.fromiter(map(methodcaller("get", "is_down", False), nodes), bool, len(nodes))
+
+    if use_watched is None:
+        # if there are too few videos in playlists, it's better to also use watched videos
+        use_watched = recent.sum() < min_sources
+    sources = (recent | watched) if use_watched else recent
+    sources &= ~down
+
+    node_ids, indptr, indices = graph_to_csr(G)
+    degrees = np.diff(indptr)
+    in_neighborhood = sources & (degrees > 0)
+    in_neighborhood[indices[np.repeat(sources, degrees)]] = True
+    return int(sources.sum()), node_ids[in_neighborhood]
@@ -1,13 +1,9 @@
+import json
+
 import panel as pn
 import param
 from panel.reactive import ReactiveHTML
 
-from yourtube.file_operations import id_to_url
-
-id_to_thumbnail = "https://i.ytimg.com/vi/{}/mqdefault.jpg"
-# id_to_thumbnail = "https://i.ytimg.com/vi/{}/maxresdefault.jpg"
-# hq and sd usually has black stripes
-# mq < hq < sd < maxres
 
 # I import both MDC and MWC, because in MWC button height cannot be set
 # and in MDC, I wasn't able to make switches
@@ -160,42 +156,108 @@ class MaterialSlider(ReactiveHTML):
 
 
 class VideoGrid(ReactiveHTML):
-    ids = param.List(item_type=str)
-    texts = param.List(item_type=str)
-    _dummy = param.Boolean(False)
+    """Grid of videos, where only the changed cells are sent to the browser.
+
+    Cells are sent as a JSON patch: {"seq": ..., "cells": {index: [id, text, thumbnail_url]}},
+    and the browser updates only these cells.
+    """
 
-    def update(self):
-        # this is needed because just updating the lists, doesn't update the grid
-        self._dummy = not self._dummy
+    num_of_cells = param.Integer(0)
+    num_of_columns = param.Integer(1)
+    column_width = param.Number(260)
+    row_height = param.Number(260)
+    grid_gap = param.Number(20)
+    cells_patch = param.String("{}")
+
+    _template = '<div id="grid" style="display: grid;"></div>'
+
+    _scripts = {
+        "render": """
+            state.cells = [];
+            self.layout();
+            self.cells_patch();
+        """,
+        "layout": """
+            grid.style.gridTemplateColumns = `repeat(${data.num_of_columns}, ${data.column_width}px)`;
+            grid.style.gridGap = `${data.grid_gap}px`;
+            while (state.cells.length < data.num_of_cells) {
+                const cell = document.createElement("div");
+                const image_link = document.createElement("a");
+                const image = document.createElement("img");
+                const title_link = document.createElement("a");
+                image_link.target = "_blank";
+                title_link.target = "_blank";
+                image.style.cssText = "width: 100%; object-fit: contain";
+                title_link.style.cssText = "text-decoration: none; color:#EEEEEE;";
+                image_link.appendChild(image);
+                cell.append(image_link, title_link);
+                grid.appendChild(cell);
+                state.cells.push({cell, image_link, image, title_link});
+            }
+            while (state.cells.length > data.num_of_cells) {
+                grid.removeChild(state.cells.pop().cell);
+            }
+            for (const {cell} of state.cells) {
+                cell.style.height = `${data.row_height}px`;
+            }
+        """,
+        "cells_patch": """
+            const cells = JSON.parse(data.cells_patch).cells || {};
+            for (const [index, [id, text, thumbnail_url]] of Object.entries(cells)) {
+                const cell = state.cells[index];
+                if (cell === undefined) {
+                    continue;
+                }
+                const video_url = `https://www.youtube.com/watch?v=${id}`;
+                cell.image_link.href = video_url;
+                cell.title_link.href = video_url;
+                cell.image.src = thumbnail_url;
+                cell.title_link.textContent = text;
+            }
+        """,
+        "num_of_cells": "self.layout()",
+        "num_of_columns": "self.layout()",
+        "column_width": "self.layout()",
+        "row_height": "self.layout()",
+        "grid_gap": "self.layout()",
+    }
 
     def __init__(self, n, num_of_columns, column_width, row_height, grid_gap):
-        super().__init__()
-
-        css_style = """
-            <style>
-            .wrapper {{
-              display: grid;
-              grid-template-columns:{};
-              grid-gap: {}px;
-            }}
-            </style>
-        """.format(
-            f"{column_width}px " * num_of_columns,
-            grid_gap,
+        super().__init__(
+            num_of_cells=n,
+            num_of_columns=num_of_columns,
+            column_width=column_width,
+            row_height=row_height,
+            grid_gap=grid_gap,
         )
-
-        html = '<div class="wrapper">'
-        for i in range(n):
-            id_handle = "${ids[" + str(i) + "]}"
-            text_handle = "${texts[" + str(i) + "]}"
-            video_url = id_to_url.format(id_handle)
-            image_url = id_to_thumbnail.format(id_handle)
-
-            html += f"""
-            <div style="height: {row_height}px;">
-                <a href="{video_url}" target="_blank"><img src="{image_url}" style='width: 100%; object-fit: contain'/></a>
-                <a href="{video_url}" target="_blank" style="text-decoration: none; color:#EEEEEE;">{text_handle}</a>
-            </div>"""
-        html += "</div>"
-
-        self._template = css_style + html + "${_dummy}"
+        # what the browser displays, as [id, text, thumbnail_url] for each cell
+        self._cells = [None] * n
+        self._seq = 0
+
+    def set_cells(self, ids, texts, thumbnail_urls):
+        """Displays these videos, sending only the cells which changed."""
+        cells = [list(cell) for cell in zip(ids, texts, thumbnail_urls)]
+        for cell, old_cell in zip(cells, self._cells):
+            if old_cell is not None and old_cell[0] == cell[0]:
+                # the browser already shows this thumbnail, e.g. from YouTube before it was
+                # cached, so switching it to the cached url would download it again
+                cell[2] = old_cell[2]
+        changed = {
+            i: cell
+            for i, (cell, old_cell) in enumerate(zip(cells, self._cells))
+            if cell != old_cell
+        }
+        if changed == dict():
+            return
+        self._cells[: len(cells)] = cells[: len(self._cells)]
+        self._send_patch(changed)
+
+    def _send_patch(self, cells):
+        # seq makes each patch different, so that it's always sent
+        self._seq += 1
+        self.cells_patch = json.dumps(dict(seq=self._seq, cells=cells), separators=(",", ":"))
+
+    def _get_model(self, doc, root=None, parent=None, comm=None):
+        # a new view must get all the cells, not only the last patch
+        self._send_patch({i: cell for i, cell in enumerate(self._cells) if cell is not None})
+        return super()._get_model(doc, root, parent, comm)
@@ -0,0 +1,123 @@
+import functools
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# upper bounds of the histogram buckets, in seconds
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+# (stage, user) -> [bucket counts, sum, count]
+_durations = dict()
+# (cache, result) -> count
+_cache_requests = dict()
+# functions returning more metrics, as lists of (name, type, help, [(labels, value)])
+_collectors = []
+
+
+def observe_duration(stage, seconds, user=""):
+    with _lock:
+        buckets, total, count = _durations.get((stage, user), ([0] * len(duration_buckets), 0, 0))
+        for i, bound in enumerate(duration_buckets):
+            if seconds <= bound:
+                buckets[i] += 1
+        _durations[(stage, user)] = (buckets, total + seconds, count + 1)
+
+
+@contextmanager
+def timed(stage, user=""):
+    """Measures the time spent in this block, as a stage of the app."""
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        observe_duration(stage, perf_counter() - start_time, user)
+
+
+def timed_function(stage):
+    """Decorator measuring the time spent in a function, as a stage of the app."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count_cache_request(cache, hit):
+    result = "hit" if hit else "miss"
+    with _lock:
+        _cache_requests[(cache, result)] = _cache_requests.get((cache, result), 0) + 1
+
+
+def register_collector(collector):
+    """Adds a function returning more metrics, as lists of (name, type, help, [(labels, value)]).
+
+    It's called each time the metrics are rendered.
+    """
+    with _lock:
+        _collectors.append(collector)
+
+
+def _format_labels(labels):
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render_metrics():
+    """Returns all the metrics in the Prometheus text format."""
+    with _lock:
+        durations = {
+            key: (list(buckets), total, count)
+            for key, (buckets, total, count) in _durations.items()
+        }
+        cache_requests = dict(_cache_requests)
+        collectors = list(_collectors)
+
+    name = "yourtube_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Time spent in each stage of the app.",
+        f"# TYPE {name} histogram",
+    ]
+    for (stage, user), (buckets, total, count) in sorted(durations.items()):
+        labels = dict(stage=stage, user=user)
+        for bound, bucket_count in zip(duration_buckets, buckets):
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {bucket_count}")
+        lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    name = "yourtube_cache_requests_total"
+    lines += [
+        f"# HELP {name} Requests to the caches, by whether they were hits or misses.",
+        f"# TYPE {name} counter",
+    ]
+    for (cache, result), count in sorted(cache_requests.items()):
+        lines.append(f"{name}{_format_labels(dict(cache=cache, result=result))} {count}")
+
+    for collector in collectors:
+        for name, type_, help_, samples in collector():
+            lines += [f"# HELP {name} {help_}", f"# TYPE {name} {type_}"]
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels) if labels else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def get_metrics_handler():
+    """Returns a tornado request handler serving the metrics, to be added to the Panel server."""
+    # imported here, because only the server needs it
+    from tornado.web import RequestHandler
+
+    class MetricsHandler(RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(render_metrics())
+
+    return MetricsHandler
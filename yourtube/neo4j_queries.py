@@ -1,3 +1,4 @@
+import functools
 import inspect
 
 
@@ -12,6 +13,7 @@ def query(func):
     signature = inspect.signature(func)
     params = list(signature.parameters)
 
+    @functools.wraps(func)
     def inner(tx, *args):
         arg_dict = dict(zip(params, args))
         return tx.run(query_string, **arg_dict).values()
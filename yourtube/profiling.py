@@ -0,0 +1,85 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from time import localtime, perf_counter, strftime, time
+
+from yourtube.file_operations import profiles_path
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+# calls profiled in this thread, so that nested calls aren't profiled again
+_profiling = threading.local()
+
+
+def profile_if_slow(name, get_metadata=lambda *args, **kwargs: dict()):
+    """Decorator saving a cProfile profile of the calls slower than Config.profile_slower_than.
+
+    get_metadata is called with the arguments of a slow call, and returns a dict saved next to
+    the profile, e.g. with the user and parameters.
+    If Config.profile_slower_than is None, calls aren't profiled at all.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            threshold = Config.profile_slower_than
+            if threshold is None or getattr(_profiling, "active", False):
+                return fn(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # some other profiler is already running
+                return fn(*args, **kwargs)
+            _profiling.active = True
+            start_time = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                duration = perf_counter() - start_time
+                profiler.disable()
+                _profiling.active = False
+                if duration > threshold:
+                    try:
+                        metadata = get_metadata(*args, **kwargs)
+                        save_profile(profiler, name, duration, metadata)
+                    except Exception:
+                        logger.exception(f"failed to save the profile of {name}")
+
+        return wrapper
+
+    return decorator
+
+
+def save_profile(profiler, name, duration, metadata, path=None):
+    """Saves the profile and its metadata, and deletes the oldest profiles above the limit.
+
+    Profiles can be viewed with: python -m pstats <file>.prof
+    """
+    path = path or profiles_path
+    Path(path).mkdir(parents=True, exist_ok=True)
+    user = re.sub(r"[^\w+-]", "_", str(metadata.get("user", "")))
+    now = time()
+    microseconds = int(now * 1e6) % 10**6
+    file_name = f"{strftime('%Y%m%d-%H%M%S', localtime(now))}_{microseconds:06d}_{name}_{user}"
+    profiler.dump_stats(os.path.join(path, file_name + ".prof"))
+    with open(os.path.join(path, file_name + ".json"), "w") as file:
+        json.dump(dict(name=name, duration=duration, time=now, **metadata), file, default=str)
+    logger.info(f"{name} took {duration:.3f} seconds, saved its profile: {file_name}")
+
+    # names start with the time, so the oldest are first
+    profiles = sorted(entry.name for entry in os.scandir(path) if entry.name.endswith(".prof"))
+    for old_profile in profiles[: -Config.max_saved_profiles]:
+        for extension in [".prof", ".json"]:
+            try:
+                os.remove(os.path.join(path, old_profile[: -len(".prof")] + extension))
+            except FileNotFoundError:
+                pass
@@ -4,23 +4,51 @@ import logging
 import os
 import pickle
 from pathlib import Path
-from threading import Thread
+from threading import Lock, Thread
 from time import time
 
 import networkx as nx
 import numpy as np
-from krakow import krakow
-from krakow.utils import create_dendrogram, split_into_n_children, normalized_dasgupta_cost
 from scipy.cluster.hierarchy import to_tree
 
-from yourtube.file_operations import clustering_cache_template, saved_clusters_template
+from yourtube.file_operations import (
+    clustering_cache_template,
+    saved_clusters_template,
+    save_cluster_to_file,
+    load_cluster_from_file,
+    register_saved_cluster,
+    save_branch_index,
+    load_branch_index,
+    load_joined_graph_of_many_users,
+)
 from yourtube.filtering_functions import *
 from yourtube.scraping import Scraper
+from yourtube.search import get_search_index
+from yourtube.similarity import get_similarity_index
+from yourtube.thumbnails import get_thumbnail_cache
+from yourtube.metrics import count_cache_request, timed, timed_function
+from yourtube.profiling import profile_if_slow
+from yourtube.config import Config
 
 logger = logging.getLogger("yourtube")
 logger.setLevel(logging.DEBUG)
 
 
+def split_into_n_children(tree, n):
+    # imported here, because krakow.utils imports matplotlib, which takes a while
+    from krakow import utils
+
+    return utils.split_into_n_children(tree, n=n)
+
+
+def get_clustering_cache_name(nodes_to_cluster, balance_alpha, balance_beta):
+    sorted_nodes = sorted(nodes_to_cluster)
+    unique_string = "".join(sorted_nodes)
+    node_hash = hashlib.md5(unique_string.encode()).hexdigest()
+    return f"{balance_alpha:.2f}_{balance_beta:.2f}_{node_hash}"
+
+
+@timed_function("cluster_subgraph")
 def cluster_subgraph(nodes_to_cluster, G, balance_alpha=2, balance_beta=2, create_image=True):
     # note that using create_image=False opens the possibility, that the cached image will be None
     # so watchout for that
@@ -28,19 +56,23 @@ def cluster_subgraph(nodes_to_cluster, G, balance_alpha=2, balance_beta=2, creat
     # use cache
     # here we assume that the same set of nodes will have the same graph structure
     # this is not true, but collisions are very rare and not destructive
-    sorted_nodes = sorted(nodes_to_cluster)
-    unique_string = "".join(sorted_nodes)
-    node_hash = hashlib.md5(unique_string.encode()).hexdigest()
-    unique_string = f"{balance_alpha:.2f}_{balance_beta:.2f}_{node_hash}"
-    cache_file = clustering_cache_template.format(unique_string)
+    cache_file = clustering_cache_template.format(
+        get_clustering_cache_name(nodes_to_cluster, balance_alpha, balance_beta)
+    )
     if os.path.isfile(cache_file):
         logger.info(f"using cached clustering: {cache_file}")
+        count_cache_request("clustering", hit=True)
         start_time = time()
         with open(cache_file, "rb") as handle:
             res = pickle.load(handle)
             logger.info(f"loaded clustering in {time() - start_time:.3f} seconds")
             return res
 
+    count_cache_request("clustering", hit=False)
+    # imported here, because importing krakow (and matplotlib with it) takes a while
+    from krakow import krakow
+    from krakow.utils import create_dendrogram, normalized_dasgupta_cost
+
     start_time = time()
 
     RecentDirected = G.subgraph(nodes_to_cluster)
@@ -68,6 +100,9 @@ def cluster_subgraph(nodes_to_cluster, G, balance_alpha=2, balance_beta=2, creat
     logger.info(f"clustering took: {time() - start_time:.3f} seconds")
 
     if create_image:
+        import matplotlib.pyplot as plt
+
+        plt.style.use("dark_background")
         img = create_dendrogram(D, clusters_limit=100, width=17.8, height=1.5)
     else:
         img = None
@@ -158,8 +193,14 @@ class TreeClimber:
         self.num_of_groups = num_of_groups
         self.videos_in_group = videos_in_group
 
-    def reset(self, tree):
-        self.tree = tree
+    def reset(self, tree, branch_index=None):
+        self.root = tree
+        # it's computed only when needed, because it takes a while on big trees
+        self.branch_index = branch_index
+        self.go_to_root()
+
+    def go_to_root(self):
+        self.tree = self.root
         self.path = []
         self.branch_id = ""
         self.children, self.grandchildren = self.new_offspring(self.tree)
@@ -192,6 +233,63 @@ class TreeClimber:
         self.children, self.grandchildren = self.new_offspring(self.tree)
         return 0
 
+    def go_to_branch(self, branch_id):
+        """Goes from the root to the given branch, e.g. "1323".
+
+        Returns -1 if there is no such branch, and then stays on the root.
+        If succesful, returns 0.
+        """
+        self.go_to_root()
+        for choice in branch_id:
+            if not (choice.isdigit() and 1 <= int(choice) <= self.num_of_groups) or (
+                self.choose_column(int(choice) - 1) == -1
+            ):
+                self.go_to_root()
+                return -1
+        return 0
+
+    def get_branch_index(self):
+        """Returns a dict from video ids in the tree, to the ids of the lowest branches with them."""
+        root = self.root
+        branch_index = self.branch_index
+        if branch_index is None:
+            branch_index = self.compute_branch_index(root)
+            # it can be computed in another thread, while the tree is reset
+            if self.root is root:
+                self.branch_index = branch_index
+        return branch_index
+
+    def compute_branch_index(self, root=None):
+        if root is None:
+            root = self.root
+        # it simulates choose_column on each branch, so that the branches are the same
+        branch_index = dict()
+        stack = [(root, "")]
+        while stack:
+            tree, branch_id = stack.pop()
+            for i, child in enumerate(split_into_n_children(tree, n=self.num_of_groups)):
+                try:
+                    self.new_offspring(child)
+                except ValueError:
+                    # it's not possible to choose this column, so its videos stay in this branch
+                    for id_ in child.pre_order():
+                        branch_index[id_] = branch_id
+                    continue
+                stack.append((child, branch_id + str(i + 1)))
+        return branch_index
+
+    def jump_to_video(self, ids):
+        """Goes to the lowest branch containing the first of ids which is in this tree.
+
+        Returns that id, or None if none of the ids is in this tree.
+        """
+        branch_index = self.get_branch_index()
+        id_ = next((id_ for id_ in ids if id_ in branch_index), None)
+        if id_ is None:
+            return None
+        self.go_to_branch(branch_index[id_])
+        return id_
+
     def new_offspring(self, new_tree):
         new_children = split_into_n_children(new_tree, n=self.num_of_groups)
         new_grandchildren = [
@@ -200,8 +298,49 @@ class TreeClimber:
         return new_children, new_grandchildren
 
 
+def cluster_graph(G, balance_alpha, balance_beta, progress_callback=lambda stage, fraction: None):
+    """Selects the videos of G worth clustering, and clusters them.
+
+    Returns the clustered ids, the tree and the dendrogram image.
+    """
+    # if there are too few videos in playlists, watched videos will also be used
+    progress_callback("selecting videos", 0.5)
+    start_time = time()
+    with timed("select_nodes_to_cluster"):
+        num_of_sources, nodes_to_cluster = select_nodes_to_cluster(G)
+    logger.info(
+        f"selected {len(nodes_to_cluster)} nodes to cluster, from {num_of_sources} sources, "
+        f"in {time() - start_time:.3f} seconds"
+    )
+
+    progress_callback("clustering", 0.6)
+    tree, dendrogram_img, clustering_quality = cluster_subgraph(
+        nodes_to_cluster, G, balance_alpha, balance_beta
+    )
+    return nodes_to_cluster, tree, dendrogram_img
+
+
+def load_clustered_graph(driver, usernames, balance_alpha, balance_beta, progress_callback):
+    """Loads the joined graph of these users, and clusters it. It's the slow part of creating
+    an engine, so it's the part shared by the sessions of the same users.
+
+    Returns the graph and its clustering, which is None if the graph is empty.
+    The result can be shared by many sessions, so the graph must be copied before changing it.
+    """
+    progress_callback("loading the graph", 0)
+    start_time = time()
+    with timed("load_joined_graph", "+".join(usernames)):
+        G = load_joined_graph_of_many_users(driver, usernames)
+    logger.info(f"loading graph took: {time() - start_time:.3f} seconds")
+    logger.info(f"users: {usernames}, graph size: {len(G.nodes)}")
+    if len(G.nodes) == 0:
+        return G, None
+    return G, cluster_graph(G, balance_alpha, balance_beta, progress_callback)
+
+
 class Engine:
-    def __init__(self, G, driver, parameters):
+    def __init__(self, G, driver, parameters, clustering=None):
+        """Clustering is the result of cluster_graph, it's computed if it isn't given."""
         self.G = G
         self.driver = driver
         self.user = parameters.username
@@ -215,31 +354,51 @@ class Engine:
         self.recommender = Recommender(G, parameters.seed)
 
         self.scraping_thread = Thread()
-        # TODO is it a problem if we don't close the scraper and its pool properly, when app closes?
-        self.scraper = Scraper(driver=driver, G=G)
-
-        # if there are too few videos in playlists, it's better to also use watched videos
-        use_watched = len(list(added_in_last_n_years(self.G, list(self.G.nodes)))) < 400
-        nodes_to_cluster = select_nodes_to_cluster(
-            self.G,
-            use_watched=use_watched,
+        self.search_index = get_search_index()
+        self.similarity_index = get_similarity_index()
+        self.scraper = Scraper(
+            driver=driver,
+            G=G,
+            search_index=self.search_index,
+            similarity_index=self.similarity_index,
         )
+        self.thumbnail_cache = get_thumbnail_cache()
+
+        # videos scraped before the indexes existed are added in the background,
+        # from a snapshot, because the scraper adds nodes to G in the meantime
+        nodes = list(G.nodes(data=True))
+        Thread(target=self.search_index.add_videos_from_nodes, args=[nodes]).start()
+        Thread(target=self.similarity_index.add_videos_from_nodes, args=[nodes]).start()
+
+        if clustering is None:
+            clustering = cluster_graph(
+                G, parameters.clustering_balance_a, parameters.clustering_balance_b
+            )
+        nodes_to_cluster, tree, self.dendrogram_img = clustering
         self._nodes = nodes_to_cluster
 
-        tree, self.dendrogram_img, clustering_quality = cluster_subgraph(
-            nodes_to_cluster,
-            self.G,
-            parameters.clustering_balance_a,
-            parameters.clustering_balance_b,
-        )
         video_ids = tree.pre_order()
-        self.recommender.compute_node_ranks(video_ids)
-        self.tree_climber.reset(tree)
+        with timed("compute_node_ranks", self.user):
+            self.recommender.compute_node_ranks(video_ids)
 
-    def get_video_ids(self, recommendation_parameters):
-        return self.recommender.build_wall(
-            self.tree_climber.grandchildren, recommendation_parameters
+        # branch index is cached next to the clustering, because it depends only on it
+        clustering_cache_name = get_clustering_cache_name(
+            nodes_to_cluster, parameters.clustering_balance_a, parameters.clustering_balance_b
         )
+        self.branch_index_path = clustering_cache_template.format(
+            f"{clustering_cache_name}_branches_{self.num_of_groups}_{self.videos_in_group}"
+        )
+        branch_index = load_branch_index(self.branch_index_path)
+        count_cache_request("branch_index", hit=branch_index is not None)
+        self.branch_index_lock = Lock()
+        self.tree_climber.reset(tree, branch_index)
+        self.prepare_branch_index()
+
+    def get_video_ids(self, recommendation_parameters):
+        with timed("build_wall", self.user):
+            return self.recommender.build_wall(
+                self.tree_climber.grandchildren, recommendation_parameters
+            )
 
     def choose_column(self, i):
         exit_code = self.tree_climber.choose_column(i)
@@ -249,9 +408,59 @@ class Engine:
         exit_code = self.tree_climber.go_back()
         return exit_code
 
+    def go_to_branch(self, branch_id):
+        exit_code = self.tree_climber.go_to_branch(branch_id)
+        return exit_code
+
     def get_branch_id(self):
         return self.tree_climber.branch_id
 
+    def get_video_branch_id(self, video_id):
+        """Returns the id of the lowest branch containing this video, or None if it's not here."""
+        branch_index = self.get_branch_index()
+        return branch_index.get(video_id)
+
+    def prepare_branch_index(self):
+        """Computes the branch index in the background, so that searching doesn't wait for it."""
+        if self.tree_climber.branch_index is None:
+            Thread(target=self.get_branch_index).start()
+
+    def get_branch_index(self):
+        # the lock makes the callers wait for the index being computed, instead of computing it
+        with self.branch_index_lock:
+            root, path = self.tree_climber.root, self.branch_index_path
+            is_cached = self.tree_climber.branch_index is not None
+            branch_index = self.tree_climber.get_branch_index()
+            if not is_cached and path is not None and self.tree_climber.root is root:
+                save_branch_index(path, branch_index)
+            return branch_index
+
+    def search(self, query):
+        """Goes to the lowest cluster containing the best match for the query.
+
+        Returns the id of this video, or None if nothing in the current tree matches.
+        """
+        # only the videos of this tree are searched, because the index has the videos of all users
+        # the branch index has all the videos of the tree, and checking it is fast
+        ids = self.search_index.search(
+            query, limit=Config.search_results_limit, video_ids=self.get_branch_index()
+        )
+        return self.tree_climber.jump_to_video(ids)
+
+    def more_like_this(self, video_id):
+        """Returns ids of the videos in the current tree most similar to this one, for one wall.
+
+        Returns None if this video isn't scraped yet.
+        """
+        return self.similarity_index.most_similar(
+            video_id,
+            self.tree_climber.root.pre_order(),
+            n=self.num_of_groups * self.videos_in_group,
+        )
+
+    def get_thumbnail_url(self, video_id):
+        return self.thumbnail_cache.get_url(video_id)
+
     def is_video_down(self, video_id):
         return self.G.nodes[video_id].get("is_down", False)
 
@@ -269,15 +478,14 @@ class Engine:
         # make sure user directory exists
         Path(path).parent.mkdir(parents=True, exist_ok=True)
 
-        data_to_save = (
+        # save cluster
+        save_cluster_to_file(
+            path,
             self.tree_climber.tree,
             self.recommender.node_ranks,
             self.G,
         )
-
-        # save cluster
-        with open(path, "wb") as handle:
-            pickle.dump(data_to_save, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        register_saved_cluster(self.user, cluster_name, self.tree_climber.tree.count)
 
         self.message_callback("cluster saved successfully")
 
@@ -288,17 +496,21 @@ class Engine:
         cluster_name = cluster_name_parts[-1]
         if len(cluster_name_parts) == 2:
             username = cluster_name_parts[0]
-            # we also need to load a new graph!
         else:
             username = self.user
 
+        # the saved cluster contains its own small graph, so no other graph needs to be loaded
         path = saved_clusters_template.format(username, cluster_name)
-        with open(path, "rb") as handle:
-            tree, node_ranks, graph = pickle.load(handle)
+        tree, node_ranks, graph = load_cluster_from_file(path)
+        # the branch index of a saved cluster isn't cached
+        # the path is changed first, so that the index of this tree is never saved to the old one
+        self.branch_index_path = None
         self.tree_climber.reset(tree)
         self.recommender.node_ranks = node_ranks
+        self.recommender.G = graph
         self.G = graph
         self.scraper.G = graph
+        self.prepare_branch_index()
         self.display_callback()
 
     def fetch_videos(self, recommendation_parameters):
@@ -308,18 +520,28 @@ class Engine:
         )
         self.scraping_thread.start()
 
+    @profile_if_slow(
+        "fetch_videos_background",
+        lambda self, recommendation_parameters: dict(
+            user=self.user, branch=self.get_branch_id(), **recommendation_parameters
+        ),
+    )
     def fetch_videos_background(self, recommendation_parameters):
         ids = self.get_video_ids(recommendation_parameters)
 
         # if some videos are scraped in the background, cancell them
         self.scraper.cancel_all_tasks()
 
+        # thumbnails are downloaded in parallel with scraping
+        self.thumbnail_cache.prefetch(np.array(ids).flatten())
+
         # scrape current videos
-        self.scraper.scrape_from_list(
-            ids,
-            skip_if_fresher_than=float("inf"),  # skip if already scraped anytime
-            non_verbose=True,
-        )
+        with timed("scrape_current_wall", self.user):
+            self.scraper.scrape_from_list(
+                ids,
+                skip_if_fresher_than=float("inf"),  # skip if already scraped anytime
+                non_verbose=True,
+            )
         # display current videos
         self.display_callback()
 
@@ -345,7 +567,8 @@ class Engine:
             )
             self.potential_ids_to_show.append(ids_to_show_in_wall)
 
-        # scrape potential videos in advance
+        # scrape potential videos and download their thumbnails in advance
+        self.thumbnail_cache.prefetch(np.array(self.potential_ids_to_show).flatten())
         self.scraper.scrape_from_list(
             self.potential_ids_to_show,
             skip_if_fresher_than=float("inf"),  # skip if already scraped anytime
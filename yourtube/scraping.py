@@ -1,17 +1,25 @@
+import atexit
+import functools
+import heapq
 import logging
+import random
 import re
+import threading
+from collections import Counter, deque
 from concurrent.futures import (
+    FIRST_COMPLETED,
     CancelledError,
     ProcessPoolExecutor,
     ThreadPoolExecutor,
     as_completed,
+    wait,
 )
-from time import time
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter, sleep, time
+from urllib.parse import urlparse
 import traceback
 
-import numpy as np
 import requests
-from neo4j import GraphDatabase
 from tqdm import tqdm
 from youtube_transcript_api import (
     NoTranscriptFound,
@@ -26,14 +34,49 @@ from yourtube.file_operations import (
     get_youtube_watched_ids,
     id_to_url,
     get_usernames,
+    load_ingest_manifest,
+    load_scraping_state,
+    save_ingest_manifest,
+    save_scrape_report,
+    save_scraping_state,
 )
+from yourtube.driver import get_driver
+from yourtube.metrics import observe_duration, timed
 from yourtube.neo4j_queries import *
+from yourtube.search import get_search_index
+from yourtube.similarity import get_similarity_index
 from yourtube.config import Config
 
 
+class FetchError(Exception):
+    """The page couldn't be fetched correctly, but the video can be fine, so it's worth retrying."""
+
+
+class ThrottledError(FetchError):
+    """YouTube limits our requests, so we should slow down."""
+
+
+def check_response(response):
+    """Raises FetchError if the response isn't a real watch page."""
+    if response.status_code == 429:
+        raise ThrottledError(f"status code {response.status_code}")
+    if response.status_code >= 500:
+        raise FetchError(f"status code {response.status_code}")
+    # when throttled, youtube redirects to a captcha page, like google.com/sorry/index
+    # the page's text isn't checked, because real watch pages can mention "unusual traffic"
+    if urlparse(response.url).path.startswith("/sorry/"):
+        raise ThrottledError(f"captcha page: {response.url}")
+    if "consent." in response.url:
+        raise FetchError(f"consent page: {response.url}")
+    if "ytInitialData" not in response.text:
+        # the page is some interstitial, so we can't conclude that the video is down
+        raise FetchError(f"not a watch page: {response.url}")
+
+
 def get_content(id_):
     url = id_to_url.format(id_)
-    content = requests.get(url, cookies={"CONSENT": "YES+1"}, timeout=60)
+    content = requests.get(url, cookies={"CONSENT": "YES+1"}, timeout=Config.fetch_timeout)
+    check_response(content)
     return content, id_
 
 
@@ -156,12 +199,28 @@ def get_keywords(content):
     return keywords
 
 
-def scrape_content(content, id_, G=None, driver=None):
+# fields of a video, and the functions extracting them from its page
+extractors = [
+    ("title", get_title),
+    ("view_count", get_view_count),
+    ("like_count", get_like_count),
+    ("channel_id", get_channel_id),
+    ("category", get_category),
+    ("length", get_length),
+    ("keywords", get_keywords),
+]
+
+
+def scrape_content(
+    content, id_, G=None, driver=None, search_index=None, similarity_index=None, stats=None
+):
     """
     if driver is not None, save the content into neo4j
     if G is not None, in addition to saving to neo4j, also update G
+    if search_index or similarity_index is not None, also add the video to it
+    if stats is not None, record the times of parsing and saving, and the parse failures
     """
-
+    start_time = perf_counter()
     recs = get_recommended_ids(content, id_)
     if len(recs) <= 1:
         # this video is probably removed from youtube
@@ -171,24 +230,25 @@ def scrape_content(content, id_, G=None, driver=None):
         if G is not None:
             G.add_node(id_)
             G.nodes[id_]["is_down"] = True
+        if stats is not None:
+            stats.add(marked_down=1, db_write_seconds=perf_counter() - start_time)
         return
 
     video_info = dict()
     video_info["video_id"] = id_
-    try:
-        video_info["title"] = get_title(content)
-        video_info["view_count"] = get_view_count(content)
-        video_info["like_count"] = get_like_count(content)
-        video_info["channel_id"] = get_channel_id(content)
-        video_info["category"] = get_category(content)
-        video_info["length"] = get_length(content)
-        video_info["keywords"] = get_keywords(content)
+    with timed("parse_page"):
+        for field, extractor in extractors:
+            try:
+                video_info[field] = extractor(content)
+            except Exception:
+                print("\n\nscraping failed for video: ", id_)
+                # print everything about the error that we can
+                print(traceback.format_exc())
+                if stats is not None:
+                    stats.add_parse_failure(extractor.__name__)
+                raise
         video_info["time_scraped"] = time()
-    except Exception:
-        print("\n\nscraping failed for video: ", id_)
-        # print everything about the error that we can
-        print(traceback.format_exc())
-        raise
+    parse_end_time = perf_counter()
 
     if driver is not None:
         with driver.session() as s:
@@ -198,124 +258,443 @@ def scrape_content(content, id_, G=None, driver=None):
         G.add_node(id_, **video_info)
         for rec in recs:
             G.add_edge(id_, rec)
+    db_write_end_time = perf_counter()
+    if search_index is not None:
+        search_index.add_video(id_, video_info["title"], video_info["keywords"])
+    if similarity_index is not None:
+        similarity_index.add_video(id_, video_info["title"], video_info["keywords"])
+
+    if stats is not None:
+        stats.add(
+            scraped=1,
+            parse_seconds=parse_end_time - start_time,
+            db_write_seconds=db_write_end_time - parse_end_time,
+            index_seconds=perf_counter() - db_write_end_time,
+        )
+
+
+class AdaptiveConcurrency:
+    """Decides how many requests can be in flight, based on the observed errors.
+
+    The limit grows slowly while requests succeed, and is halved when too many of them fail.
+    When YouTube throttles us, sending requests is paused, with exponential backoff.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.outcomes = deque(maxlen=Config.fetch_error_rate_window)
+        self.time_decreased = 0
+        self.consecutive_throttles = 0
+        self.paused_until = 0
+
+    def on_success(self):
+        self.outcomes.append(False)
+        self.consecutive_throttles = 0
+        # additive increase: +1 after a whole window of successful requests
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_error(self, throttled):
+        self.outcomes.append(True)
+        now = time()
+        if throttled:
+            self.paused_until = max(self.paused_until, now + backoff(self.consecutive_throttles))
+            self.consecutive_throttles += 1
+        error_rate = sum(self.outcomes) / len(self.outcomes)
+        # the requests in flight were sent with the old limit, so don't decrease it again for them
+        if (throttled or error_rate > Config.max_fetch_error_rate) and (
+            now - self.time_decreased > Config.fetch_backoff_base
+        ):
+            self.limit = max(1, self.limit / 2)
+            self.time_decreased = now
+
+    def can_submit(self, num_of_in_flight):
+        return num_of_in_flight < int(self.limit) and time() >= self.paused_until
+
+
+def backoff(attempt):
+    # exponential backoff with jitter
+    return Config.fetch_backoff_base * 2**attempt * random.uniform(0.5, 1.5)
+
+
+class FetchService:
+    """One pool of processes fetching youtube pages, shared by all the scrapers of this process.
+
+    The total number of requests in flight is limited by its adaptive concurrency, so it's
+    never more than max_workers, however many sessions are scraping at once.
+    Each scraper processes the results of its own requests, so they go to its own graph.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.concurrency = AdaptiveConcurrency(max_workers)
+        self.lock = threading.Lock()
+        # processes are started only when something is fetched
+        self.executor = None
+        self.in_flight = 0
+        self.is_shut_down = False
+
+    def try_submit(self, fn, *args):
+        """Submits fn(*args), if the concurrency limit allows it. Otherwise returns None."""
+        with self.lock:
+            if self.is_shut_down or not self.concurrency.can_submit(self.in_flight):
+                return None
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            try:
+                future = self.executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # some process of the pool died, e.g. it was killed when out of memory,
+                # so the pool can't be used anymore, and it's replaced with a new one
+                print("the pool of fetching processes is broken, starting a new one")
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                future = self.executor.submit(fn, *args)
+            executor = self.executor
+            self.in_flight += 1
+        future.add_done_callback(functools.partial(self._on_done, executor))
+        return future
+
+    def _on_done(self, executor, future):
+        with self.lock:
+            self.in_flight -= 1
+            if (
+                not future.cancelled()
+                and isinstance(future.exception(), BrokenProcessPool)
+                and self.executor is executor
+            ):
+                # the next request starts a new pool
+                self.executor = None
+
+    def on_success(self):
+        with self.lock:
+            self.concurrency.on_success()
+
+    def on_error(self, throttled):
+        with self.lock:
+            self.concurrency.on_error(throttled)
+
+    def get_paused_until(self):
+        return self.concurrency.paused_until
+
+    def shutdown(self):
+        with self.lock:
+            self.is_shut_down = True
+            executor = self.executor
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+@functools.lru_cache(maxsize=None)
+def get_fetch_service():
+    """Returns the fetch service shared by the whole process, it's shut down at exit."""
+    fetch_service = FetchService(Config.max_fetch_workers)
+    atexit.register(fetch_service.shutdown)
+    return fetch_service
+
+
+def _flatten_ids(ids):
+    """Yields the ids from nested lists and numpy arrays of them, without copying them."""
+    if isinstance(ids, str):
+        yield ids
+        return
+    for element in ids:
+        yield from _flatten_ids(element)
+
+
+class ScrapeStats:
+    """Statistics of a scraping run, which can be saved as a JSON report.
+
+    Fetch seconds are summed over the pages fetched in parallel, so they can exceed the run time.
+    """
+
+    counters = [
+        "requested",
+        "skipped",
+        "scraped",
+        "marked_down",
+        "failed",
+        "pages_fetched",
+        "bytes_fetched",
+        "retries",
+        "fetch_seconds",
+        "parse_seconds",
+        "db_write_seconds",
+        "index_seconds",
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.time_started = time()
+        self.time_finished = None
+        self.values = dict.fromkeys(self.counters, 0)
+        self.errors = Counter()
+        self.parse_failures = Counter()
+
+    def add(self, **increments):
+        with self.lock:
+            for counter, increment in increments.items():
+                self.values[counter] += increment
+
+    def add_error(self, ex):
+        with self.lock:
+            self.errors[type(ex).__name__] += 1
+
+    def add_parse_failure(self, extractor_name):
+        with self.lock:
+            self.parse_failures[extractor_name] += 1
+
+    def finish(self):
+        self.time_finished = time()
+
+    def to_dict(self):
+        with self.lock:
+            values = dict(self.values)
+            errors = dict(self.errors)
+            parse_failures = dict(self.parse_failures)
+        time_finished = self.time_finished or time()
+        duration = time_finished - self.time_started
+        return dict(
+            time_started=self.time_started,
+            time_finished=time_finished,
+            duration_seconds=duration,
+            videos={
+                counter: values[counter]
+                for counter in ["requested", "skipped", "scraped", "marked_down", "failed"]
+            },
+            fetch=dict(
+                pages=values["pages_fetched"],
+                bytes=values["bytes_fetched"],
+                retries=values["retries"],
+                pages_per_second=values["pages_fetched"] / duration if duration > 0 else 0,
+                bytes_per_second=values["bytes_fetched"] / duration if duration > 0 else 0,
+            ),
+            stage_seconds=dict(
+                fetch=values["fetch_seconds"],
+                parse=values["parse_seconds"],
+                db_write=values["db_write_seconds"],
+                index=values["index_seconds"],
+            ),
+            errors=errors,
+            parse_failures=parse_failures,
+        )
 
 
 class Scraper:
-    def __init__(self, driver=None, G=None):
-        self.executor = ProcessPoolExecutor(max_workers=8)
+    def __init__(
+        self,
+        driver=None,
+        G=None,
+        search_index=None,
+        similarity_index=None,
+        fetch_service=None,
+        stats=None,
+    ):
+        self.fetch_service = fetch_service or get_fetch_service()
+        self.stats = stats or ScrapeStats()
         self.driver = driver
         self.G = G
+        self.search_index = search_index
+        self.similarity_index = similarity_index
         # Either driver or G (or both) must be given.
         assert (driver is not None) or (G is not None)
         self.futures = set()
+        # incremented on each cancel_all_tasks, so that running scrape_from_list calls stop
+        self.generation = 0
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.executor.shutdown(wait=True)
+        # the fetch service is shared, so only the tasks of this scraper are stopped
+        self.cancel_all_tasks()
         return False
 
+    def should_skip(self, id_, skip_if_fresher_than):
+        if self.G is not None:
+            # if G is given, use it to skip already scraped nodes
+            if id_ not in self.G.nodes:
+                return False
+            node = self.G.nodes[id_]
+            # check if this video is down
+            if "is_down" in node and node["is_down"]:
+                return True
+            # check if this video was already scraped recently
+            return (
+                skip_if_fresher_than is not None
+                and "time_scraped" in node
+                and time() - node["time_scraped"] < skip_if_fresher_than
+            )
+
+        # if G is not given, use neo4j to decide what to skip
+        with self.driver.session() as s:
+            result = s.read_transaction(check_if_this_video_was_scraped, id_)
+        if result == []:
+            # it is not present in the database, so scrape
+            return False
+        time_scraped, is_down = result[0]
+        if is_down:
+            # down videos should be skipped
+            return True
+        if time_scraped is None:
+            # it is present in the database, but wasn't scraped yet
+            return False
+        if skip_if_fresher_than is None:
+            # don't skip any scraped videos
+            return False
+        # skip if this video was already scraped recently, scrape if it was long ago
+        return time() - time_scraped < skip_if_fresher_than
+
     def choose_which_video_to_skip(self, ids, skip_if_fresher_than):
-        ids_to_scrape = []
-        for id_ in ids:
-            if self.G is not None:
-                # if G is given, use it to skip already scraped nodes
-                if id_ in self.G.nodes:
-                    node = self.G.nodes[id_]
-                    # check if this video is down
-                    if "is_down" in node and node["is_down"]:
-                        continue
-                    # check if this video was already scraped recently
-                    if (
-                        skip_if_fresher_than is not None
-                        and "time_scraped" in node
-                        and time() - node["time_scraped"] < skip_if_fresher_than
-                    ):
-                        continue
-                # no reason to skip this video
-                ids_to_scrape.append(id_)
-            else:
-                # if G is not given, use neo4j to decide what to skip
-                with self.driver.session() as s:
-                    result = s.read_transaction(check_if_this_video_was_scraped, id_)
-                if result == []:
-                    # it is not present in the database, so scrape
-                    ids_to_scrape.append(id_)
-                    continue
-                time_scraped, is_down = result[0]
-                if is_down:
-                    # down videos should be skipped
-                    continue
-                if time_scraped is None:
-                    # it is present in the database, but wasn't scraped yet
-                    ids_to_scrape.append(id_)
-                    continue
-                if skip_if_fresher_than is None:
-                    # don't skip any scraped videos
-                    ids_to_scrape.append(id_)
-                    continue
-                if time() - time_scraped < skip_if_fresher_than:
-                    # this video was already scraped recently, so skip
-                    continue
-                else:
-                    # it was scraped, but long ago, so scrape it
-                    ids_to_scrape.append(id_)
-                    continue
-        return ids_to_scrape
+        return [id_ for id_ in ids if not self.should_skip(id_, skip_if_fresher_than)]
 
     def scrape_from_list(self, ids, skip_if_fresher_than=None, non_verbose=False):
         """
         Scrapes videos from the ids list and adds them to neo4j database and/or networkx graph
 
         ids:
-            can be multidimensional, as long as it is convertible to numpy array
+            can be an iterator, or nested lists and numpy arrays of ids
             it can contain "" elements - they will be skipped
         skip_if_fresher_than:
             is in seconds
             if set, videos scraped more recently than this time will be skipped
 
+        Ids are read lazily, at most Config.scraping_window ids are waiting or fetched at once,
+        and the fetched pages are saved before more ids are read, so the memory used
+        doesn't grow with the number of ids.
+
+        Returns the list of ids which failed to be scraped.
         """
-        # flatten
-        ids = np.array(ids).flatten()
-        # remove "" elements (they represent empty clusters)
-        ids = [id_ for id_ in ids if id_ != ""]
-        ids_to_scrape = self.choose_which_video_to_skip(ids, skip_if_fresher_than)
+        # "" elements represent empty clusters
+        ids = (id_ for id_ in _flatten_ids(ids) if id_ != "")
+        num_of_requested = 0
+        num_of_skipped = 0
+
+        generation = self.generation
+        # ids waiting to be submitted, with the number of their previous attempts
+        pending = deque()
+        # (time when it can be retried, id, attempt) of the ids which failed to be fetched
+        retries = []
+        in_flight = dict()
+        failed_ids = []
+        progress_bar = tqdm(total=0, ncols=80, smoothing=0.05, disable=non_verbose)
+        ids_exhausted = False
+        while not ids_exhausted or pending or retries or in_flight:
+            if generation != self.generation:
+                # the tasks have been cancelled
+                ids_exhausted = True
+                pending.clear()
+                retries.clear()
+
+            # read more ids only when there is space in the window
+            num_of_new_ids = 0
+            while not ids_exhausted and (
+                len(pending) + len(retries) + len(in_flight) < Config.scraping_window
+            ):
+                id_ = next(ids, None)
+                if id_ is None:
+                    ids_exhausted = True
+                    break
+                num_of_requested += 1
+                if self.should_skip(id_, skip_if_fresher_than):
+                    num_of_skipped += 1
+                    continue
+                pending.append((id_, 0))
+                num_of_new_ids += 1
+            if num_of_new_ids:
+                progress_bar.total += num_of_new_ids
+                progress_bar.refresh()
+            if not (pending or retries or in_flight):
+                continue
+
+            while retries and retries[0][0] <= time():
+                _, id_, attempt = heapq.heappop(retries)
+                pending.append((id_, attempt))
+
+            while pending:
+                future = self.fetch_service.try_submit(get_content, pending[0][0])
+                if future is None:
+                    break
+                id_, attempt = pending.popleft()
+                in_flight[future] = (id_, attempt, time())
+                self.futures.add(future)
+
+            if not in_flight:
+                # wait until something can be submitted, other scrapers can be using all the slots
+                next_time = min(
+                    retries[0][0] if retries else float("inf"),
+                    (
+                        max(self.fetch_service.get_paused_until(), time() + 0.1)
+                        if pending
+                        else float("inf")
+                    ),
+                )
+                sleep(min(max(next_time - time(), 0), 1))
+                continue
+
+            done, _ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                # delete this entry, to prevent this dict from eating all the RAM
+                id_, attempt, time_submitted = in_flight.pop(future)
+                self.futures.discard(future)
+                try:
+                    content, id_ = future.result()
+                    self.fetch_service.on_success()
+                    # fetching runs in another process, so it's measured here
+                    fetch_seconds = time() - time_submitted
+                    observe_duration("fetch_page", fetch_seconds)
+                    self.stats.add(
+                        pages_fetched=1,
+                        bytes_fetched=len(content.content),
+                        fetch_seconds=fetch_seconds,
+                    )
+                    scrape_content(
+                        content,
+                        id_,
+                        self.G,
+                        self.driver,
+                        self.search_index,
+                        self.similarity_index,
+                        self.stats,
+                    )
+                except CancelledError:
+                    pass
+                except (FetchError, requests.RequestException) as ex:
+                    self.fetch_service.on_error(throttled=isinstance(ex, ThrottledError))
+                    self.stats.add_error(ex)
+                    if attempt + 1 < Config.fetch_max_attempts:
+                        heapq.heappush(retries, (time() + backoff(attempt), id_, attempt + 1))
+                        self.stats.add(retries=1)
+                        continue
+                    # don't mark it as down, it will be retried in the next scraping
+                    print(f"failed to get content of a video: {id_}, {ex}")
+                    failed_ids.append(id_)
+                    self.stats.add(failed=1)
+                except BrokenProcessPool as ex:
+                    # the fetch service replaces the broken pool, and the video is retried
+                    # in the next scraping, like the other failed ones
+                    print(f"failed to get content of a video: {id_}, {ex}")
+                    failed_ids.append(id_)
+                    self.stats.add_error(ex)
+                    self.stats.add(failed=1)
+                except Exception as ex:
+                    print("failed to get content of a video: %s" % (ex))
+                    failed_ids.append(id_)
+                    self.stats.add_error(ex)
+                    self.stats.add(failed=1)
+                progress_bar.update(1)
+        progress_bar.close()
 
         if not non_verbose:
-            print(f"skipped {len(ids) - len(ids_to_scrape)} videos, to scrape {len(ids_to_scrape)}")
-
-        futures = set()
-        for id_ in ids_to_scrape:
-            future = self.executor.submit(get_content, id_)
-            futures.add(future)
-        self.futures = futures.copy()
-
-        for future in tqdm(
-            as_completed(futures),
-            total=len(ids_to_scrape),
-            ncols=80,
-            smoothing=0.05,
-            disable=non_verbose,
-        ):
-            try:
-                content, id_ = future.result()
-                # print(future)
-                scrape_content(content, id_, self.G, self.driver)
-            except CancelledError:
-                pass
-            except Exception as ex:
-                print("failed to get content of a video: %s" % (ex))
-
-            # delete this entry, to prevent this list from eating all the RAM
-            futures.remove(future)
-            try:
-                self.futures.remove(future)
-            except KeyError:
-                # some other thread could have changed self.futures
-                pass
+            num_of_scraped = num_of_requested - num_of_skipped - len(failed_ids)
+            print(
+                f"skipped {num_of_skipped} videos, scraped {num_of_scraped}, failed {len(failed_ids)}"
+            )
+        self.stats.add(requested=num_of_requested, skipped=num_of_skipped)
+        return failed_ids
 
     def cancel_all_tasks(self):
+        # stop submitting new tasks
+        self.generation += 1
         # it is a copy, because self.futures can be changexd by other thread while this loop runs
         for future in self.futures.copy():
             future.cancel()
@@ -338,25 +717,89 @@ def only_added_in_last_n_years(ids_to_add, times_added, n=5):
     return filtered_ids_to_add, filtered_times_to_add
 
 
-def scrape_playlist(
-    username, playlist_name, driver, scrape_from_last_n_years, skip_if_fresher_than
-):
-    ids_to_add, times_added = get_youtube_playlist_ids(playlist_name, username)
-    ids_to_add, times_added = only_added_in_last_n_years(
-        ids_to_add, times_added, n=scrape_from_last_n_years
-    )
+def get_new_playlist_rows(username, scrape_from_last_n_years, manifest, importance):
+    """Returns a dict from playlist name to the rows of this playlist not in the ingest manifest.
+
+    Rows are tuples: (playlist_name, video_id, time_added)
+    Importance of all the videos in user's playlists is added to the importance dict.
+    """
+    seconds_in_year = 60 * 60 * 24 * 365
+    start_time = time()
+    new_rows = dict()
+    for playlist_name in get_playlist_names(username):
+        ids_to_add, times_added = get_youtube_playlist_ids(playlist_name, username)
+        ids_to_add, times_added = only_added_in_last_n_years(
+            ids_to_add, times_added, n=scrape_from_last_n_years
+        )
+        new_rows[playlist_name] = [
+            (playlist_name, id_, time_added)
+            for id_, time_added in zip(ids_to_add, times_added)
+            if (playlist_name, id_, time_added) not in manifest["rows"]
+        ]
+        for id_, time_added in zip(ids_to_add, times_added):
+            # each occurrence in some playlist counts, and the recently added ones count more
+            age_in_years = max(start_time - time_added, 0) / seconds_in_year
+            importance[id_] = importance.get(id_, 0) + 1 / (1 + age_in_years)
+    return new_rows
+
+
+def schedule_refresh(importance, time_checked, min_age, budget):
+    """Chooses which videos to scrape in this run, in the order they should be scraped.
+
+    Videos never checked go first. The rest are ordered by their staleness times importance,
+    and the ones checked more recently than min_age seconds ago are skipped.
+    At most budget videos are chosen, or all of them if budget is None.
+    """
+    start_time = time()
+
+    def priority(id_):
+        if id_ not in time_checked:
+            return (1, importance[id_])
+        return (0, (start_time - time_checked[id_]) * importance[id_])
+
+    candidates = [
+        id_ for id_ in importance if start_time - time_checked.get(id_, -float("inf")) >= min_age
+    ]
+    if budget is None:
+        return sorted(candidates, key=priority, reverse=True)
+    return heapq.nlargest(budget, candidates, key=priority)
 
-    with Scraper(driver=driver, G=None) as scraper:
-        scraper.scrape_from_list(ids_to_add, skip_if_fresher_than=skip_if_fresher_than)
 
+def save_playlist_rows(username, playlist_name, rows, driver, manifest, deferred_ids):
     with driver.session() as s:
         # ensure that this playlist exists in database
         s.write_transaction(ensure_playlist_exists, username, playlist_name)
         # add data about the time they were added and from which playlist and user
-        for video_id, time_added in zip(ids_to_add, times_added):
-            s.write_transaction(
-                add_info_that_video_is_in_playlist, username, playlist_name, video_id, time_added
-            )
+        for row in rows:
+            _, video_id, _ = row
+            if video_id in deferred_ids:
+                # the video may be missing in the database, so try again in the next run
+                continue
+            s.write_transaction(add_info_that_video_is_in_playlist, username, *row)
+            manifest["rows"].add(row)
+
+
+def scrape_in_batches(scraper, ids, skip_if_fresher_than, scraping_state):
+    """Scrapes ids in batches, saving progress to the scraping state after each batch.
+
+    Returns the set of ids which failed to be scraped.
+    """
+    time_checked = scraping_state["time_checked"]
+    failed_ids = set()
+    batch_size = Config.scraping_checkpoint_interval
+    for batch_start in range(0, len(ids), batch_size):
+        batch = ids[batch_start : batch_start + batch_size]
+        print(f"\nscraping videos {batch_start}-{batch_start + len(batch)} of {len(ids)}")
+        start_time = time()
+        batch_failed_ids = scraper.scrape_from_list(
+            batch, skip_if_fresher_than=skip_if_fresher_than
+        )
+        failed_ids.update(batch_failed_ids)
+        for id_ in set(batch).difference(batch_failed_ids):
+            time_checked[id_] = start_time
+        # checkpoint, so that an interrupted run resumes from here
+        save_scraping_state(scraping_state)
+    return failed_ids
 
 
 #######################################################################################
@@ -366,21 +809,57 @@ def scrape_playlist(
 def scrape_all_playlists(
     scrape_from_last_n_years=None, skip_if_fresher_than=None, save_watched_data_to_db=False
 ):
+    """Scrapes the videos from playlists of all users, and saves which videos are in which playlist.
+
+    Videos from all users are merged, so a video is scraped once, even if many users have it.
+    Only videos not checked for longer than skip_if_fresher_than are scraped,
+    so a run that was interrupted will resume where it stopped.
+    At most Config.periodic_scraping_budget videos are scraped in one run, the stalest and most
+    important first, so that the load is spread over many runs.
+    A JSON report of the run, with its throughput and errors, is saved to data/scrape_reports.
+    """
     if scrape_from_last_n_years is None:
         scrape_from_last_n_years = Config.scrape_playlist_items_from_last_n_years
     if skip_if_fresher_than is None:
         skip_if_fresher_than = Config.periodic_scraping_skip_if_fresher_than
 
-    driver = GraphDatabase.driver("neo4j://neo4j:7687", auth=("neo4j", Config.neo4j_password))
+    driver = get_driver()
 
+    # find what needs to be done for all the users
+    manifests = dict()
+    new_rows = dict()
+    importance = dict()
     for username in get_usernames():
-        print(f"\n\nSCRAPING USER: {username}")
-        for playlist_name in get_playlist_names(username):
-            print()
-            print("scraping: ", playlist_name)
-            scrape_playlist(
-                username, playlist_name, driver, scrape_from_last_n_years, skip_if_fresher_than
-            )
+        manifests[username] = load_ingest_manifest(username)
+        new_rows[username] = get_new_playlist_rows(
+            username, scrape_from_last_n_years, manifests[username], importance
+        )
+
+    scraping_state = load_scraping_state()
+    time_checked = scraping_state["time_checked"]
+    ids_to_scrape = schedule_refresh(
+        importance, time_checked, skip_if_fresher_than, Config.periodic_scraping_budget
+    )
+    print(f"videos in playlists: {len(importance)}, to check: {len(ids_to_scrape)}")
+
+    # one scraper is used for all the users
+    stats = ScrapeStats()
+    with Scraper(
+        driver=driver,
+        G=None,
+        search_index=get_search_index(),
+        similarity_index=get_similarity_index(),
+        stats=stats,
+    ) as scraper:
+        failed_ids = scrape_in_batches(scraper, ids_to_scrape, skip_if_fresher_than, scraping_state)
+    # videos which were never scraped, because they didn't fit in the budget, are also deferred
+    deferred_ids = failed_ids.union(id_ for id_ in importance if id_ not in time_checked)
+
+    for username, manifest in manifests.items():
+        print(f"\n\nSAVING PLAYLISTS OF USER: {username}")
+        for playlist_name, rows in new_rows[username].items():
+            save_playlist_rows(username, playlist_name, rows, driver, manifest, deferred_ids)
+        save_ingest_manifest(username, manifest)
 
         if save_watched_data_to_db:
             # also add information, which videos have been watched
@@ -395,6 +874,17 @@ def scrape_all_playlists(
                 for video_id, watched_times in id_to_watched_times.items():
                     s.write_transaction(add_watched_times, username, video_id, watched_times)
     print(f"\n\nSCRAPING FINISHED")
+    print(f"neo4j connection pool: {driver.get_stats()}")
+    stats.finish()
+    report = stats.to_dict()
+    report["neo4j_pool"] = driver.get_stats()
+    report_path = save_scrape_report(report)
+    fetch = report["fetch"]
+    print(
+        f"scraped {report['videos']['scraped']} videos in {report['duration_seconds']:.0f} s, "
+        f"{fetch['pages_per_second']:.2f} pages/s, {fetch['bytes']} bytes, "
+        f"report saved to: {report_path}"
+    )
 
 
 # def scrape_watched(username="default"):
@@ -416,32 +906,34 @@ def scrape_all_playlists(
 
 
 def scrape_transcripts_from_watched_videos(username="default"):
-    # note that already scraped videos won't be skipped
-    # as is the case with other scraping functions
-    # also no saving db in case of some failure
+    """Fetches transcripts of the watched videos, skipping the ones already fetched.
+
+    Each transcript is saved as soon as it's fetched, so an interrupted run loses nothing.
+    """
     id_to_watched_times = get_youtube_watched_ids(username)
     # note: it looks that in watched videos, there are only stored watches from the last 5 years
-    ids = id_to_watched_times.keys()
-
-    transcripts_db = get_transcripts_db()
 
-    with ProcessPoolExecutor(max_workers=8) as executor:
-        future_to_id = {executor.submit(get_transript, id_): id_ for id_ in ids}
-        for future in tqdm(
-            as_completed(future_to_id),
-            total=len(ids),
-            ncols=80,
-            smoothing=0.05,
-        ):
-            id_ = future_to_id[future]
-            try:
-                transcript = future.result()
-            except Exception as ex:
-                print("thread generated an exception: %s" % (ex))
-                continue
-            transcripts_db[id_] = transcript
-
-            # delete this dict entry, to prevent this dict from eating all the RAM
-            del future_to_id[future]
-
-    transcripts_db.dump()
+    search_index = get_search_index()
+    with get_transcripts_db() as transcripts_db:
+        fetched_ids = transcripts_db.fetched_ids()
+        ids = [id_ for id_ in id_to_watched_times if id_ not in fetched_ids]
+        print(f"already fetched {len(fetched_ids)} transcripts, to fetch {len(ids)}")
+
+        # fetching is IO bound, so threads are enough
+        with ThreadPoolExecutor(max_workers=Config.transcript_fetch_workers) as executor:
+            future_to_id = {executor.submit(get_transript, id_): id_ for id_ in ids}
+            for future in tqdm(
+                as_completed(future_to_id),
+                total=len(ids),
+                ncols=80,
+                smoothing=0.05,
+            ):
+                # delete this dict entry, to prevent this dict from eating all the RAM
+                id_ = future_to_id.pop(future)
+                try:
+                    transcript = future.result()
+                except Exception as ex:
+                    print("thread generated an exception: %s" % (ex))
+                    continue
+                transcripts_db[id_] = transcript
+                search_index.add_transcript(id_, transcript)
@@ -0,0 +1,207 @@
+import functools
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from yourtube.file_operations import get_transcripts_db, search_index_path
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+# matches in titles are the most relevant, and in transcripts the least
+column_weights = (10.0, 5.0, 1.0)
+
+search_token_regex = re.compile(r"\w+")
+
+
+def transcript_to_text(transcript):
+    if transcript is None:
+        return ""
+    return " ".join(entry["text"] for entry in transcript)
+
+
+def query_to_fts(query):
+    """Converts user's query into an FTS5 query, matching all the words.
+
+    Words aren't matched as prefixes, because expanding a prefix of a common word is slow.
+    """
+    tokens = search_token_regex.findall(query)
+    if tokens == []:
+        return None
+    # quoting makes FTS5 syntax like AND or NEAR in the user's query harmless
+    return " ".join(f'"{token}"' for token in tokens)
+
+
+class SearchIndex:
+    """Full-text index of titles, keywords and transcripts of videos, stored in SQLite FTS5.
+
+    It can be shared between threads, writes are serialized with a lock.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = search_index_path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            # FTS5 rows can be found efficiently only by their rowid, so keep a rowid for each id
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id INTEGER PRIMARY KEY,
+                    video_id TEXT NOT NULL UNIQUE,
+                    has_title INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+                    title, keywords, transcript, tokenize = 'unicode61 remove_diacritics 2'
+                )
+                """
+            )
+            # rank is computed by bm25 with these column weights
+            self.conn.execute(
+                "INSERT INTO videos_fts (videos_fts, rank) VALUES ('rank', ?)",
+                ("bm25({}, {}, {})".format(*column_weights),),
+            )
+            # user_version marks that the transcripts fetched before the index existed were added
+            (index_version,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if index_version == 0:
+            self._import_transcripts()
+            with self.lock, self.conn:
+                self.conn.execute("PRAGMA user_version = 1")
+
+    def _import_transcripts(self):
+        with get_transcripts_db() as transcripts_db:
+            ids = transcripts_db.fetched_ids()
+            logger.info(f"adding {len(ids)} transcripts to the search index")
+            with self.lock, self.conn:
+                for id_ in ids:
+                    self._update(id_, transcript=transcript_to_text(transcripts_db[id_]))
+
+    def _update(self, id_, **columns):
+        """Sets the given columns of this video, keeping the other ones.
+
+        It must be called inside a transaction, with the lock held.
+        """
+        self.conn.execute("INSERT OR IGNORE INTO documents (video_id) VALUES (?)", (id_,))
+        (doc_id,) = self.conn.execute(
+            "SELECT doc_id FROM documents WHERE video_id = ?", (id_,)
+        ).fetchone()
+        row = self.conn.execute(
+            "SELECT title, keywords, transcript FROM videos_fts WHERE rowid = ?", (doc_id,)
+        ).fetchone()
+        values = dict(zip(["title", "keywords", "transcript"], row or ("", "", "")))
+        values.update(columns)
+        self.conn.execute("DELETE FROM videos_fts WHERE rowid = ?", (doc_id,))
+        self.conn.execute(
+            "INSERT INTO videos_fts (rowid, title, keywords, transcript) VALUES (?, ?, ?, ?)",
+            (doc_id, values["title"], values["keywords"], values["transcript"]),
+        )
+        if "title" in columns:
+            self.conn.execute("UPDATE documents SET has_title = 1 WHERE doc_id = ?", (doc_id,))
+
+    def add_video(self, id_, title, keywords):
+        with self.lock, self.conn:
+            self._update(id_, title=title, keywords=" ".join(keywords))
+
+    def add_videos_from_nodes(self, nodes):
+        """Adds titles and keywords of the scraped videos, which aren't in the index yet.
+
+        Nodes are (video_id, data) pairs, like list(G.nodes(data=True)). The list must be a
+        snapshot, because the graph can be changed by the scraper while they are added.
+        """
+        with self.lock:
+            has_title = dict(self.conn.execute("SELECT video_id, has_title FROM documents"))
+            rows = [
+                (id_, data["title"], " ".join(data.get("keywords", [])))
+                for id_, data in nodes
+                if not has_title.get(id_, False) and "title" in data
+            ]
+            if rows == []:
+                return
+            logger.info(f"adding {len(rows)} videos to the search index")
+            # videos which aren't indexed at all can be inserted in bulk
+            new_rows = [row for row in rows if row[0] not in has_title]
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO documents (video_id, has_title) VALUES (?, 1)",
+                    ((id_,) for id_, _, _ in new_rows),
+                )
+                self.conn.executemany(
+                    """
+                    INSERT INTO videos_fts (rowid, title, keywords, transcript)
+                    VALUES ((SELECT doc_id FROM documents WHERE video_id = ?), ?, ?, '')
+                    """,
+                    new_rows,
+                )
+                # the ones with only a transcript indexed must keep it
+                for id_, title, keywords in rows:
+                    if id_ in has_title:
+                        self._update(id_, title=title, keywords=keywords)
+
+    def add_transcript(self, id_, transcript):
+        with self.lock, self.conn:
+            self._update(id_, transcript=transcript_to_text(transcript))
+
+    def search(self, query, limit=50, video_ids=None):
+        """Returns ids of the videos matching all the words of the query, the best matches first.
+
+        If video_ids is given, only these videos are returned, e.g. the ones in a user's tree.
+        It can be any container of ids, but checking a set or a dict is the fastest.
+
+        Ranking all the matches of a very common word would take too long, so the matches are
+        read in pages, in the order they were indexed, and only the ones read are ranked.
+        Reading stops when there are enough results, or after Config.search_max_candidates.
+        """
+        fts_query = query_to_fts(query)
+        if fts_query is None:
+            return []
+        results = []
+        last_doc_id = 0
+        num_of_candidates = 0
+        while num_of_candidates < Config.search_max_candidates and len(results) < limit:
+            page = self.conn.execute(
+                """
+                SELECT videos_fts.rowid, documents.video_id, videos_fts.rank
+                FROM videos_fts JOIN documents ON documents.doc_id = videos_fts.rowid
+                WHERE videos_fts MATCH ? AND videos_fts.rowid > ?
+                ORDER BY videos_fts.rowid
+                LIMIT ?
+                """,
+                (fts_query, last_doc_id, Config.search_page_size),
+            ).fetchall()
+            results += [
+                (rank, video_id)
+                for _, video_id, rank in page
+                if video_ids is None or video_id in video_ids
+            ]
+            num_of_candidates += len(page)
+            if len(page) < Config.search_page_size:
+                # there are no more matches
+                break
+            last_doc_id = page[-1][0]
+        results.sort()
+        return [video_id for _, video_id in results[:limit]]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_index():
+    """Returns the search index shared by the whole process."""
+    return SearchIndex()
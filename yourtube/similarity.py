@@ -0,0 +1,251 @@
+import fcntl
+import functools
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from yourtube.file_operations import similarity_ids_path, similarity_vectors_path
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+token_regex = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=2**20)
+def get_token_projection(token):
+    """Returns the dimensions and signs to which this token is projected.
+
+    Each token is hashed into a few random dimensions with random signs, which is a sparse
+    random projection of the bag of words, so the similarity of vectors approximates the
+    similarity of the bags of words, without storing any vocabulary.
+    """
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    rng = np.random.default_rng(int.from_bytes(digest, "little"))
+    dims = rng.choice(Config.similarity_dimensions, Config.similarity_hashes_per_token, False)
+    signs = rng.choice(np.array([-1, 1], dtype=np.float32), Config.similarity_hashes_per_token)
+    return dims, signs
+
+
+def vectorize_many(rows):
+    """Turns titles and keywords into normalized dense vectors, one row for each video.
+
+    Rows are tuples: (video_id, title, keywords)
+    """
+    token_to_index = dict()
+    row_indexes = []
+    token_indexes = []
+    token_weights = []
+    for row_index, (_, title, keywords) in enumerate(rows):
+        weights = Counter(token_regex.findall(title.lower()))
+        for keyword in keywords:
+            for token in token_regex.findall(keyword.lower()):
+                weights[token] += Config.similarity_keyword_weight
+        for token, weight in weights.items():
+            row_indexes.append(row_index)
+            token_indexes.append(token_to_index.setdefault(token, len(token_to_index)))
+            # sublinear term frequency, so that repeated words don't dominate
+            token_weights.append(1 + math.log(weight) if weight > 1 else weight)
+
+    vectors = np.zeros((len(rows), Config.similarity_dimensions), dtype=np.float32)
+    if token_to_index != dict():
+        projections = [get_token_projection(token) for token in token_to_index]
+        token_dims = np.array([dims for dims, _ in projections])[token_indexes]
+        token_signs = np.array([signs for _, signs in projections])[token_indexes]
+        values = token_signs * np.array(token_weights, dtype=np.float32)[:, None]
+        row_indexes = np.repeat(row_indexes, Config.similarity_hashes_per_token)
+        # add.at, because dimensions of different tokens can collide
+        np.add.at(vectors, (row_indexes, token_dims.ravel()), values.ravel())
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def vectorize(title, keywords):
+    """Turns a title and keywords into a normalized dense vector."""
+    return vectorize_many([(None, title, keywords)])[0]
+
+
+class SimilarityIndex:
+    """Vectors of titles and keywords of videos, for finding similar videos.
+
+    Vectors are appended to a memory-mapped file, and their ids to a text file, one per line.
+    Searching is brute force, over the vectors of the given candidates.
+    Many processes can append to the same files, e.g. the server and the scraping job,
+    and each reads the rows appended by the others before its own append.
+    """
+
+    def __init__(self, ids_path=None, vectors_path=None):
+        self.ids_path = str(ids_path or similarity_ids_path)
+        self.vectors_path = str(vectors_path or similarity_vectors_path)
+        # the scraping process and the server append to the same files, so appends are
+        # serialized between processes by locking this file
+        self.lock_path = self.ids_path + ".lock"
+        Path(self.ids_path).parent.mkdir(parents=True, exist_ok=True)
+        self.row_size = Config.similarity_dimensions * np.dtype(np.float32).itemsize
+        self.lock = threading.Lock()
+
+        self.num_of_rows = 0
+        self.row_to_id = []
+        self.id_to_row = dict()
+        # bytes of the ids file already read
+        self._ids_offset = 0
+        self._vectors = None
+        with self.lock, self._file_lock():
+            self._read_appended_rows()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read_appended_rows(self):
+        """Reads the rows appended by other processes, and repairs an interrupted append.
+
+        It must be called with both locks held.
+        """
+        appended = b""
+        if os.path.isfile(self.ids_path):
+            with open(self.ids_path, "rb") as file:
+                file.seek(self._ids_offset)
+                appended = file.read()
+        vectors_size = 0
+        if os.path.isfile(self.vectors_path):
+            vectors_size = os.path.getsize(self.vectors_path)
+
+        # the last line is partial, or empty if the file ends with a newline
+        lines = appended.split(b"\n")[:-1]
+        # vectors are written first, so an interrupted append can leave vectors without ids
+        num_of_rows = min(self.num_of_rows + len(lines), vectors_size // self.row_size)
+        lines = lines[: num_of_rows - self.num_of_rows]
+        ids_offset = self._ids_offset + sum(len(line) + 1 for line in lines)
+        if ids_offset != self._ids_offset + len(appended) or vectors_size != (
+            num_of_rows * self.row_size
+        ):
+            logger.warning(f"repairing similarity index, keeping {num_of_rows} vectors")
+            with open(self.ids_path, "ab") as file:
+                file.truncate(ids_offset)
+            with open(self.vectors_path, "ab") as file:
+                file.truncate(num_of_rows * self.row_size)
+
+        for line in lines:
+            id_ = line.decode("utf-8")
+            self.id_to_row[id_] = self.num_of_rows
+            self.row_to_id.append(id_)
+            self.num_of_rows += 1
+        self._ids_offset = ids_offset
+
+    def get_vectors(self):
+        """Returns the memory-mapped vectors, remapping them if some were appended."""
+        with self.lock:
+            if self._vectors is None or len(self._vectors) != self.num_of_rows:
+                if self.num_of_rows == 0:
+                    return np.zeros((0, Config.similarity_dimensions), dtype=np.float32)
+                self._vectors = np.memmap(
+                    self.vectors_path,
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(self.num_of_rows, Config.similarity_dimensions),
+                )
+            return self._vectors
+
+    def add_videos(self, rows):
+        """Adds videos which aren't in the index yet.
+
+        Rows are tuples: (video_id, title, keywords)
+        """
+        rows = [row for row in rows if row[0] not in self.id_to_row]
+        if rows == []:
+            return
+        vectors = vectorize_many(rows)
+        with self.lock, self._file_lock():
+            # rows appended by other processes must be read, so that the new rows are numbered
+            # after them, and other threads or processes could add some of these videos
+            # while they were vectorized, so they are filtered again before the append
+            self._read_appended_rows()
+            new_ids = set()
+            is_new = []
+            for id_, _, _ in rows:
+                is_new.append(id_ not in self.id_to_row and id_ not in new_ids)
+                new_ids.add(id_)
+            rows = [row for row, new in zip(rows, is_new) if new]
+            if rows == []:
+                return
+            vectors = vectors[is_new]
+            # vectors are written first, so that an interrupted append is repaired on loading
+            with open(self.vectors_path, "ab") as file:
+                file.write(vectors.tobytes())
+            ids_data = "".join(id_ + "\n" for id_, _, _ in rows).encode("utf-8")
+            with open(self.ids_path, "ab") as file:
+                file.write(ids_data)
+            self._ids_offset += len(ids_data)
+            for id_, _, _ in rows:
+                self.id_to_row[id_] = self.num_of_rows
+                self.row_to_id.append(id_)
+                self.num_of_rows += 1
+
+    def add_video(self, id_, title, keywords):
+        self.add_videos([(id_, title, keywords)])
+
+    def add_videos_from_nodes(self, nodes, chunk_size=10_000):
+        """Adds the scraped videos, which aren't in the index yet.
+
+        Nodes are (video_id, data) pairs, like list(G.nodes(data=True)). The list must be a
+        snapshot, because the graph can be changed by the scraper while they are added.
+        """
+        rows = [
+            (id_, data["title"], data.get("keywords", []))
+            for id_, data in nodes
+            if id_ not in self.id_to_row and "title" in data
+        ]
+        if rows == []:
+            return
+        logger.info(f"adding {len(rows)} videos to the similarity index")
+        # in chunks, so that the progress isn't lost if it's interrupted
+        for chunk_start in range(0, len(rows), chunk_size):
+            self.add_videos(rows[chunk_start : chunk_start + chunk_size])
+
+    def most_similar(self, id_, candidate_ids, n):
+        """Returns up to n ids of candidates most similar to id_, the most similar first.
+
+        Returns None if id_ isn't in the index.
+        """
+        if id_ not in self.id_to_row:
+            return None
+        # the row is looked up before mapping the vectors, so that they already include it
+        id_row = self.id_to_row[id_]
+        vectors = self.get_vectors()
+        if id_row >= len(vectors):
+            return []
+        candidate_rows = np.fromiter(
+            (self.id_to_row.get(candidate, -1) for candidate in candidate_ids), dtype=np.int64
+        )
+        # unique also sorts them, and reading the rows in order is faster on a memory-mapped file
+        candidate_rows = np.unique(
+            candidate_rows[(candidate_rows >= 0) & (candidate_rows != id_row)]
+        )
+        # rows appended by other threads after getting the vectors can't be used yet
+        candidate_rows = candidate_rows[candidate_rows < len(vectors)]
+        if len(candidate_rows) == 0:
+            return []
+        similarities = vectors[candidate_rows] @ vectors[id_row]
+        n = min(n, len(candidate_rows))
+        best = np.argpartition(-similarities, n - 1)[:n]
+        best = best[np.argsort(-similarities[best])]
+        return [self.row_to_id[row] for row in candidate_rows[best]]
+
+
+@functools.lru_cache(maxsize=None)
+def get_similarity_index():
+    """Returns the similarity index shared by the whole process."""
+    return SimilarityIndex()
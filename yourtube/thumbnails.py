@@ -0,0 +1,120 @@
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from yourtube.file_operations import thumbnails_path
+from yourtube.metrics import count_cache_request
+from yourtube.config import Config
+
+logger = logging.getLogger("yourtube")
+logger.setLevel(logging.DEBUG)
+
+id_to_thumbnail = "https://i.ytimg.com/vi/{}/mqdefault.jpg"
+# id_to_thumbnail = "https://i.ytimg.com/vi/{}/maxresdefault.jpg"
+# hq and sd usually has black stripes
+# mq < hq < sd < maxres
+
+# thumbnails_path is served by the app under this route, see yourtube.run
+thumbnails_route = "thumbnails"
+id_to_local_thumbnail = "/" + thumbnails_route + "/{}.jpg"
+
+
+class ThumbnailCache:
+    """Thumbnails downloaded from YouTube, stored on disk, with the least recently used evicted.
+
+    Modification time of a file is its last use time.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or thumbnails_path
+        self.max_bytes = max_bytes or Config.thumbnail_cache_max_bytes
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=Config.thumbnail_fetch_workers)
+        # ids being downloaded, so that they aren't downloaded twice
+        self.pending = set()
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.path))
+
+    def get_file_path(self, id_):
+        return os.path.join(self.path, f"{id_}.jpg")
+
+    def get_url(self, id_):
+        """Returns the url of the cached thumbnail, or the YouTube url if it isn't cached."""
+        file_path = self.get_file_path(id_)
+        try:
+            # mark it as recently used
+            os.utime(file_path)
+        except FileNotFoundError:
+            count_cache_request("thumbnail", hit=False)
+            return id_to_thumbnail.format(id_)
+        count_cache_request("thumbnail", hit=True)
+        return id_to_local_thumbnail.format(id_)
+
+    def prefetch(self, ids):
+        """Downloads the missing thumbnails in the background. Ids can contain "" elements."""
+        for id_ in ids:
+            if id_ == "":
+                continue
+            with self.lock:
+                if id_ in self.pending:
+                    continue
+                self.pending.add(id_)
+            self.executor.submit(self._fetch, id_)
+
+    def _fetch(self, id_):
+        try:
+            file_path = self.get_file_path(id_)
+            if os.path.isfile(file_path):
+                os.utime(file_path)
+                return
+            response = requests.get(id_to_thumbnail.format(id_), timeout=Config.fetch_timeout)
+            if response.status_code != 200:
+                # the browser will try YouTube itself
+                return
+            # write to a temporary file first, so that a partial thumbnail is never served
+            tmp_path = file_path + ".partial"
+            with open(tmp_path, "wb") as file:
+                file.write(response.content)
+            os.replace(tmp_path, file_path)
+            with self.lock:
+                self.total_bytes += len(response.content)
+                evict = self.total_bytes > self.max_bytes
+            if evict:
+                self.evict()
+        except Exception as ex:
+            logger.warning(f"failed to fetch thumbnail of {id_}: {ex}")
+        finally:
+            with self.lock:
+                self.pending.discard(id_)
+
+    def evict(self):
+        """Deletes the least recently used thumbnails, until the cache uses 90% of max_bytes."""
+        files = []
+        for entry in os.scandir(self.path):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total_bytes = sum(size for _, size, _ in files)
+        target_bytes = 0.9 * self.max_bytes
+        for _, size, file_path in files:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        with self.lock:
+            self.total_bytes = total_bytes
+        logger.info(f"evicted thumbnails, cache size: {total_bytes / 2**20:.1f} MB")
+
+
+@functools.lru_cache(maxsize=None)
+def get_thumbnail_cache():
+    """Returns the thumbnail cache shared by the whole process."""
+    return ThumbnailCache()